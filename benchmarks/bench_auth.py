@@ -0,0 +1,107 @@
+"""
+WebSocket handshake throughput in a reconnect storm: --clients logged-in
+clients, each with its own session, all reconnect at once --rounds times
+(the first round is the deploy, later ones flaky networks). Compares
+channels' AuthMiddlewareStack, which reads the session and the user row on
+every handshake, with chat.auth.CachedAuthMiddlewareStack. The consumer
+only accepts, so the numbers are the cost of the auth stack itself.
+
+SQLite serializes everything, so the gap is larger against the production
+database with real network round trips:
+
+    DATABASE_URL=postgres://... python benchmarks/bench_auth.py --clients 100 1000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import percentile, setup_django
+
+
+def make_sessions(count):
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.models import User
+    from django.contrib.sessions.backends.db import SessionStore
+
+    User.objects.bulk_create(User(username=f'bench_auth_{i}') for i in range(count))
+    cookies = []
+    for user in User.objects.filter(username__startswith='bench_auth_')[:count]:
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        cookies.append(f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode())
+    return cookies
+
+
+async def storm(app, cookies):
+    from channels.testing import WebsocketCommunicator
+
+    latencies = []
+
+    async def handshake(cookie):
+        communicator = WebsocketCommunicator(app, '/ws/chat/lobby/', headers=[(b'cookie', cookie)])
+        start = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=60)
+        latencies.append(time.perf_counter() - start)
+        assert connected
+        await communicator.disconnect()
+
+    await asyncio.gather(*(handshake(cookie) for cookie in cookies))
+    return latencies
+
+
+async def run(mode, cookies, rounds):
+    from channels.auth import AuthMiddlewareStack
+    from channels.generic.websocket import AsyncWebsocketConsumer
+    from chat.auth import CachedAuthMiddlewareStack, sessions
+    from chat.metrics import AUTH_CACHE
+
+    class Accept(AsyncWebsocketConsumer):
+        async def connect(self):
+            assert self.scope['user'].is_authenticated
+            await self.accept()
+
+    stack = AuthMiddlewareStack if mode == 'plain' else CachedAuthMiddlewareStack
+    app = stack(Accept.as_asgi())
+    sessions.clear()
+    AUTH_CACHE.values.clear()
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        latencies += await storm(app, cookies)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'clients': len(cookies),
+        'mode': mode,
+        'handshakes_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+    if mode == 'cached':
+        hits = sum(value for key, value in AUTH_CACHE.values.items() if ('result', 'hit') in key)
+        result['cache_hit_ratio'] = round(hits / len(latencies), 3)
+    return result
+
+
+async def main(args):
+    from channels.db import database_sync_to_async
+
+    cookies = await database_sync_to_async(make_sessions)(max(args.clients))
+    for count in args.clients:
+        for mode in ('plain', 'cached'):
+            print(json.dumps(await run(mode, cookies[:count], args.rounds)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--rounds', type=int, default=5, help='reconnects per client')
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(main(args))
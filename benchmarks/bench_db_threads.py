@@ -0,0 +1,81 @@
+"""
+Throughput and latency of ChatConsumer.save_message with N senders saving
+at once, on asgiref's single shared database thread (CHAT_DB_THREADS=0)
+versus a dedicated pool of --threads threads.
+
+SQLite serializes writers whatever the pool size, so run against the
+production database for numbers that mean anything:
+
+    DATABASE_URL=postgres://... python benchmarks/bench_db_threads.py --senders 50 500 5000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import percentile, setup_django
+
+
+def make_senders(users, room):
+    from chat.consumers import ChatConsumer
+    from chat.inbox import get_inbox_writer, room_members
+
+    senders = []
+    for user in users:
+        consumer = ChatConsumer()
+        consumer.room_name = room
+        consumer.room_pk = None
+        consumer.user = user
+        consumer.user_id = user.id
+        consumer.inbox = get_inbox_writer()
+        consumer.inbox_members = room_members(None, user.id)
+        senders.append(consumer)
+    return senders
+
+
+async def run(threads, senders, messages):
+    from django.test import override_settings
+
+    latencies = []
+
+    async def send_all(consumer):
+        for i in range(messages):
+            start = time.perf_counter()
+            await consumer.save_message(f'message {i}')
+            latencies.append(time.perf_counter() - start)
+
+    with override_settings(CHAT_DB_THREADS=threads):
+        start = time.perf_counter()
+        await asyncio.gather(*(send_all(consumer) for consumer in senders))
+        elapsed = time.perf_counter() - start
+
+    return {
+        'senders': len(senders),
+        'db_threads': threads,
+        'messages_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def main(args):
+    from channels.db import database_sync_to_async
+    from django.contrib.auth.models import User
+
+    users = await database_sync_to_async(
+        lambda: User.objects.bulk_create(User(username=f'sender{i}') for i in range(max(args.senders)))
+    )()
+    for count in args.senders:
+        for threads in (0, args.threads):
+            senders = make_senders(users[:count], f'bench_db_{count}_{threads}')
+            print(json.dumps(await run(threads, senders, args.messages)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--senders', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=4, help='messages per sender')
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(main(args))
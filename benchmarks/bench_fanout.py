@@ -0,0 +1,90 @@
+"""
+Per-worker CPU cost of fanning one chat message out to a room's sockets:
+every recipient rebuilding and json.dumps-ing the frame versus forwarding
+a frame the sender encoded once (with ujson, and with the stdlib json for
+comparison). channels_redis serializes a group message once per worker,
+not per socket, so the recipients' handlers are the part that scales.
+
+    python benchmarks/bench_fanout.py --recipients 10 100 1000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import setup_django
+
+
+def legacy_event(i):
+    return {
+        'type': 'chat_message_broadcast',
+        'message': f'message number {i} with a little বাংলা text and a link https://example.com/a/b',
+        'username': 'alice',
+        'timestamp': '10:42 AM',
+        'message_id': 1000 + i,
+        'image_url': None,
+        'audio_url': None,
+    }
+
+
+def frame_event(i):
+    from chat.frames import chat_message_frame, frame_event as encode_frame
+
+    event = legacy_event(i)
+    return encode_frame(chat_message_frame(
+        event['username'], event['timestamp'], event['message_id'], event['message']
+    ))
+
+
+def stdlib_frame_event(i):
+    from chat.frames import FRAME_EVENT, chat_message_frame
+
+    event = legacy_event(i)
+    frame = chat_message_frame(event['username'], event['timestamp'], event['message_id'], event['message'])
+    return {'type': FRAME_EVENT, 'text': json.dumps(frame)}
+
+
+def make_consumers(count):
+    from chat.consumers import ChatConsumer
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        pass
+
+    consumers = []
+    for _ in range(count):
+        consumer = ChatConsumer()
+        consumer.send = send
+        consumers.append(consumer)
+    return consumers
+
+
+async def handler_cost(consumers, build_event, handler_name, messages):
+    start = time.process_time()
+    for i in range(messages):
+        event = build_event(i)
+        for consumer in consumers:
+            await getattr(consumer, handler_name)(event)
+    return (time.process_time() - start) / messages
+
+
+async def main(args):
+    for count in args.recipients:
+        consumers = make_consumers(count)
+        messages = max(10, args.deliveries // count)
+        row = {'recipients': count}
+        for label, build_event, handler in (
+            ('per_recipient_json', legacy_event, 'chat_message_broadcast'),
+            ('pre_encoded_json', stdlib_frame_event, 'chat_frame'),
+            ('pre_encoded_ujson', frame_event, 'chat_frame'),
+        ):
+            row[f'{label}_us'] = round(await handler_cost(consumers, build_event, handler, messages) * 1e6, 1)
+        print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--recipients', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--deliveries', type=int, default=200000, help='approximate deliveries per measurement')
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(main(args))
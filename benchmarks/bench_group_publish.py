@@ -0,0 +1,101 @@
+"""
+Cost of publishing one room event versus room size, for a room spread
+over --workers processes:
+
+    per_socket     every socket is a member of chat_<room> (the default)
+    sharded        sockets spread over CHAT_GROUP_SHARDS sub-groups
+    local_fanout   one relay channel per worker (CHAT_LOCAL_FANOUT)
+
+publish_us is the CPU time of chat.fanout.publish on the in-memory layer,
+which copies the event once per member. channels_redis instead reads the
+group's members from one sorted set and writes one message per worker
+whose ``__asgi_channel__`` lists that worker's member channels, so
+largest_group (members in the biggest group key) and redis_bytes (the
+msgpack payloads it would write, channel names included) are what grow
+with the room there. Handing an event to a worker's sockets is measured
+by bench_fanout.py.
+
+    python benchmarks/bench_group_publish.py --members 100 1000 10000
+"""
+import argparse
+import asyncio
+import collections
+import json
+import time
+import uuid
+
+import msgpack
+
+from common import setup_django
+
+
+def channel_name(worker):
+    # same shape as channels_redis process-specific names
+    return f'specific.worker{worker}!{uuid.uuid4().hex[:12]}'
+
+
+def member_channels(mode, members, workers):
+    if mode == 'local_fanout':
+        return [(worker, f'fanout.worker{worker}!{uuid.uuid4().hex[:12]}') for worker in range(workers)]
+    return [(i % workers, channel_name(i % workers)) for i in range(members)]
+
+
+def redis_bytes(groups, event):
+    """Bytes channels_redis would write for one publish: one payload per worker per group."""
+    total = 0
+    for channels in groups.values():
+        by_worker = collections.defaultdict(list)
+        for worker, name in channels:
+            by_worker[worker].append(name)
+        for names in by_worker.values():
+            total += len(msgpack.packb({**event, '__asgi_channel__': names}))
+    return total
+
+
+async def measure(mode, members, args):
+    from channels.layers import InMemoryChannelLayer
+    from django.test import override_settings
+
+    from chat import fanout
+    from chat.frames import chat_message_frame, frame_event
+
+    shards = args.shards if mode == 'sharded' else 1
+    with override_settings(CHAT_GROUP_SHARDS=shards):
+        layer = InMemoryChannelLayer(capacity=args.messages + 1)
+        groups = collections.defaultdict(list)
+        for worker, name in member_channels(mode, members, args.workers):
+            group = fanout.shard_for('chat_bigroom', name)
+            await layer.group_add(group, name)
+            groups[group].append((worker, name))
+
+        event = frame_event(chat_message_frame('alice', '10:42 AM', 1, 'hello, large room'))
+        start = time.process_time()
+        for _ in range(args.messages):
+            await fanout.publish(layer, 'chat_bigroom', event)
+        elapsed = time.process_time() - start
+
+    return {
+        'members': members,
+        'mode': mode,
+        'group_members': sum(len(channels) for channels in groups.values()),
+        'largest_group': max(len(channels) for channels in groups.values()),
+        'publish_us': round(elapsed / args.messages * 1e6, 1),
+        'redis_bytes': redis_bytes(groups, event),
+    }
+
+
+async def main(args):
+    for members in args.members:
+        for mode in ('per_socket', 'sharded', 'local_fanout'):
+            print(json.dumps(await measure(mode, members, args)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=50)
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(main(args))
@@ -0,0 +1,79 @@
+"""
+History page latency by depth: keyset cursors versus OFFSET pagination
+over a large Message table.
+
+    python benchmarks/bench_history.py --rows 5000000
+"""
+import argparse
+import datetime
+import json
+import time
+
+from common import setup_django
+
+ROOM = 'hot'
+
+
+def seed(rows, user_id):
+    from django.db import connection, transaction
+
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    batch = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(rows):
+            # one busy room plus background traffic in other rooms
+            room = ROOM if i % 10 else f'room{i % 1000}'
+            batch.append((user_id, room, f'message {i}', start + datetime.timedelta(seconds=i), False))
+            if len(batch) == 10000:
+                cursor.executemany(
+                    'INSERT INTO chat_message (user_id, room_name, content, timestamp, is_read) VALUES (%s, %s, %s, %s, %s)',
+                    batch,
+                )
+                batch = []
+        if batch:
+            cursor.executemany(
+                'INSERT INTO chat_message (user_id, room_name, content, timestamp, is_read) VALUES (%s, %s, %s, %s, %s)',
+                batch,
+            )
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 3)
+
+
+def main(args):
+    from django.contrib.auth.models import User
+
+    from chat.history import encode_cursor, fetch_page, room_messages
+    from chat.models import Message
+
+    user = User.objects.create_user('bench')
+    started = time.perf_counter()
+    seed(args.rows, user.id)
+    print(json.dumps({'seeded_rows': args.rows, 'seconds': round(time.perf_counter() - started, 1)}))
+
+    newest_first = Message.objects.filter(room_name=ROOM).order_by('-timestamp', '-id')
+    room_rows = newest_first.count()
+    for fraction in (0, 0.01, 0.1, 0.5, 0.9, 0.99):
+        depth = int(room_rows * fraction)
+        anchor = newest_first[depth]
+        cursor = encode_cursor(anchor)
+        print(json.dumps({
+            'depth': depth,
+            'keyset_ms': timed(lambda: fetch_page(room_messages(ROOM), before=cursor), args.repeat),
+            'offset_ms': timed(lambda: list(room_messages(ROOM).order_by('-timestamp', '-id')[depth:depth + 50]), args.repeat),
+        }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    setup_django()
+    main(args)
@@ -0,0 +1,92 @@
+"""
+A client with --rooms rooms open: one ws/chat/<room>/ socket per room
+versus one ws/mux/ socket subscribed to all of them. Reports the sockets
+and group memberships the worker holds, the Python heap the client's
+connections keep alive (tracemalloc, after connecting), and how many
+sockets the online-status writer counts for the user.
+
+Both run against the in-memory layer in one process; with daphne each
+socket additionally costs its ASGI/Twisted connection state, which the
+heap numbers here leave out.
+
+    python benchmarks/bench_mux.py --rooms 1 5 20
+"""
+import argparse
+import asyncio
+import json
+import tracemalloc
+
+from common import connect, drain, setup_django
+
+
+async def per_room(user, rooms):
+    sockets = []
+    for room in rooms:
+        sockets.append(await connect(user, room))
+    for communicator in sockets:
+        await drain(communicator)
+    return sockets
+
+
+async def multiplexed(user, rooms):
+    from channels.testing import WebsocketCommunicator
+    from chat.multiplex import MultiplexConsumer
+
+    communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/mux/')
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect()
+    assert connected
+    for room in rooms:
+        await communicator.send_json_to({'type': 'subscribe', 'room': room})
+    await drain(communicator)
+    return [communicator]
+
+
+async def measure(mode, user, count):
+    from channels.layers import get_channel_layer
+    from chat.status import get_status_writer
+
+    rooms = [f'bench_mux_{i}' for i in range(count)]
+    layer = get_channel_layer()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sockets = await (per_room if mode == 'per_room' else multiplexed)(user, rooms)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    heap = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    members = sum(len(channels) for name, channels in layer.groups.items() if name.startswith('chat_bench_mux_'))
+    result = {
+        'rooms': count,
+        'mode': mode,
+        'sockets': len(sockets),
+        'group_members': members,
+        'heap_kb': round(heap / 1024, 1),
+        # sockets the online-status writer tracks for the user
+        'status_sockets': get_status_writer().sockets[user.id],
+    }
+    for communicator in sockets:
+        await communicator.disconnect()
+    return result
+
+
+async def main(args):
+    from channels.db import database_sync_to_async
+    from django.contrib.auth.models import User
+
+    user = await database_sync_to_async(User.objects.create_user)('bench_mux', password='pass')
+    # imports and first-use caches would otherwise land in the first measurement
+    await measure('per_room', user, 1)
+    await measure('multiplexed', user, 1)
+    for count in args.rooms:
+        for mode in ('per_room', 'multiplexed'):
+            print(json.dumps(await measure(mode, user, count)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, nargs='+', default=[1, 5, 20])
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(main(args))
@@ -0,0 +1,77 @@
+"""
+Bytes on the wire and encode/decode CPU per event type: the current JSON
+frames against the chat.v1 msgpack and CBOR subprotocols, each with and
+without permessage-deflate (no context takeover, as core.serve negotiates).
+
+    python benchmarks/bench_protocol.py
+"""
+import argparse
+import base64
+import json
+import os
+import timeit
+import zlib
+
+from common import setup_django
+
+
+def sample_frames():
+    from chat.frames import chat_message_frame
+
+    avatar = os.urandom(48 * 1024)
+    return {
+        'chat_message': chat_message_frame('alice', '10:42 AM', 7301234567890123, 'see you at the standup in five minutes?'),
+        'image_message': chat_message_frame(
+            'alice', '10:42 AM', 7301234567890124,
+            image_url='https://res.cloudinary.com/demo/image/upload/v1/media/chat_images/4f1c2a9e.png',
+        ),
+        'typing': {'type': 'typing', 'username': 'alice', 'state': 'start', 'ttl': 6.0},
+        'message_read': {'type': 'message_read', 'message_id': 7301234567890124, 'up_to': 7301234567890124, 'reader': 'bob'},
+        'presence': {'type': 'presence', 'joined': ['carol'], 'left': []},
+        'user_list': {'type': 'user_list', 'users': [f'member{i}' for i in range(50)]},
+        # client -> server; JSON has to carry the file as a base64 data URL
+        'file_upload': {'type': 'file', 'file_name': 'photo.png', 'file_data': avatar},
+    }
+
+
+def json_form(frame):
+    if isinstance(frame.get('file_data'), bytes):
+        frame = dict(frame, file_data='data:image/png;base64,' + base64.b64encode(frame['file_data']).decode())
+    return frame
+
+
+def deflated_size(payload):
+    compressor = zlib.compressobj(wbits=-15)
+    return len(compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def per_call_us(fn, number):
+    return round(min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6, 2)
+
+
+def main(args):
+    from chat.frames import encode
+    from chat.protocol import CODECS
+
+    codecs = {'json': (lambda f: encode(json_form(f)).encode(), json.loads)}
+    for codec in CODECS.values():
+        codecs[codec.name] = (codec.encode, codec.decode)
+
+    for event, frame in sample_frames().items():
+        number = 200 if event == 'file_upload' else args.number
+        row = {'event': event}
+        for name, (dumps, loads) in codecs.items():
+            payload = dumps(frame)
+            row[f'{name}_bytes'] = len(payload)
+            row[f'{name}_deflate_bytes'] = deflated_size(payload)
+            row[f'{name}_encode_us'] = per_call_us(lambda: dumps(frame), number)
+            row[f'{name}_decode_us'] = per_call_us(lambda: loads(payload), number)
+        print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+    setup_django()
+    main(args)
@@ -0,0 +1,93 @@
+"""
+Search latency: the old icontains scan versus the full-text backend, plus
+the in-process inverted index, over a large Message table.
+
+    python benchmarks/bench_search.py --rows 100000
+    python benchmarks/bench_search.py --rows 5000000
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+
+from common import setup_django
+
+ROOM = 'hot'
+WORDS = (
+    'deploy release rollback staging review merge branch ticket incident alert '
+    'meeting lunch coffee weekend invoice budget report design sprint backlog '
+    'database index cache latency outage customer feedback roadmap launch demo'
+).split()
+
+
+def seed(rows, user_id):
+    from django.db import connection, transaction
+
+    rng = random.Random(0)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    sql = 'INSERT INTO chat_message (user_id, room_name, content, timestamp, is_read) VALUES (%s, %s, %s, %s, %s)'
+    batch = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(rows):
+            room = ROOM if i % 10 else f'room{i % 1000}'
+            content = ' '.join(rng.choice(WORDS) for _ in range(8)) + f' n{i}'
+            batch.append((user_id, room, content, start + datetime.timedelta(seconds=i), False))
+            if len(batch) == 10000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 3)
+
+
+def main(args):
+    from django.contrib.auth.models import User
+    from django.db.models import Q
+
+    from chat.models import Message
+    from chat.search import InvertedIndexSearchBackend, get_search_backend
+
+    user = User.objects.create_user('bench')
+    started = time.perf_counter()
+    seed(args.rows, user.id)
+    print(json.dumps({'seeded_rows': args.rows, 'seconds': round(time.perf_counter() - started, 1)}))
+
+    def icontains(query):
+        return list(Message.objects.filter(room_name=ROOM).filter(
+            Q(content__icontains=query) | Q(user__username__icontains=query)
+        ).select_related('user').order_by('-timestamp')[:20])
+
+    backend = get_search_backend()
+    inverted = InvertedIndexSearchBackend()
+    started = time.perf_counter()
+    inverted.search(ROOM, 'warmup')
+    print(json.dumps({'inverted_index_build_seconds': round(time.perf_counter() - started, 1)}))
+
+    # common word, rare word, prefix, two terms, no match
+    for query in ('deploy', f'n{args.rows // 2}', 'rollb', 'incident outage', 'zzzz'):
+        print(json.dumps({
+            'query': query,
+            'backend': type(backend).__name__,
+            'icontains_ms': timed(lambda: icontains(query), args.repeat),
+            'fulltext_ms': timed(lambda: backend.search(ROOM, query), args.repeat),
+            'fulltext_page_5_ms': timed(lambda: backend.search(ROOM, query, page=5), args.repeat),
+            'inverted_ms': timed(lambda: inverted.search(ROOM, query), args.repeat),
+        }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    setup_django()
+    main(args)
@@ -0,0 +1,121 @@
+"""
+group_send volume for a room full of typists: the old per-keystroke relay
+versus the throttled start/stop typing indicator.
+
+    python benchmarks/bench_typing.py --typists 200 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from common import setup_django
+
+
+def legacy_consumer():
+    from chat.consumers import ChatConsumer
+
+    class LegacyTypingConsumer(ChatConsumer):
+        # the relay as it was: one group_send per keystroke frame
+        async def receive(self, text_data):
+            if json.loads(text_data).get('type') == 'typing':
+                await self.channel_layer.group_send(
+                    self.room_group_name, {'type': 'typing_status', 'username': self.user.username}
+                )
+                return
+            await super().receive(text_data)
+
+    return LegacyTypingConsumer
+
+
+async def run_mode(mode, consumer_class, users, seconds, interval):
+    from channels.layers import get_channel_layer
+    from channels.testing import WebsocketCommunicator
+
+    room = f'typing_{mode}'
+    layer = get_channel_layer()
+    comms = []
+    for user in users:
+        comm = WebsocketCommunicator(consumer_class.as_asgi(), f'/ws/chat/{room}/')
+        comm.scope['user'] = user
+        comm.scope['url_route'] = {'kwargs': {'room_name': room}}
+        connected, _ = await comm.connect()
+        assert connected
+        comms.append(comm)
+
+    counts = {'group_send': 0, 'delivered': 0}
+    original = layer.group_send
+
+    async def counting_group_send(group, message):
+        if message['type'] == 'typing_status' or '"type":"typing"' in message.get('text', ''):
+            counts['group_send'] += 1
+        await original(group, message)
+
+    layer.group_send = counting_group_send
+
+    async def drain(comm, typing_done):
+        while True:
+            # a receive_from timeout would kill the consumer, so poll instead
+            if await comm.receive_nothing(timeout=2):
+                if typing_done.is_set():
+                    return
+                continue
+            frame = json.loads(await comm.receive_from())
+            if frame.get('type') == 'typing':
+                counts['delivered'] += 1
+
+    async def type_for(comm, rng):
+        keystrokes = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            # bursts of typing separated by pauses to think
+            for _ in range(rng.randint(5, 30)):
+                await comm.send_to(text_data=json.dumps({'type': 'typing'}))
+                keystrokes += 1
+                await asyncio.sleep(interval)
+            await asyncio.sleep(rng.uniform(0.5, 4))
+        return keystrokes
+
+    typing_done = asyncio.Event()
+    drains = [asyncio.ensure_future(drain(comm, typing_done)) for comm in comms]
+    started = time.perf_counter()
+    keystrokes = sum(await asyncio.gather(*(type_for(c, random.Random(i)) for i, c in enumerate(comms))))
+    typing_done.set()
+    # receivers stop once they have been quiet for a while, which covers pending 'stop' events
+    await asyncio.gather(*drains)
+    elapsed = time.perf_counter() - started
+    layer.group_send = original
+    for comm in comms:
+        await comm.disconnect()
+
+    return {
+        'mode': mode,
+        'typists': len(users),
+        'keystrokes': keystrokes,
+        'typing_group_sends': counts['group_send'],
+        'typing_frames_delivered': counts['delivered'],
+        'seconds': round(elapsed, 1),
+    }
+
+
+async def main(args):
+    from channels.db import database_sync_to_async
+    from django.contrib.auth.models import User
+
+    from chat.consumers import ChatConsumer
+
+    create = database_sync_to_async(User.objects.create_user)
+    users = [await create(f'typist{i}') for i in range(args.typists)]
+    for mode, consumer_class in (('per_keystroke', legacy_consumer()), ('throttled', ChatConsumer)):
+        print(json.dumps(await run_mode(mode, consumer_class, users, args.seconds, args.interval)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--typists', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--interval', type=float, default=0.15, help='seconds between keystrokes in a burst')
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(main(args))
@@ -0,0 +1,103 @@
+"""
+Peak RSS of one media upload through the legacy base64-over-WebSocket path
+versus the chunked HTTP upload path. Each mode runs in its own process so
+the high-water marks do not leak into each other.
+
+    python benchmarks/bench_upload_rss.py --size-mb 10
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from common import setup_django
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def legacy_upload(frame_path):
+    from django.core.files.base import ContentFile
+
+    from chat.models import Message
+
+    # what ChatConsumer.receive does with a 'file' frame carrying file_data
+    with open(frame_path) as fh:
+        text_data = fh.read()
+    text_data_json = json.loads(text_data)
+    format, imgstr = text_data_json['file_data'].split(';base64,')
+    actual_file = ContentFile(base64.b64decode(imgstr), name='bench.png')
+    field = Message._meta.get_field('image')
+    field.storage.save(field.generate_filename(None, 'bench.png'), actual_file)
+
+
+def chunked_upload(raw_path, size):
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    from chat.uploads import claim_upload, store_upload
+
+    user = User.objects.create_user('bench')
+    client = Client()
+    client.force_login(user)
+    start = client.post(
+        '/chat/uploads/', json.dumps({'file_name': 'bench.png', 'kind': 'file', 'size': size}),
+        content_type='application/json',
+    ).json()
+    offset = 0
+    with open(raw_path, 'rb') as fh:
+        while offset < size:
+            chunk = fh.read(settings.CHAT_UPLOAD_CHUNK_SIZE)
+            result = client.put(
+                f"/chat/uploads/{start['upload_id']}/", chunk,
+                content_type='application/octet-stream', headers={'Upload-Offset': str(offset)},
+            ).json()
+            offset = result['offset']
+    store_upload(claim_upload(result['upload_token'], user.id))
+
+
+def child(mode, workdir, size):
+    setup_django()
+    from django.conf import settings
+
+    settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+    settings.ALLOWED_HOSTS = ['*']
+    baseline = peak_rss_mb()
+    if mode == 'base64':
+        legacy_upload(os.path.join(workdir, 'frame.json'))
+    else:
+        chunked_upload(os.path.join(workdir, 'raw.bin'), size)
+    print(json.dumps({'mode': mode, 'size_mb': size / 2**20, 'peak_rss_delta_mb': round(peak_rss_mb() - baseline, 1)}))
+
+
+def main(args):
+    size = int(args.size_mb * 2**20)
+    workdir = tempfile.mkdtemp(prefix='chat-upload-bench-')
+    raw = os.urandom(size)
+    with open(os.path.join(workdir, 'raw.bin'), 'wb') as fh:
+        fh.write(raw)
+    with open(os.path.join(workdir, 'frame.json'), 'w') as fh:
+        data_url = 'data:image/png;base64,' + base64.b64encode(raw).decode()
+        json.dump({'type': 'file', 'file_data': data_url, 'file_name': 'bench.png'}, fh)
+    del raw, data_url
+
+    for mode in ('base64', 'chunked'):
+        subprocess.run([sys.executable, __file__, '--child', mode, '--workdir', workdir, '--size-mb', str(args.size_mb)], check=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=float, default=10)
+    parser.add_argument('--child')
+    parser.add_argument('--workdir')
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.workdir, int(args.size_mb * 2**20))
+    else:
+        main(args)
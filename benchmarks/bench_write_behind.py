@@ -0,0 +1,86 @@
+"""
+Messages/sec and broadcast latency of ChatConsumer text messages with
+synchronous saves versus write-behind persistence.
+
+    python benchmarks/bench_write_behind.py --senders 20 --messages 100
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import connect, drain, percentile, setup_django
+
+
+async def run_mode(mode, senders, listener, messages):
+    from chat import persistence
+
+    room = f'bench_{mode}'
+    listener_comm = await connect(listener, room)
+    sender_comms = [await connect(user, room) for user in senders]
+    for comm in [listener_comm] + sender_comms:
+        await drain(comm)
+
+    total = len(senders) * messages
+    latencies = []
+
+    async def send_all(comm):
+        for _ in range(messages):
+            await comm.send_to(text_data=json.dumps({'message': repr(time.perf_counter())}))
+
+    async def listen():
+        while len(latencies) < total:
+            data = json.loads(await listener_comm.receive_from(timeout=30))
+            if data.get('type') == 'chat_message':
+                latencies.append(time.perf_counter() - float(data['message']))
+
+    start = time.perf_counter()
+    await asyncio.gather(listen(), *(send_all(c) for c in sender_comms))
+    elapsed = time.perf_counter() - start
+
+    queue = persistence.get_write_behind_queue()
+    if queue:
+        await queue.flush()
+    for comm in [listener_comm] + sender_comms:
+        await comm.disconnect()
+
+    return {
+        'mode': mode,
+        'messages': total,
+        'messages_per_sec': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def main(args):
+    from channels.db import database_sync_to_async
+    from django.contrib.auth.models import User
+    from django.test import override_settings
+
+    from chat import persistence
+    from chat.models import Message
+
+    create = database_sync_to_async(User.objects.create_user)
+    senders = [await create(f'sender{i}') for i in range(args.senders)]
+    listener = await create('listener')
+
+    results = []
+    for mode, enabled in (('sync', False), ('write_behind', True)):
+        persistence._queue = None
+        with override_settings(CHAT_WRITE_BEHIND=enabled):
+            results.append(await run_mode(mode, senders, listener, args.messages))
+        stored = await database_sync_to_async(Message.objects.filter(room_name=f'bench_{mode}').count)()
+        results[-1]['persisted'] = stored
+
+    for row in results:
+        print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--senders', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=50)
+    args = parser.parse_args()
+    setup_django()
+    asyncio.run(main(args))
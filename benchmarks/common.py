@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(**env):
+    """Boot the project against a throwaway SQLite file and the in-memory channel layer."""
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix='chat-bench-')
+    os.environ.pop('REDIS_URL', None)
+    os.environ.pop('REDIS_URLS', None)
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{workdir}/bench.sqlite3')
+    os.environ.setdefault('CHAT_WRITE_BEHIND_JOURNAL_DIR', os.path.join(workdir, 'journal'))
+    os.environ.update(env)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    django.setup()
+    # benchmarks deliberately overrun the default per-channel capacity of 100
+    settings.CHANNEL_LAYERS['default']['CONFIG'] = {'capacity': 100000}
+    call_command('migrate', verbosity=0)
+    return workdir
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def connect(user, room_name):
+    from channels.testing import WebsocketCommunicator
+    from chat.consumers import ChatConsumer
+
+    prefix = 'ws/chat/private' if room_name.startswith('private_') else 'ws/chat'
+    communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/{prefix}/{room_name}/')
+    communicator.scope['user'] = user
+    communicator.scope['url_route'] = {'kwargs': {'room_name': room_name}}
+    connected, _ = await communicator.connect()
+    assert connected, f'could not connect to {room_name}'
+    return communicator
+
+
+async def drain(communicator):
+    while not await communicator.receive_nothing(timeout=0.05):
+        await communicator.receive_from()
@@ -0,0 +1,309 @@
+"""
+Load test for the WebSocket chat path. Boots core.asgi.application in
+process, so session-cookie auth, URL routing, the consumer and the HTTP
+upload views all run exactly as under daphne, against SQLite and the
+in-memory channel layer (or Redis with --redis-url).
+
+Simulated clients are spread over public rooms and private pairs and send
+a weighted mix of text, typing, read-receipt and media (chunked HTTP
+upload plus token frame) traffic. Reports connections/sec, messages/sec,
+end-to-end latency percentiles of text messages across every recipient
+and resident memory per connection.
+
+    python benchmarks/loadtest.py --clients 2000 --duration 30 --output run.json
+    python benchmarks/loadtest.py --clients 2000 --duration 30 --baseline run.json
+"""
+import argparse
+import array
+import asyncio
+import datetime
+import json
+import os
+import random
+import secrets
+import subprocess
+import time
+
+from common import ROOT, percentile, setup_django
+
+MARK = 'lt:'
+CSRF_TOKEN = secrets.token_hex(16)
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as fh:
+        return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, weight = part.split('=')
+        if kind not in ('text', 'typing', 'read', 'media'):
+            raise argparse.ArgumentTypeError(f'unknown frame kind {kind!r}')
+        mix[kind] = float(weight)
+    return mix
+
+
+class Stats:
+    def __init__(self):
+        self.sent = {'text': 0, 'typing': 0, 'read': 0, 'media': 0}
+        self.frames_received = 0
+        self.messages_received = 0
+        self.media_received = 0
+        self.errors = 0
+        self.latencies = array.array('d')
+
+
+class Client:
+    def __init__(self, user, session_key, room_name):
+        self.user = user
+        self.session_key = session_key
+        self.room_name = room_name
+        self.last_incoming = None
+        self.comm = None
+
+    @property
+    def path(self):
+        prefix = 'ws/chat/private' if self.room_name.startswith('private_') else 'ws/chat'
+        return f'/{prefix}/{self.room_name}/'
+
+    def headers(self):
+        cookie = f'sessionid={self.session_key}; csrftoken={CSRF_TOKEN}'
+        return [(b'host', b'localhost'), (b'cookie', cookie.encode())]
+
+    async def connect(self, app):
+        from channels.testing import WebsocketCommunicator
+
+        self.comm = WebsocketCommunicator(app, self.path, headers=self.headers())
+        connected, _ = await self.comm.connect(timeout=60)
+        return connected
+
+    async def receive_loop(self, stats):
+        # straight off the output queue: a receive_from timeout would kill the consumer
+        while True:
+            output = await self.comm.output_queue.get()
+            if output['type'] != 'websocket.send':
+                return
+            stats.frames_received += 1
+            frame = json.loads(output['text'])
+            if frame.get('type') != 'chat_message':
+                continue
+            stats.messages_received += 1
+            message = frame.get('message') or ''
+            if message.startswith(MARK):
+                stats.latencies.append(time.perf_counter() - float(message[len(MARK):].split(' ', 1)[0]))
+            elif frame.get('image_url'):
+                stats.media_received += 1
+            if frame.get('username') != self.user.username:
+                self.last_incoming = frame.get('message_id')
+
+    async def http(self, app, method, path, body, extra_headers=()):
+        from channels.testing import HttpCommunicator
+
+        headers = self.headers() + [(b'x-csrftoken', CSRF_TOKEN.encode())] + list(extra_headers)
+        response = await HttpCommunicator(app, method, path, body=body, headers=headers).get_response(timeout=60)
+        return response['status'], json.loads(response['body'] or b'{}')
+
+    async def upload(self, app, payload):
+        status, started = await self.http(app, 'POST', '/chat/uploads/', json.dumps({
+            'file_name': 'photo.png', 'kind': 'file', 'size': len(payload),
+        }).encode(), [(b'content-type', b'application/json')])
+        if status != 201:
+            return None
+        status, done = await self.http(
+            app, 'PUT', f"/chat/uploads/{started['upload_id']}/", payload, [(b'upload-offset', b'0')]
+        )
+        return done.get('upload_token') if status == 200 else None
+
+    async def traffic(self, app, deadline, rate, mix, rng, stats, media_payload):
+        kinds, weights = list(mix), list(mix.values())
+        while True:
+            await asyncio.sleep(rng.expovariate(rate))
+            if time.perf_counter() >= deadline:
+                return
+            kind = rng.choices(kinds, weights)[0]
+            if kind == 'text':
+                frame = {'message': f'{MARK}{time.perf_counter()} hello from {self.user.username}'}
+            elif kind == 'typing':
+                frame = {'type': 'typing'}
+            elif kind == 'read':
+                if self.last_incoming is None:
+                    continue
+                frame = {'type': 'message_read', 'message_id': self.last_incoming}
+            else:
+                token = await self.upload(app, media_payload)
+                if token is None:
+                    stats.errors += 1
+                    continue
+                frame = {'type': 'file', 'upload_token': token}
+            stats.sent[kind] += 1
+            await self.comm.send_json_to(frame)
+
+
+def create_clients(count, rooms, private_ratio):
+    """Users with real login sessions, a share of them paired into private rooms."""
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.models import User
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.contrib.sessions.models import Session
+    from django.utils import timezone
+
+    from chat.models import PrivateChatRoom, UserProfile
+
+    users = User.objects.bulk_create(User(username=f'load{i}', password='!') for i in range(count))
+    UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+
+    store = SessionStore()
+    expires = timezone.now() + datetime.timedelta(days=1)
+    sessions = []
+    for user in users:
+        key = secrets.token_hex(16)
+        data = {
+            SESSION_KEY: str(user.pk),
+            BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+            HASH_SESSION_KEY: user.get_session_auth_hash(),
+        }
+        sessions.append(Session(session_key=key, session_data=store.encode(data), expire_date=expires))
+    Session.objects.bulk_create(sessions)
+
+    private_count = int(count * private_ratio) // 2 * 2
+    pairs = []
+    for a, b in zip(users[:private_count:2], users[1:private_count:2]):
+        pairs.append(PrivateChatRoom(user1=a, user2=b, room_id=f'private_{a.id}_{b.id}'))
+    PrivateChatRoom.objects.bulk_create(pairs)
+
+    clients = []
+    for i, (user, session) in enumerate(zip(users, sessions)):
+        if i < private_count:
+            room = pairs[i // 2].room_id
+        else:
+            room = f'loadroom{i % rooms}'
+        clients.append(Client(user, session.session_key, room))
+    return clients
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    from channels.db import database_sync_to_async
+
+    from core.asgi import application
+
+    clients = await database_sync_to_async(create_clients)(args.clients, args.rooms, args.private_ratio)
+    stats = Stats()
+    rng = random.Random(args.seed)
+    media_payload = os.urandom(args.media_size)
+
+    rss_before = rss_bytes()
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client):
+        async with semaphore:
+            return await client.connect(application)
+
+    started = time.perf_counter()
+    connected = await asyncio.gather(*(connect(c) for c in clients))
+    connect_seconds = time.perf_counter() - started
+    receivers = [asyncio.ensure_future(c.receive_loop(stats)) for c in clients]
+    # let presence snapshots and join deltas settle before measuring memory
+    await asyncio.sleep(1)
+    rss_connected = rss_bytes()
+
+    stats.frames_received = stats.messages_received = 0
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(
+        c.traffic(application, deadline, args.rate, args.mix, random.Random(rng.random()), stats, media_payload)
+        for c in clients
+    ))
+    sent_seconds = time.perf_counter() - started
+    # drain what is still in flight
+    previous = -1
+    while previous != stats.frames_received:
+        previous = stats.frames_received
+        await asyncio.sleep(1)
+    drain_seconds = time.perf_counter() - started
+
+    for client in clients:
+        await client.comm.disconnect()
+    for task in receivers:
+        task.cancel()
+
+    latencies = stats.latencies
+    return {
+        'clients': args.clients,
+        'connected': sum(connected),
+        'connections_per_sec': round(args.clients / connect_seconds, 1),
+        'memory_per_connection_kb': round((rss_connected - rss_before) / args.clients / 1024, 1),
+        'frames_sent': sum(stats.sent.values()),
+        'sent_by_kind': stats.sent,
+        'messages_sent_per_sec': round((stats.sent['text'] + stats.sent['media']) / sent_seconds, 1),
+        'messages_delivered_per_sec': round(stats.messages_received / drain_seconds, 1),
+        'frames_delivered_per_sec': round(stats.frames_received / drain_seconds, 1),
+        'media_delivered': stats.media_received,
+        'latency_samples': len(latencies),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'latency_p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'errors': stats.errors,
+    }
+
+
+def compare(results, baseline):
+    """Relative change of every numeric metric against a previous run."""
+    changes = {}
+    for key, value in results.items():
+        old = baseline.get(key)
+        if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            changes[key] = {'baseline': old, 'current': value, 'change_pct': round((value - old) / old * 100, 1)}
+    return changes
+
+
+def main(args):
+    from django.conf import settings
+
+    settings.DEBUG = False
+    settings.MEDIA_ROOT = os.path.join(args.workdir, 'media')
+    settings.CHAT_UPLOAD_DIR = os.path.join(args.workdir, 'uploads')
+
+    results = asyncio.run(run(args))
+    report = {
+        'revision': git_revision(),
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('baseline', 'output', 'workdir')},
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as fh:
+            report['comparison'] = compare(results, json.load(fh)['results'])
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--rooms', type=int, default=20, help='public rooms the non-private clients are spread over')
+    parser.add_argument('--private-ratio', type=float, default=0.2, help='share of clients paired into private rooms')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of traffic')
+    parser.add_argument('--rate', type=float, default=0.5, help='frames per second per client')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('text=70,typing=20,read=8,media=2'))
+    parser.add_argument('--media-size', type=int, default=32 * 1024)
+    parser.add_argument('--connect-concurrency', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--redis-url', help='use channels_redis instead of the in-memory layer')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    env = {'REDIS_URL': args.redis_url} if args.redis_url else {}
+    args.workdir = setup_django(**env)
+    main(args)
@@ -1,9 +1,20 @@
 from django.contrib import admin
-from .models import Message
+from .models import ArchiveSegment, Message, RoomRetention
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
    list_display = ('user', 'room_name', 'content', 'timestamp')
    list_filter = ('room_name', 'timestamp')
    search_fields = ('user_username', 'content')
-   
\ No newline at end of file
+   
+
+@admin.register(RoomRetention)
+class RoomRetentionAdmin(admin.ModelAdmin):
+   list_display = ('room_name', 'days')
+   search_fields = ('room_name',)
+
+
+@admin.register(ArchiveSegment)
+class ArchiveSegmentAdmin(admin.ModelAdmin):
+   list_display = ('room_name', 'first_timestamp', 'last_timestamp', 'message_count', 'path')
+   search_fields = ('room_name',)
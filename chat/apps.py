@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     name = 'chat'
+
+    def ready(self):
+        from . import auth  # noqa: F401 (registers handshake cache invalidation)
+        from . import cache  # noqa: F401 (registers cache invalidation signals)
+        from . import search  # noqa: F401 (registers in-process index updates)
+        from . import recent  # noqa: F401 (registers recent-message invalidation)
+        from . import db  # noqa: F401 (registers connection pool metrics)
@@ -0,0 +1,122 @@
+"""
+Message retention. Messages older than their room's retention
+(RoomRetention, else CHAT_RETENTION_DAYS; 0 or null keeps them forever)
+are moved by ``manage.py archive_messages`` into gzip-compressed JSON Lines
+segments under CHAT_ARCHIVE_DIR, CHAT_ARCHIVE_BATCH_SIZE messages per
+segment, each indexed by an ArchiveSegment row. A batch writes its file
+first and then inserts the segment row and deletes the messages in one
+transaction, so a crash can leave an orphaned file but never lose a
+message.
+
+History reads through: chat.history.fetch_history pages a room's rows
+and, once they run out, carries on into its segments with the same
+cursors. Archived messages are no longer searchable; their media files
+are kept.
+
+On PostgreSQL the message tables can also be partitioned by month
+(chat.partitions), which lets archiving drop emptied partitions instead of
+leaving dead rows for vacuum.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .history import FILE_FIELDS, message_model, room_messages
+from .models import ArchiveSegment, Message, PrivateChatRoom, PrivateMessage, RoomRetention
+from .recent import recent_messages
+
+
+def to_record(msg):
+    author = msg.sender if isinstance(msg, PrivateMessage) else msg.user
+    return {
+        'id': msg.id,
+        'user_id': author.id,
+        'username': author.username,
+        'content': msg.content,
+        'timestamp': msg.timestamp.isoformat(),
+        'is_read': msg.is_read,
+        'image_width': msg.image_width,
+        'image_height': msg.image_height,
+        **{field: getattr(msg, field).name or None for field in FILE_FIELDS},
+    }
+
+
+def retention_policies():
+    """room_name -> days for every room that may hold messages past its retention."""
+    rooms = {}
+    default = settings.CHAT_RETENTION_DAYS
+    if default:
+        cutoff = timezone.now() - datetime.timedelta(days=default)
+        public = Message.objects.filter(timestamp__lt=cutoff).order_by().values_list('room_name', flat=True)
+        private = PrivateChatRoom.objects.filter(private_messages__timestamp__lt=cutoff).order_by().values_list(
+            'room_id', flat=True
+        )
+        rooms.update((room_name, default) for room_name in public.distinct())
+        rooms.update((room_name, default) for room_name in private.distinct())
+    for room_name, days in RoomRetention.objects.values_list('room_name', 'days'):
+        if days:
+            rooms[room_name] = days
+        else:
+            rooms.pop(room_name, None)
+    return rooms
+
+
+def segment_path(room_name, first_id, last_id):
+    # রুমের নাম ইউজারের দেওয়া, তাই ফাইলের নামে সরাসরি নয়
+    digest = hashlib.sha1(room_name.encode()).hexdigest()
+    model = message_model(room_name)
+    return os.path.join(model._meta.db_table, digest[:2], digest, f'{first_id}-{last_id}.jsonl.gz')
+
+
+def write_segment(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.part'
+    with open(partial, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as fh:
+            for record in records:
+                fh.write(json.dumps(record, ensure_ascii=False).encode() + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial, path)
+
+
+def archive_batch(room_name, cutoff, batch_size):
+    """Move the room's oldest batch before ``cutoff`` into a new segment. Returns the number moved."""
+    model = message_model(room_name)
+    rows = list(room_messages(room_name).filter(timestamp__lt=cutoff).order_by('timestamp', 'id')[:batch_size])
+    if not rows:
+        return 0
+
+    first, last = rows[0], rows[-1]
+    relative = segment_path(room_name, first.id, last.id)
+    path = os.path.join(settings.CHAT_ARCHIVE_DIR, relative)
+    write_segment(path, [to_record(msg) for msg in rows])
+    try:
+        with transaction.atomic():
+            ArchiveSegment.objects.create(
+                room_name=room_name, path=relative, first_id=first.id, last_id=last.id,
+                first_timestamp=first.timestamp, last_timestamp=last.timestamp, message_count=len(rows),
+            )
+            model.objects.filter(id__in=[msg.id for msg in rows]).delete()
+    except Exception:
+        os.remove(path)
+        raise
+    recent_messages.invalidate(room_name)
+    return len(rows)
+
+
+def archive_room(room_name, days, batch_size=None):
+    batch_size = batch_size or settings.CHAT_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    total = 0
+    while True:
+        moved = archive_batch(room_name, cutoff, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
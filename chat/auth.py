@@ -0,0 +1,75 @@
+"""
+WebSocket authentication without the database on every handshake.
+
+``AuthMiddleware`` loads the session row and then the user row for every
+connect, which during a reconnect storm after a deploy is two queries per
+socket before any chat traffic. ``CachedAuthMiddleware`` keeps the user it
+resolved for a session key in a process-wide LRU for CHAT_AUTH_CACHE_TTL
+seconds, so a client reconnecting within that window costs no query at all
+(the session itself is never loaded).
+
+Entries are dropped when the session's user logs out and whenever the user
+row is saved (password change, deactivation). Those signals only reach the
+process they fire in; other workers notice within the TTL, which is why it
+is kept short. CHAT_AUTH_CACHE_TTL=0 turns the cache off.
+"""
+import copy
+import time
+
+from channels.auth import AuthMiddleware, get_user
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model, user_logged_out
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .cache import LRUCache
+from .db import db_sync_to_async
+from .metrics import AUTH_CACHE
+
+# session key -> (monotonic deadline, user)
+sessions = LRUCache(settings.CHAT_AUTH_CACHE_SIZE)
+
+
+def forget_user(user_id):
+    with sessions.lock:
+        keys = [key for key, (_, user) in sessions.data.items() if user.pk == user_id]
+    for key in keys:
+        sessions.pop(key)
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    async def resolve_scope(self, scope):
+        ttl = settings.CHAT_AUTH_CACHE_TTL
+        # কুকির কী; সেশন এখনো লোড হয়নি
+        session_key = scope['session'].session_key
+        if ttl <= 0 or not session_key:
+            return await super().resolve_scope(scope)
+
+        entry = sessions.get(session_key)
+        if entry is not None and entry[0] > time.monotonic():
+            AUTH_CACHE.inc(result='hit')
+        else:
+            AUTH_CACHE.inc(result='miss')
+            entry = (time.monotonic() + ttl, await db_sync_to_async(get_user.func)(scope))
+            sessions.set(session_key, entry)
+        # প্রতিটি কানেকশনের নিজের কপি, যাতে একটার পরিবর্তন অন্যটায় না যায়
+        scope['user']._wrapped = copy.copy(entry[1])
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
+
+
+@receiver(user_logged_out)
+def invalidate_logged_out(sender, request, user, **kwargs):
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        sessions.pop(session.session_key)
+    if user is not None:
+        forget_user(user.pk)
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_saved_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import PrivateChatRoom
+
+RoomRow = namedtuple('RoomRow', ['pk', 'user1_id', 'user2_id'])
+
+
+class LRUCache:
+    # ডাটাবেস থ্রেড থেকেও অ্যাক্সেস হয়, তাই লক দরকার
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return default
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+private_rooms = LRUCache(settings.CHAT_ROOM_CACHE_SIZE)
+
+
+def get_private_room(room_id):
+    room = private_rooms.get(room_id)
+    if room is None:
+        row = PrivateChatRoom.objects.filter(room_id=room_id).values_list('pk', 'user1_id', 'user2_id').first()
+        if row is None:
+            return None
+        room = RoomRow(*row)
+        private_rooms.set(room_id, room)
+    return room
+
+
+@receiver(post_delete, sender=PrivateChatRoom)
+def invalidate_private_room(sender, instance, **kwargs):
+    private_rooms.pop(instance.room_id)
@@ -1,141 +1,375 @@
 
 
-from channels.db import database_sync_to_async
-from .models import Message, PrivateChatRoom, PrivateMessage
+import asyncio
+from .models import Message, PrivateMessage, ReadMarker
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 import datetime
 import base64
 import uuid
 from django.core.files.base import ContentFile
-from django.contrib.auth.models import User
-from .models import UserProfile
-from django.utils import timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
+import logging
+from .db import db_sync_to_async
+from .presence import get_presence_store
+from .persistence import get_write_behind_queue
+from .cache import get_private_room, private_rooms
+from .uploads import UploadError, claim_upload, discard_stored, discard_upload, storage_executor, store_upload
+from .ephemeral import EphemeralSender, TypingIndicator, ephemeral_event
+from .frames import chat_message_frame, encode, frame_event, resume_id
+from .protocol import CODECS, decode_json, negotiate
+from .outbound import MESSAGE, OutboundQueue, classify
+from .replay import get_replay_buffer
+from . import fanout
+from .recent import from_model, recent_messages
+from .status import get_status_writer
+from .inbox import get_inbox_writer, room_members, snippet
+from .media import get_media_backend, media_job
+from .history import encode_cursor, fetch_page, room_messages, serialize_message
+from urllib.parse import parse_qs
+from .metrics import DB_SECONDS, ERRORS, WS_CONNECTIONS, WS_FRAME, WS_OPEN, WS_PHASE
+
+logger = logging.getLogger(__name__)
+
+# ক্লায়েন্ট যেকোনো type পাঠাতে পারে, মেট্রিক লেবেল শুধু এগুলো
+FRAME_TYPES = {'audio', 'file', 'message_read', 'typing', 'ephemeral'}
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    online_users = set()
+    heartbeat_task = None
+    typing = None
+    codec = None
+    read_receipt_task = None
+    pending_read = None
+    read_up_to = 0
+    accepted = False
+    outbound = None
+    write_behind = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_tasks = set()
 
     async def connect(self):
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'chat_{self.room_name}'
+        with WS_PHASE.time(phase='connect'):
+            await self.open_connection()
+
+    async def open_connection(self):
         self.user = self.scope['user']
+        # ইউজার আর রুম পুরো কানেকশনে একই থাকে, তাই একবারই রিজলভ করা
+        self.user_id = self.user.id if self.user.is_authenticated else None
+        self.room_name = self.scope['url_route']['kwargs']['room_name']
+        private_room = None
+        if self.room_name.startswith('private_'):
+            with WS_PHASE.time(phase='resolve_room'):
+                private_room = await self.resolve_private_room()
+            # history API আর মাল্টিপ্লেক্সারের মতো: রিপ্লে আর লাইভ মেসেজ শুধু রুমের দুই সদস্যের
+            if private_room is None or self.user_id not in (private_room.user1_id, private_room.user2_id):
+                await self.close()
+                return
+        await self.join_room(self.room_name, private_room)
+        # সাবপ্রোটোকল: msgpack/cbor হলে বাইনারি ফ্রেম, নাহলে আগের মতো JSON
+        subprotocol = negotiate(self.scope.get('subprotocols', []))
+        self.codec = CODECS.get(subprotocol)
+        await self.accept(subprotocol=subprotocol)
+        self.accepted = True
+        WS_CONNECTIONS.inc()
+        WS_OPEN.inc()
 
-        if self.user.is_authenticated:
-            ChatConsumer.online_users.add(self.user.username)
+        await self.enter_room(self.resume_after())
 
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
+        # is_online আর সাথে সাথে লেখা হয় না, জমিয়ে পরে একবারে
+        if self.user_id is not None:
+            get_status_writer().connect(self.user_id)
+
+    # রুমের অংশ আলাদা, যাতে MultiplexConsumer একই সকেটে অনেক রুমে এটা চালাতে পারে
+    async def join_room(self, room_name, private_room=None):
+        self.room_name = room_name
+        self.room_group_name = f'chat_{self.room_name}'
+        self.presence = get_presence_store(self.channel_layer)
+        self.replay = get_replay_buffer(self.channel_layer)
+        self.room_pk = None
+        if self.room_name.startswith('private_'):
+            if private_room is None:
+                with WS_PHASE.time(phase='resolve_room'):
+                    private_room = await self.resolve_private_room()
+            self.room_pk = private_room.pk if private_room else None
+        # ইনবক্সে এই রুমের মেসেজ কার কার কনভারসেশনে যাবে
+        self.inbox_members = room_members(private_room, self.user_id)
+        self.inbox = get_inbox_writer()
+        self.inbox.start()
+        self.write_behind = get_write_behind_queue()
+        if self.write_behind:
+            self.write_behind.start()
+        self.ephemeral = EphemeralSender(self.channel_layer)
+        self.outbound = OutboundQueue(
+            self.write, self.presence_snapshot, self.close_slow_client, settings.CHAT_OUTBOUND_QUEUE_SIZE,
+            drained=self.scope.get('extensions', {}).get('chat.drained'),
         )
-        await self.accept()
-        await self.send_online_users()
+        self.typing = TypingIndicator(
+            self.ephemeral, self.room_group_name,
+            self.user.username if self.user.is_authenticated else 'Anonymous'
+        )
+
+        # বড় রুমে গ্রুপ শার্ড/ওয়ার্কার রিলে হতে পারে, তাই সরাসরি group_add নয়
+        with WS_PHASE.time(phase='group_add'):
+            await fanout.join(self.channel_layer, self.room_group_name, self)
+
+    async def enter_room(self, after):
+        # রিকানেক্ট: ক্লায়েন্টের শেষ দেখা মেসেজের পরেরগুলো আবার পাঠানো
+        if after is not None:
+            with WS_PHASE.time(phase='replay'):
+                await self.replay_missed(after)
 
         if self.user.is_authenticated:
-            await self.update_user_status(self.user, True)
+            with WS_PHASE.time(phase='presence_join'):
+                joined, left = await self.presence.join(
+                    self.room_group_name, self.user.username, self.channel_name
+                )
+            self.heartbeat_task = asyncio.ensure_future(self.presence_heartbeat())
+            await self.broadcast_presence(joined, left)
+        with WS_PHASE.time(phase='send_user_list'):
+            await self.send_online_users()
 
     async def disconnect(self, close_code):
+        if self.accepted:
+            self.accepted = False
+            WS_OPEN.dec()
+        with WS_PHASE.time(phase='disconnect'):
+            await self.close_connection()
+
+    async def close_connection(self):
+        # সংযোগ নেওয়ার আগেই ফিরিয়ে দেওয়া হয়েছে
+        if self.outbound is None:
+            return
+        await self.leave_room()
         if self.user.is_authenticated:
-            ChatConsumer.online_users.discard(self.user.username)
+            get_status_writer().disconnect(self.user_id)
 
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
-        await self.send_online_users()
+    async def leave_room(self):
+        if self.outbound:
+            self.outbound.cancel()
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        if self.typing:
+            self.typing.stop()
+        # জমে থাকা রিড রিসিপ্ট হারিয়ে না যায়
+        if self.read_receipt_task:
+            self.read_receipt_task.cancel()
+            self.read_receipt_task = None
+            await self.flush_read_receipts()
+
+        with WS_PHASE.time(phase='group_discard'):
+            await fanout.leave(self.channel_layer, self.room_group_name, self)
 
         if self.user.is_authenticated:
-            await self.update_user_status(self.user, False)
+            with WS_PHASE.time(phase='presence_leave'):
+                joined, left = await self.presence.leave(
+                    self.room_group_name, self.user.username, self.channel_name
+                )
+            await self.broadcast_presence(joined, left)
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        with WS_PHASE.time(phase='decode'):
+            if bytes_data is not None and self.codec is None:
+                return
+            try:
+                if bytes_data is not None:
+                    text_data_json = self.codec.decode(bytes_data)
+                else:
+                    text_data_json = decode_json(text_data)
+            except ValueError as e:
+                text_data_json = None
+                error = str(e)
+        if text_data_json is None:
+            ERRORS.inc(where='decode')
+            await self.send_frame({'type': 'error', 'error': error})
+            return
+
+        msg_type = text_data_json.get('type')
+        label = msg_type if msg_type in FRAME_TYPES else ('text' if 'message' in text_data_json else 'other')
+        with WS_FRAME.time(type=label):
+            await self.handle_frame(text_data_json)
+
+    async def handle_frame(self, text_data_json):
         username = self.scope['user'].username if self.scope['user'].is_authenticated else 'Anonymous'
         time_now = datetime.datetime.now().strftime('%I:%M %p')
         msg_type = text_data_json.get('type')
 
+        # ০. চাংকড HTTP আপলোড: সকেটে শুধু টোকেন আসে, স্টোরেজ আপলোড ব্যাকগ্রাউন্ডে
+        if msg_type in ('audio', 'file') and text_data_json.get('upload_token'):
+            task = asyncio.ensure_future(
+                self.publish_upload(text_data_json['upload_token'], username, time_now)
+            )
+            self.upload_tasks.add(task)
+            task.add_done_callback(self.upload_tasks.discard)
+            return
+
         # ১. অডিও মেসেজ হ্যান্ডলিং (সংশোধিত)
         if msg_type == 'audio':
             file_data = text_data_json.get('file_data')
-            format, audiostream = file_data.split(';base64,')
-            audio_file = ContentFile(base64.b64decode(audiostream), name=f"voice_{uuid.uuid4()}.wav")
+            # বাইনারি প্রোটোকলে ফাইল সরাসরি bytes হিসেবে আসে
+            if not isinstance(file_data, bytes):
+                format, audiostream = file_data.split(';base64,')
+                file_data = base64.b64decode(audiostream)
+            audio_file = ContentFile(file_data, name=f"voice_{uuid.uuid4()}.wav")
 
             # আর্গুমেন্ট পাসিং নিশ্চিত করা (content="" এবং image=None)
-            msg_obj = await self.save_message(username, self.room_name, "", None, audio_file)
+            with WS_PHASE.time(phase='save_message'):
+                msg_obj = await self.save_message("", None, audio_file)
 
             if msg_obj:
-                await self.channel_layer.group_send(
-                    self.room_group_name, {
-                        'type': 'chat_message_broadcast',
-                        'message': '',
-                        'username': username,
-                        'audio_url': msg_obj.audio.url,
-                        'image_url': None,
-                        'timestamp': time_now,
-                        'message_id': msg_obj.id
-                    }
-                )
+                await self.broadcast_frame(chat_message_frame(
+                    username, time_now, msg_obj.id, audio_url=msg_obj.audio.url
+                ))
+                self.queue_media(msg_obj)
             return
 
         # ২. ইমেজ/ফাইল হ্যান্ডলিং (সংশোধিত)
         if msg_type == 'file':
             file_data = text_data_json.get('file_data')
             file_name = text_data_json.get('file_name')
-            format, imgstr = file_data.split(';base64,')
+            if not isinstance(file_data, bytes):
+                format, imgstr = file_data.split(';base64,')
+                file_data = base64.b64decode(imgstr)
             ext = file_name.split('.')[-1]
-            actual_file = ContentFile(base64.b64decode(imgstr), name=f"{uuid.uuid4()}.{ext}")
+            actual_file = ContentFile(file_data, name=f"{uuid.uuid4()}.{ext}")
 
             # আর্গুমেন্ট পাসিং নিশ্চিত করা (audio=None)
-            msg_obj = await self.save_message(username, self.room_name, "", actual_file, None)
+            with WS_PHASE.time(phase='save_message'):
+                msg_obj = await self.save_message("", actual_file, None)
 
             if msg_obj:
-                await self.channel_layer.group_send(
-                    self.room_group_name, {
-                        'type': 'chat_message_broadcast',
-                        'message': '',
-                        'username': username,
-                        'image_url': msg_obj.image.url,
-                        'audio_url': None,
-                        'timestamp': time_now,
-                        'message_id': msg_obj.id
-                    }
-                )
+                await self.broadcast_frame(chat_message_frame(
+                    username, time_now, msg_obj.id, image_url=msg_obj.image.url
+                ))
+                self.queue_media(msg_obj)
             return
 
         # ৩. টাইপিং এবং রিড সিগন্যাল (অপরিবর্তিত)
         if msg_type == 'message_read':
-            msg_id = text_data_json.get('message_id')
-            await self.mark_message_as_read(msg_id)
-            await self.channel_layer.group_send(
-                self.room_group_name, {'type': 'message_read_update', 'message_id': msg_id}
-            )
+            self.queue_read_receipt(text_data_json.get('message_id'))
             return
 
+        # প্রতি কীপ্রেসে নয়, শুধু start/stop পরিবর্তনে গ্রুপে পাঠানো
         if msg_type == 'typing':
-            await self.channel_layer.group_send(
-                self.room_group_name, {'type': 'typing_status', 'username': username}
-            )
+            if text_data_json.get('state') == 'stop':
+                self.typing.stop()
+            else:
+                self.typing.keystroke()
+            return
+
+        # ephemeral ইভেন্ট: ডাটাবেসে যায় না, চাপ বেশি হলে বাদ পড়তে পারে
+        if msg_type == 'ephemeral':
+            event = ephemeral_event(username, text_data_json)
+            if event:
+                self.ephemeral.send(self.room_group_name, event)
             return
 
         # ৪. সাধারণ টেক্সট মেসেজ
         if 'message' in text_data_json:
             message = text_data_json['message']
-            msg_obj = await self.save_message(username, self.room_name, message)
+            self.typing.reset()
+            if self.write_behind:
+                message_id = self.enqueue_message(message)
+            else:
+                with WS_PHASE.time(phase='save_message'):
+                    msg_obj = await self.save_message(message)
+                message_id = msg_obj.id if msg_obj else None
 
-            if msg_obj:
-                await self.channel_layer.group_send(
-                    self.room_group_name, {
-                        'type': 'chat_message_broadcast',
-                        'message': message,
-                        'username': username,
-                        'timestamp': time_now,
-                        'message_id': msg_obj.id,
-                        'image_url': None,
-                        'audio_url': None
-                    }
-                )
+            if message_id:
+                await self.broadcast_frame(chat_message_frame(username, time_now, message_id, message))
+
+    async def publish_upload(self, token, username, time_now):
+        try:
+            upload = claim_upload(token, self.user_id)
+        except UploadError as e:
+            await self.send_frame({'type': 'upload_error', 'error': str(e)})
+            return
 
-    # ইভেন্ট হ্যান্ডলার মেথডস (অপরিবর্তিত)
+        loop = asyncio.get_running_loop()
+        try:
+            with WS_PHASE.time(phase='storage_upload'):
+                name = await loop.run_in_executor(storage_executor, store_upload, upload)
+        except Exception:
+            ERRORS.inc(where='storage_upload')
+            logger.exception("Could not store upload %s", upload['id'])
+            await self.send_frame({'type': 'upload_error', 'error': 'Could not store the file, try again.'})
+            return
+        with WS_PHASE.time(phase='save_message'):
+            if upload['kind'] == 'audio':
+                msg_obj = await self.save_message("", None, name)
+            else:
+                msg_obj = await self.save_message("", name, None)
+        if not msg_obj:
+            # স্টেজ করা ফাইল থাকে, তাই একই টোকেনে আবার পাঠানো যায়; স্টোরেজের কপিটা আর কারো নয়
+            await self.send_frame({'type': 'upload_error', 'error': 'Could not save the message.'})
+            try:
+                await loop.run_in_executor(storage_executor, discard_stored, upload, name)
+            except Exception:
+                logger.exception("Could not delete stored file %s", name)
+            return
+
+        discard_upload(upload)
+        await self.broadcast_frame(chat_message_frame(
+            username, time_now, msg_obj.id,
+            image_url=msg_obj.image.url if msg_obj.image else None,
+            audio_url=msg_obj.audio.url if msg_obj.audio else None,
+        ))
+        self.queue_media(msg_obj)
+
+    # থাম্বনেইল/কমপ্রেশন ব্যাকগ্রাউন্ডে; শেষ হলে রুমে media_update যায়
+    def queue_media(self, msg_obj):
+        job = media_job(msg_obj, self.room_name, self.room_group_name)
+        if job is not None:
+            get_media_backend().enqueue(job)
+
+    # পাঠানোর সময় একবারই encode, প্রাপকেরা শুধু ফরওয়ার্ড করে
+    async def broadcast_frame(self, frame):
+        if frame['type'] == 'chat_message':
+            await self.replay.append(self.room_group_name, frame)
+        with WS_PHASE.time(phase='encode'):
+            event = frame_event(frame)
+        with WS_PHASE.time(phase='group_send'):
+            await fanout.publish(self.channel_layer, self.room_group_name, event)
+
+    # সরাসরি সকেটে না লিখে কিউতে, যাতে ধীর ক্লায়েন্ট ইনবক্স আটকে না রাখে
+    async def chat_frame(self, event):
+        if self.codec is None:
+            text, data = event['text'], None
+        elif self.codec.name in event:
+            text, data = None, event[self.codec.name]
+        else:
+            # অন্য কনফিগের ওয়ার্কার এই কোডেক encode করেনি
+            text, data = None, self.codec.encode(json.loads(event['text']))
+        self.outbound.put(event.get('kind', MESSAGE), event.get('key'), text, data, event.get('message_id'))
+
+    # শুধু এই সকেটের জন্য ফ্রেম, নেগোশিয়েট করা প্রোটোকলে
+    async def send_frame(self, frame):
+        kind, key = classify(frame)
+        # রিড রিসিপ্ট বা media_update-এর message_id রিজিউম কার্সর এগোয় না
+        self.outbound.put(kind, key, *self.encode_frame(frame), message_id=resume_id(frame))
+
+    def encode_frame(self, frame):
+        if self.codec is None:
+            return encode(frame), None
+        return None, self.codec.encode(frame)
+
+    async def write(self, text_data, bytes_data):
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    async def presence_snapshot(self):
+        users = await self.presence.members(self.room_group_name)
+        return self.encode_frame({'type': 'user_list', 'users': users})
+
+    # কিউ মেসেজে ভরে গেলে আর জমানো নয়: কোথা থেকে আবার শুরু করবে জানিয়ে বন্ধ
+    async def close_slow_client(self, last_message_id):
+        await self.write(*self.encode_frame({'type': 'resume', 'message_id': last_message_id}))
+        await self.close(code=4008)
+
+    # পুরনো ইভেন্ট হ্যান্ডলার: আগের ভার্সনের ওয়ার্কার থেকে আসা ইভেন্টের জন্য রাখা
     async def chat_message_broadcast(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'chat_message',
             'message': event['message'],
             'username': event['username'],
@@ -143,56 +377,204 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message_id': event.get('message_id'),
             'image_url': event.get('image_url'),
             'audio_url': event.get('audio_url'),
-        }))
+        })
 
     async def typing_status(self, event):
-        await self.send(text_data=json.dumps({'type': 'typing', 'username': event['username']}))
+        await self.send_frame({
+            'type': 'typing',
+            'username': event['username'],
+            'state': event.get('state', 'start'),
+            'ttl': event.get('ttl'),
+        })
 
     async def user_list_update(self, event):
-        await self.send(text_data=json.dumps({'type': 'user_list', 'users': event['users']}))
+        await self.send_frame({'type': 'user_list', 'users': event['users']})
 
     async def message_read_update(self, event):
-        await self.send(text_data=json.dumps({'type': 'message_read', 'message_id': event['message_id']}))
+        await self.send_frame({
+            'type': 'message_read',
+            'message_id': event['message_id'],
+            'up_to': event.get('up_to', event['message_id']),
+            'reader': event.get('reader'),
+        })
+
+    async def presence_update(self, event):
+        await self.send_frame({'type': 'presence', 'joined': event['joined'], 'left': event['left']})
+
+    def resume_after(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return int(query['after'][0])
+        except (KeyError, ValueError):
+            return None
+
+    async def replay_missed(self, after):
+        # শুধু রিং বা ডাটাবেস: রিসেন্ট ক্যাশ অন্য ওয়ার্কারের মেসেজ দেখে না, তাই "সম্পূর্ণ" বলা যায় না
+        frames = await self.replay.since(self.room_group_name, after)
+        complete = True
+        if frames is None:
+            frames, complete = await self.missed_messages(after)
+        for frame in frames:
+            await self.send_frame(frame)
+        # complete=False হলে ফাঁকটা বেশি বড়, ক্লায়েন্ট পেজ রিলোড করবে
+        await self.send_frame({'type': 'replay', 'count': len(frames), 'complete': complete})
 
+    # পুরো লিস্ট শুধু নতুন সকেটকে, বাকিদের কাছে শুধু join/leave ডেল্টা
     async def send_online_users(self):
-        await self.channel_layer.group_send(
-            self.room_group_name, {'type': 'user_list_update', 'users': list(ChatConsumer.online_users)}
+        users = await self.presence.members(self.room_group_name)
+        await self.send_frame({'type': 'user_list', 'users': users})
+
+    async def broadcast_presence(self, joined, left):
+        if joined or left:
+            await self.broadcast_frame({'type': 'presence', 'joined': joined, 'left': left})
+
+    async def presence_heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.CHAT_PRESENCE_HEARTBEAT)
+            joined, left = await self.presence.heartbeat(
+                self.room_group_name, self.user.username, self.channel_name
+            )
+            await self.broadcast_presence(joined, left)
+
+    # রিড রিসিপ্ট: ছোট উইন্ডোতে জমিয়ে একবারে "X পর্যন্ত পড়া হয়েছে"
+    def queue_read_receipt(self, message_id):
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return
+        if self.user_id is None or message_id <= max(self.read_up_to, self.pending_read or 0):
+            return
+        self.pending_read = message_id
+        if self.read_receipt_task is None:
+            self.read_receipt_task = asyncio.ensure_future(self.read_receipt_window())
+
+    async def read_receipt_window(self):
+        await asyncio.sleep(settings.CHAT_READ_RECEIPT_WINDOW)
+        self.read_receipt_task = None
+        await self.flush_read_receipts()
+
+    async def flush_read_receipts(self):
+        up_to, self.pending_read = self.pending_read, None
+        if up_to is None:
+            return
+        self.read_up_to = up_to
+        with WS_PHASE.time(phase='mark_read'):
+            updated = await self.mark_read_up_to(up_to)
+        if updated:
+            await self.broadcast_frame({
+                'type': 'message_read',
+                'message_id': up_to,
+                'up_to': up_to,
+                'reader': self.user.username,
+            })
+
+    # write-behind মোড: আইডি আগে, ডাটাবেসে লেখা পরে (ব্যাচে)
+    def enqueue_message(self, message_content):
+        if self.user_id is None:
+            return None
+        kind = 'private' if self.room_name.startswith('private_') else 'public'
+        # save_message-এর মতো: রুম না থাকলে ব্রডকাস্টও নয়
+        if kind == 'private' and self.room_pk is None:
+            return None
+        row = self.write_behind.enqueue(kind, self.user_id, self.room_name, message_content)
+        recent_messages.add_row(row, self.user.username)
+        self.inbox.message(
+            self.room_name, self.inbox_members, row['id'], datetime.datetime.fromisoformat(row['timestamp']),
+            self.user_id, self.user.username, snippet(message_content),
         )
+        return row['id']
 
     # ডাটাব্যাস মেথডস (সংশোধিত)
-    @database_sync_to_async
-    def save_message(self, username, room_name, message_content, image_file=None, audio_file=None):
+    @db_sync_to_async
+    @DB_SECONDS.time(op='resolve_private_room')
+    def resolve_private_room(self):
+        return get_private_room(self.room_name)
+
+    # প্রতি মেসেজে শুধু একটি INSERT, কোনো SELECT নয়
+    @db_sync_to_async
+    @DB_SECONDS.time(op='save_message')
+    def save_message(self, message_content, image_file=None, audio_file=None):
+        if self.user_id is None:
+            return None
+        # write-behind চালু থাকলে টেক্সট মেসেজের মতো একই snowflake আইডি, দুই রকম আইডি এক টেবিলে নয়
+        ids = {'id': self.write_behind.ids.next_id()} if self.write_behind else {}
         try:
-            user = User.objects.get(username=username)
-            if room_name.startswith('private_'):
-                private_room = PrivateChatRoom.objects.get(room_id=room_name)
-                return PrivateMessage.objects.create(
-                    room=private_room,
-                    sender=user,
+            if self.room_name.startswith('private_'):
+                if self.room_pk is None:
+                    return None
+                msg_obj = PrivateMessage.objects.create(
+                    **ids,
+                    room_id=self.room_pk,
+                    sender_id=self.user_id,
                     content=message_content,
                     image=image_file,
                     audio=audio_file
                 )
             else:
-                return Message.objects.create(
-                    user=user, 
-                    room_name=room_name,
+                msg_obj = Message.objects.create(
+                    **ids,
+                    user_id=self.user_id, 
+                    room_name=self.room_name,
                     content=message_content,
                     image=image_file,
                     audio=audio_file
                 )
-        except Exception as e:
-            print(f"Error saving message: {e}")
+            # রুম পেজ আর রিকানেক্ট এই ক্যাশ থেকেই পড়ে
+            recent_messages.add(self.room_name, from_model(msg_obj, self.user.username))
+            self.inbox.message(
+                self.room_name, self.inbox_members, msg_obj.id, msg_obj.timestamp, self.user_id,
+                self.user.username, snippet(message_content, bool(msg_obj.image), bool(msg_obj.audio)),
+            )
+            return msg_obj
+        except IntegrityError as e:
+            # রুম ডিলিট হয়ে গেলে ক্যাশ করা আইডি আর কাজে আসবে না
+            private_rooms.pop(self.room_name)
+            self.room_pk = None
+            ERRORS.inc(where='save_message')
+            logger.warning("Could not save message to %s: %s", self.room_name, e)
+            return None
+        except Exception:
+            ERRORS.inc(where='save_message')
+            logger.exception("Could not save message to %s", self.room_name)
             return None
 
-    @database_sync_to_async
-    def mark_message_as_read(self, msg_id):
-        Message.objects.filter(id=msg_id).update(is_read=True)
-        PrivateMessage.objects.filter(id=msg_id).update(is_read=True)
-
-    @database_sync_to_async
-    def update_user_status(self, user, status):
-        profile, created = UserProfile.objects.get_or_create(user=user)
-        profile.is_online = status
-        profile.last_seen = timezone.now()
-        profile.save()
\ No newline at end of file
+    # সঠিক টেবিলে একটাই UPDATE, তারপর ইউজারের high-water mark
+    @db_sync_to_async
+    @DB_SECONDS.time(op='mark_read_up_to')
+    def mark_read_up_to(self, up_to):
+        if self.room_name.startswith('private_'):
+            if self.room_pk is None:
+                return 0
+            unread = PrivateMessage.objects.filter(room_id=self.room_pk).exclude(sender_id=self.user_id)
+        else:
+            unread = Message.objects.filter(room_name=self.room_name).exclude(user_id=self.user_id)
+        with transaction.atomic():
+            updated = unread.filter(id__lte=up_to, is_read=False).update(is_read=True)
+            ReadMarker.objects.bulk_create(
+                [ReadMarker(user_id=self.user_id, room_name=self.room_name, last_read_id=up_to)],
+                update_conflicts=True,
+                unique_fields=['user', 'room_name'],
+                update_fields=['last_read_id', 'updated_at'],
+            )
+        recent_messages.mark_read(self.room_name, up_to, self.user_id)
+        self.inbox.read(self.user_id, self.room_name, self.inbox_members.get(self.user_id), up_to)
+        return updated
+
+    # রিং বাফারে না থাকলে: আগের মেসেজের টাইমস্ট্যাম্প, তারপর একটা keyset পেজ
+    @db_sync_to_async
+    @DB_SECONDS.time(op='missed_messages')
+    def missed_messages(self, after):
+        messages = room_messages(self.room_name)
+        anchor = messages.select_related(None).only('id', 'timestamp').filter(id=after).first()
+        if anchor is None:
+            return [], False
+        page, has_more = fetch_page(messages, after=encode_cursor(anchor), limit=settings.CHAT_REPLAY_LIMIT)
+        page.reverse()
+        frames = []
+        for msg in page:
+            data = serialize_message(msg)
+            frames.append(chat_message_frame(
+                data['username'], data['timestamp'], data['message_id'], data['message'],
+                data['image_url'], data['audio_url'],
+            ))
+        return frames, not has_more
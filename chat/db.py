@@ -0,0 +1,95 @@
+"""
+Database calls from async code. ``database_sync_to_async`` runs every call
+on the single thread asgiref keeps for thread-sensitive code, so a worker
+makes one query at a time however many sockets are waiting on it. With
+CHAT_DB_THREADS set, ``db_sync_to_async`` runs them on a dedicated pool of
+that many threads instead, each holding its own connection; the database
+must accept CHAT_DB_THREADS connections per worker.
+
+On PostgreSQL with CHAT_DB_POOL_MAX those threads (and the request
+threads) borrow connections from Django's psycopg pool for the length of
+one call, so the pool size, not the thread count, bounds a worker's
+connections. Its statistics are exported as chat_db_pool_* metrics.
+
+Django's async ORM methods (``acreate``, ``aupdate``, ...) are
+sync_to_async wrappers around the same single thread, so they would not
+add any concurrency until Django has async database backends.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .metrics import Collected
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_db_executor():
+    """The CHAT_DB_THREADS pool, or None to use asgiref's shared thread."""
+    global _executor
+    size = settings.CHAT_DB_THREADS
+    if size <= 0:
+        return None
+    with _lock:
+        if _executor is None or _executor._max_workers != size:
+            # সেটিং বদলালে (টেস্ট, বেঞ্চমার্ক) নতুন পুল; পুরনোটা চলতি কাজ শেষ করে থামে
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='chat-db')
+        return _executor
+
+
+def db_sync_to_async(func):
+    """``database_sync_to_async`` on the CHAT_DB_THREADS pool when one is configured."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        executor = get_db_executor()
+        if executor is None:
+            return await database_sync_to_async(func)(*args, **kwargs)
+        return await database_sync_to_async(func, thread_sensitive=False, executor=executor)(*args, **kwargs)
+
+    return wrapper
+
+
+def pool_stats():
+    """psycopg_pool statistics of the default database, empty without a pool."""
+    pool = getattr(connections['default'], 'pool', None)
+    return pool.get_stats() if pool is not None else {}
+
+
+def _collect(*keys, scale=1):
+    def collect():
+        stats = pool_stats()
+        if not stats:
+            return []
+        if len(keys) == 1:
+            return [({}, stats.get(keys[0], 0) * scale)]
+        # psycopg_pool শূন্য কাউন্টার রিপোর্ট করে না
+        return [({'stat': key}, stats.get(key, 0) * scale) for key in keys]
+    return collect
+
+
+DB_POOL_CONNECTIONS = Collected(
+    'chat_db_pool_connections', 'Pooled database connections: pool_max, pool_size (open) and pool_available (idle).',
+    'gauge', _collect('pool_max', 'pool_size', 'pool_available'),
+)
+DB_POOL_WAITING = Collected(
+    'chat_db_pool_waiting', 'Threads currently waiting for a pooled connection.', 'gauge', _collect('requests_waiting'),
+)
+DB_POOL_REQUESTS = Collected(
+    'chat_db_pool_requests_total', 'Connections requested from the pool.', 'counter', _collect('requests_num'),
+)
+DB_POOL_WAIT = Collected(
+    'chat_db_pool_wait_seconds_total', 'Time spent waiting for a pooled connection.', 'counter',
+    _collect('requests_wait_ms', scale=0.001),
+)
+DB_POOL_ERRORS = Collected(
+    'chat_db_pool_errors_total', 'Pool timeouts (requests_errors), failed connects and connections found broken.',
+    'counter', _collect('requests_errors', 'connections_errors', 'connections_lost'),
+)
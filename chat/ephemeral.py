@@ -0,0 +1,131 @@
+"""
+Room events that are fanned out but never stored: typing indicators and
+client-defined ephemeral frames. Losing one is harmless, so they never
+wait on the database or queue up behind a slow channel layer.
+"""
+import asyncio
+import time
+
+from channels.exceptions import ChannelFull
+from django.conf import settings
+
+from .fanout import publish
+from .frames import encode, frame_event
+from .metrics import EPHEMERAL_DROPPED
+
+MAX_EVENT_SIZE = 1024
+
+
+class EphemeralSender:
+    """
+    Fire-and-forget group_send. At most one send is in flight per
+    connection; events arriving meanwhile replace the queued one rather
+    than piling up, and a full channel drops the event.
+    """
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.task = None
+        self.queued = None
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, group, event):
+        if self.task is not None and not self.task.done():
+            if self.queued is not None:
+                self.dropped += 1
+                EPHEMERAL_DROPPED.inc()
+            self.queued = (group, event)
+            return
+        self.task = asyncio.ensure_future(self._drain(group, event))
+
+    async def _drain(self, group, event):
+        while True:
+            try:
+                await publish(self.channel_layer, group, event)
+                self.sent += 1
+            except ChannelFull:
+                self.dropped += 1
+                EPHEMERAL_DROPPED.inc()
+            if self.queued is None:
+                return
+            (group, event), self.queued = self.queued, None
+
+
+class TypingIndicator:
+    """
+    Per-connection typing state. Keystrokes only produce an event on the
+    idle -> typing transition and then at most once per ``idle`` seconds
+    while they continue; a 'stop' follows ``idle`` seconds after the last
+    keystroke. Receivers also expire the indicator after ``ttl`` in case
+    the 'stop' is dropped.
+    """
+
+    def __init__(self, sender, group, username, idle=None):
+        self.sender = sender
+        self.group = group
+        self.username = username
+        self.idle = settings.CHAT_TYPING_IDLE if idle is None else idle
+        self.typing = False
+        self.last_event = 0.0
+        self.last_key = 0.0
+        self.timer = None
+
+    def keystroke(self):
+        now = time.monotonic()
+        self.last_key = now
+        if not self.typing or now - self.last_event >= self.idle:
+            self.typing = True
+            self.last_event = now
+            self._emit('start')
+        if self.timer is None:
+            self.timer = asyncio.ensure_future(self._expire())
+
+    def stop(self):
+        self._cancel_timer()
+        if self.typing:
+            self.typing = False
+            self._emit('stop')
+
+    def reset(self):
+        """End typing silently; receivers clear the indicator when the message itself arrives."""
+        self._cancel_timer()
+        self.typing = False
+
+    async def _expire(self):
+        while True:
+            remaining = self.last_key + self.idle - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        self.timer = None
+        self.stop()
+
+    def _cancel_timer(self):
+        if self.timer is not None and self.timer is not asyncio.current_task():
+            self.timer.cancel()
+        self.timer = None
+
+    def _emit(self, state):
+        self.sender.send(self.group, frame_event({
+            'type': 'typing',
+            'username': self.username,
+            'state': state,
+            'ttl': self.idle * 2,
+        }))
+
+
+def ephemeral_event(username, frame):
+    """Group event for a client 'ephemeral' frame, or None if it is malformed or too large."""
+    name = frame.get('event')
+    if not isinstance(name, str) or not name or len(name) > 64:
+        return None
+    data = frame.get('data')
+    # বাইনারি প্রোটোকলে bytes বা অন্য টাইপ আসতে পারে, যা JSON ক্লায়েন্টদের পাঠানো যায় না
+    try:
+        size = len(encode(data))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if size > MAX_EVENT_SIZE:
+        return None
+    return frame_event({'type': 'ephemeral', 'event': name, 'username': username, 'data': data})
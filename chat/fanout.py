@@ -0,0 +1,184 @@
+"""
+Room group membership and publishing for rooms too big for one group.
+
+CHAT_GROUP_SHARDS splits ``chat_<room>`` into that many sub-groups
+(``chat_<room>.0`` ...). A member joins one of them by the hash of its
+channel name and a publish goes to all of them, so no single Redis key
+holds, and no single group_send walks, the whole room. With several
+REDIS_URLS the sub-groups land on different hosts.
+
+CHAT_LOCAL_FANOUT adds a per-worker tier: the first socket of a room in
+this process opens one relay channel that joins the group in its place,
+and the relay hands each event to the room's local consumers directly.
+A room then has one group member per worker instead of one per socket,
+and an event crosses the channel layer once per worker.
+
+Every worker has to run with the same CHAT_GROUP_SHARDS. With one shard
+the group keeps its plain name, so workers with and without the local
+tier can be mixed during a rolling deploy.
+"""
+import asyncio
+import logging
+import weakref
+import zlib
+
+from channels.consumer import get_handler_name
+from django.conf import settings
+
+from .metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+# relays re-join their groups well within channels_redis' default group_expiry of a day
+REFRESH_INTERVAL = 60 * 60
+
+
+def shard_groups(group):
+    shards = settings.CHAT_GROUP_SHARDS
+    if shards <= 1:
+        return [group]
+    return [f'{group}.{i}' for i in range(shards)]
+
+
+def shard_for(group, channel_name):
+    shards = settings.CHAT_GROUP_SHARDS
+    if shards <= 1:
+        return group
+    return f'{group}.{zlib.crc32(channel_name.encode()) % shards}'
+
+
+async def publish(channel_layer, group, event):
+    groups = shard_groups(group)
+    if len(groups) == 1:
+        await channel_layer.group_send(group, event)
+    else:
+        await asyncio.gather(*(channel_layer.group_send(shard, event) for shard in groups))
+
+
+async def join(channel_layer, group, consumer):
+    if settings.CHAT_LOCAL_FANOUT:
+        await get_local_fanout(channel_layer).join(group, consumer)
+    else:
+        await channel_layer.group_add(shard_for(group, consumer.channel_name), consumer.channel_name)
+
+
+async def leave(channel_layer, group, consumer):
+    if settings.CHAT_LOCAL_FANOUT:
+        await get_local_fanout(channel_layer).leave(group, consumer)
+    else:
+        await channel_layer.group_discard(shard_for(group, consumer.channel_name), consumer.channel_name)
+
+
+class Relay:
+    __slots__ = ('group', 'channel', 'consumers', 'ready', 'task')
+
+    def __init__(self, group):
+        self.group = group
+        self.channel = None
+        self.consumers = set()
+        # True once the relay is in the group, False if joining failed
+        self.ready = asyncio.get_running_loop().create_future()
+        self.task = None
+
+
+class LocalFanout:
+    """The relays of one channel layer in this process, one per room with local sockets."""
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.rooms = {}
+        self.loop = None
+        self.refresher = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # নতুন ইভেন্ট লুপ (টেস্ট, বেঞ্চমার্ক): আগের লুপের রিলেগুলো আর চলে না
+            self.rooms.clear()
+            self.loop = loop
+            self.refresher = loop.create_task(self._refresh_loop())
+
+    async def join(self, group, consumer):
+        self.start()
+        relay = self.rooms.get(group)
+        if relay is not None:
+            relay.consumers.add(consumer)
+            # কানেক্ট শেষ হওয়ার আগেই রিলে গ্রুপে থাকতে হবে, নাহলে রিপ্লের পরের মেসেজ হারাবে
+            if await asyncio.shield(relay.ready):
+                return
+            relay.consumers.discard(consumer)
+            await self.join(group, consumer)
+            return
+
+        relay = self.rooms[group] = Relay(group)
+        relay.consumers.add(consumer)
+        try:
+            relay.channel = await self.channel_layer.new_channel('fanout')
+            relay.task = asyncio.ensure_future(self._relay(relay))
+            await self.channel_layer.group_add(shard_for(group, relay.channel), relay.channel)
+        except BaseException:
+            self._forget(relay)
+            relay.ready.set_result(False)
+            raise
+        relay.ready.set_result(True)
+        if not relay.consumers:
+            # তৈরি হওয়ার মধ্যেই সবাই চলে গেছে
+            await self._close(relay)
+
+    async def leave(self, group, consumer):
+        relay = self.rooms.get(group)
+        if relay is None or consumer not in relay.consumers:
+            return
+        relay.consumers.discard(consumer)
+        if not relay.consumers and relay.ready.done():
+            await self._close(relay)
+
+    def _forget(self, relay):
+        if self.rooms.get(relay.group) is relay:
+            del self.rooms[relay.group]
+        if relay.task is not None:
+            relay.task.cancel()
+
+    async def _close(self, relay):
+        self._forget(relay)
+        await self.channel_layer.group_discard(shard_for(relay.group, relay.channel), relay.channel)
+
+    async def _relay(self, relay):
+        while True:
+            try:
+                event = await self.channel_layer.receive(relay.channel)
+                handler_name = get_handler_name(event)
+            except Exception:
+                ERRORS.inc(where='fanout_receive')
+                logger.exception("Relay for %s could not receive", relay.group)
+                await asyncio.sleep(1)
+                continue
+            # AsyncConsumer.dispatch নয়: হ্যান্ডলারগুলো শুধু কিউতে রাখে, ডাটাবেস ছোঁয় না
+            for consumer in list(relay.consumers):
+                try:
+                    await getattr(consumer, handler_name)(event)
+                except Exception:
+                    ERRORS.inc(where='fanout')
+                    logger.exception("Could not relay %s to a socket in %s", event.get('type'), relay.group)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            for relay in list(self.rooms.values()):
+                if not relay.ready.done():
+                    continue
+                try:
+                    await self.channel_layer.group_add(shard_for(relay.group, relay.channel), relay.channel)
+                except Exception:
+                    ERRORS.inc(where='fanout_refresh')
+                    logger.exception("Could not refresh the relay of %s", relay.group)
+
+
+_fanouts = weakref.WeakKeyDictionary()
+
+
+def get_local_fanout(channel_layer):
+    fanout = _fanouts.get(channel_layer)
+    if fanout is None:
+        fanout = _fanouts[channel_layer] = LocalFanout(channel_layer)
+    return fanout
@@ -0,0 +1,50 @@
+"""
+Client-facing frames for room broadcasts. The sender encodes a frame once
+per enabled protocol and the group event carries the encoded forms, so each
+recipient only forwards the one its socket negotiated instead of
+rebuilding and re-serializing the same dict.
+"""
+import ujson
+
+from .outbound import classify
+from .protocol import enabled_codecs
+
+FRAME_EVENT = 'chat.frame'
+
+
+def encode(frame):
+    return ujson.dumps(frame, ensure_ascii=False, escape_forward_slashes=False)
+
+
+def resume_id(frame):
+    """The message id a delivered frame advances the resume cursor to; only chat messages do."""
+    return frame.get('message_id') if frame.get('type') == 'chat_message' else None
+
+
+def frame_event(frame):
+    """
+    Group event for ChatConsumer.chat_frame carrying ``frame`` pre-encoded,
+    plus what the recipient's outbound queue needs to know about it.
+    """
+    kind, key = classify(frame)
+    event = {'type': FRAME_EVENT, 'text': encode(frame), 'kind': kind}
+    if key:
+        event['key'] = key
+    message_id = resume_id(frame)
+    if message_id is not None:
+        event['message_id'] = message_id
+    for codec in enabled_codecs():
+        event[codec.name] = codec.encode(frame)
+    return event
+
+
+def chat_message_frame(username, timestamp, message_id, message='', image_url=None, audio_url=None):
+    return {
+        'type': 'chat_message',
+        'message': message,
+        'username': username,
+        'timestamp': timestamp,
+        'message_id': message_id,
+        'image_url': image_url,
+        'audio_url': audio_url,
+    }
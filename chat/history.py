@@ -0,0 +1,187 @@
+import base64
+import datetime
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import LRUCache, get_private_room
+from .models import ArchiveSegment, Message, PrivateMessage
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# chat.archive সেগমেন্টে যে ফাইল ফিল্ডগুলোর নাম রাখা হয়
+FILE_FIELDS = ('image', 'audio', 'image_webp', 'thumbnail', 'audio_compressed')
+
+# পেজ করে স্ক্রল করলে একই সেগমেন্ট বারবার পড়া হয়
+segments = LRUCache(32)
+
+
+def encode_cursor(message):
+    return encode_key(message.timestamp, message.id)
+
+
+def encode_key(timestamp, pk):
+    raw = json.dumps([timestamp.isoformat(), pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor.')
+
+
+def message_model(room_name):
+    return PrivateMessage if room_name.startswith('private_') else Message
+
+
+def room_messages(room_name):
+    if room_name.startswith('private_'):
+        room = get_private_room(room_name)
+        if room is None:
+            return PrivateMessage.objects.none()
+        return PrivateMessage.objects.filter(room_id=room.pk).select_related('sender')
+    return Message.objects.filter(room_name=room_name).select_related('user')
+
+
+def fetch_page(queryset, before=None, after=None, limit=PAGE_SIZE):
+    """
+    Keyset pagination on (timestamp, id). Pages are always newest-first;
+    ``before``/``after`` are cursors from a previous page. Returns the page
+    and whether more rows exist past it in the direction being walked.
+    """
+    if after:
+        timestamp, message_id = decode_cursor(after)
+        queryset = queryset.filter(timestamp__gte=timestamp).filter(
+            Q(timestamp__gt=timestamp) | Q(id__gt=message_id)
+        ).order_by('timestamp', 'id')
+    else:
+        if before:
+            timestamp, message_id = decode_cursor(before)
+            queryset = queryset.filter(timestamp__lte=timestamp).filter(
+                Q(timestamp__lt=timestamp) | Q(id__lt=message_id)
+            )
+        queryset = queryset.order_by('-timestamp', '-id')
+
+    rows = list(queryset[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after:
+        rows.reverse()
+    return rows, has_more
+
+
+def from_record(record, model):
+    """An unsaved message that serialize_message and recent.from_model render like a row."""
+    msg = model(
+        id=record['id'], content=record['content'], timestamp=record['timestamp'], is_read=record['is_read'],
+        image_width=record['image_width'], image_height=record['image_height'],
+        **{field: record[field] for field in FILE_FIELDS},
+    )
+    author = User(id=record['user_id'], username=record['username'])
+    if model is PrivateMessage:
+        msg.sender = author
+    else:
+        msg.user = author
+    return msg
+
+
+def read_segment(segment):
+    records = segments.get(segment.id)
+    if records is None:
+        with gzip.open(os.path.join(settings.CHAT_ARCHIVE_DIR, segment.path), 'rt', encoding='utf-8') as fh:
+            records = [json.loads(line) for line in fh]
+        for record in records:
+            record['timestamp'] = datetime.datetime.fromisoformat(record['timestamp'])
+        segments.set(segment.id, records)
+    return records
+
+
+def _key(record):
+    return record['timestamp'], record['id']
+
+
+def archived_page(room_name, before=None, after=None, limit=PAGE_SIZE):
+    """fetch_page over the room's archive: newest first, and whether more exist past it."""
+    found = ArchiveSegment.objects.filter(room_name=room_name)
+    if after:
+        key = decode_cursor(after)
+        found = found.filter(last_timestamp__gte=key[0]).order_by('last_timestamp', 'last_id')
+    else:
+        key = decode_cursor(before) if before else None
+        if key:
+            found = found.filter(first_timestamp__lte=key[0])
+        found = found.order_by('-last_timestamp', '-last_id')
+
+    rows = []
+    for segment in found.iterator():
+        records = read_segment(segment)
+        for record in (records if after else reversed(records)):
+            if key is None or (_key(record) > key if after else _key(record) < key):
+                rows.append(record)
+                if len(rows) > limit:
+                    break
+        if len(rows) > limit:
+            break
+
+    has_more = len(rows) > limit
+    model = message_model(room_name)
+    rows = [from_record(record, model) for record in rows[:limit]]
+    if after:
+        rows.reverse()
+    return rows, has_more
+
+
+def fetch_history(room_name, before=None, after=None, limit=PAGE_SIZE):
+    """
+    fetch_page over the room's rows and then its archive. Archived messages
+    are always older than the rows left in the table, so walking back
+    continues into the archive and walking forward leaves it.
+    """
+    if after:
+        archived, has_more = archived_page(room_name, after=after, limit=limit)
+        if has_more:
+            return archived, True
+        rows, has_more = fetch_page(room_messages(room_name), after=after, limit=limit - len(archived))
+        return rows + archived, has_more
+
+    rows, has_more = fetch_page(room_messages(room_name), before=before, limit=limit)
+    if has_more:
+        return rows, True
+    archived, has_more = archived_page(
+        room_name, before=encode_cursor(rows[-1]) if rows else before, limit=limit - len(rows)
+    )
+    return rows + archived, has_more
+
+
+def media_urls(msg):
+    """Media of a message, preferring the variants chat.media made over the originals."""
+    image = msg.image_webp or msg.image
+    audio = msg.audio_compressed or msg.audio
+    return {
+        'image_url': image.url if image else None,
+        'thumbnail_url': msg.thumbnail.url if msg.thumbnail else None,
+        'width': msg.image_width,
+        'height': msg.image_height,
+        'audio_url': audio.url if audio else None,
+    }
+
+
+def serialize_message(msg):
+    author = msg.sender if isinstance(msg, PrivateMessage) else msg.user
+    return {
+        'message_id': msg.id,
+        'username': author.username,
+        'message': msg.content or '',
+        **media_urls(msg),
+        'timestamp': timezone.localtime(msg.timestamp).strftime('%I:%M %p'),
+        'is_read': msg.is_read,
+    }
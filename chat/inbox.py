@@ -0,0 +1,210 @@
+"""
+Conversation inbox: one Conversation row per user and room with the last
+message, a snippet and the user's unread count, so the landing page is a
+single indexed query however many users and messages there are.
+
+The consumer reports every saved message and read receipt to the
+InboxWriter, which writes what each room received during the last
+CHAT_INBOX_FLUSH_INTERVAL seconds with one INSERT for missing rows and one
+UPDATE, off the message path. Private rooms get a row for both
+participants with their first message; in a public room a user gets one
+once they post or send a read receipt there.
+
+Like online status this is best-effort: a failed flush is logged and
+dropped. A user's unread count is recounted from the messages table on
+their next read receipt, so it cannot drift for long.
+"""
+import asyncio
+import collections
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from django.utils import timezone
+
+from .db import db_sync_to_async
+from .history import decode_cursor, encode_key, room_messages
+from .metrics import DB_SECONDS
+from .models import Conversation, PrivateMessage
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 30
+SNIPPET_LENGTH = 100
+
+
+def snippet(content, image=False, audio=False):
+    if content:
+        return content[:SNIPPET_LENGTH]
+    if image:
+        return '📷 Photo'
+    if audio:
+        return '🎤 Voice message'
+    return ''
+
+
+def room_members(room, user_id):
+    """user_id -> peer_id of the rows a message in the room needs: both participants, or the public sender."""
+    if room is not None:
+        return {room.user1_id: room.user2_id, room.user2_id: room.user1_id}
+    return {user_id: None}
+
+
+class RoomDelta:
+    __slots__ = ('last', 'total', 'by_sender', 'members')
+
+    def __init__(self):
+        # (message_id, timestamp, sender name, snippet) of the newest message
+        self.last = None
+        self.total = 0
+        self.by_sender = collections.Counter()
+        # user_id -> peer_id for rows that must exist before the UPDATE
+        self.members = {}
+
+
+def unread_after(room_name, user_id, up_to):
+    messages = room_messages(room_name).filter(id__gt=up_to)
+    author = 'sender_id' if messages.model is PrivateMessage else 'user_id'
+    return messages.exclude(**{author: user_id}).count()
+
+
+@DB_SECONDS.time(op='write_inbox')
+def write_inbox(rooms, reads):
+    with transaction.atomic():
+        Conversation.objects.bulk_create([
+            *(Conversation(user_id=user_id, room_name=room_name, peer_id=peer_id)
+              for room_name, delta in rooms.items() for user_id, peer_id in delta.members.items()),
+            *(Conversation(user_id=user_id, room_name=room_name, peer_id=peer_id)
+              for (user_id, room_name), (_, peer_id) in reads.items()),
+        ], ignore_conflicts=True)
+
+        for room_name, delta in rooms.items():
+            message_id, timestamp, sender, text = delta.last
+            # অন্য ওয়ার্কারের নতুন মেসেজ আগে লেখা হয়ে থাকলে শেষ মেসেজ পিছিয়ে যাবে না
+            newer = Q(last_message_id__lt=message_id)
+            # নিজের পাঠানো মেসেজ নিজের কাছে না-পড়া নয়
+            own = Case(*(When(user_id=user_id, then=Value(count)) for user_id, count in delta.by_sender.items()),
+                       default=Value(0))
+            Conversation.objects.filter(room_name=room_name).update(
+                last_message_id=Case(
+                    When(newer, then=Value(message_id)), default=F('last_message_id'), output_field=BigIntegerField()
+                ),
+                last_message_at=Case(When(newer, then=Value(timestamp)), default=F('last_message_at')),
+                last_sender=Case(When(newer, then=Value(sender)), default=F('last_sender')),
+                snippet=Case(When(newer, then=Value(text)), default=F('snippet')),
+                unread_count=F('unread_count') + delta.total - own,
+            )
+
+        for (user_id, room_name), (up_to, _) in reads.items():
+            Conversation.objects.filter(user_id=user_id, room_name=room_name).update(
+                unread_count=unread_after(room_name, user_id, up_to)
+            )
+
+
+class InboxWriter:
+    """
+    Collects inbox updates in memory. ``message`` and ``read`` are called
+    from the database threads as well as the event loop, hence the lock.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.rooms = {}
+        # (user_id, room_name) -> (highest read message id, peer_id)
+        self.reads = {}
+        self.lock = threading.Lock()
+        self.flusher = None
+
+    def message(self, room_name, members, message_id, timestamp, sender_id, sender_name, text):
+        with self.lock:
+            delta = self.rooms.get(room_name)
+            if delta is None:
+                delta = self.rooms[room_name] = RoomDelta()
+            delta.total += 1
+            delta.by_sender[sender_id] += 1
+            if delta.last is None or message_id > delta.last[0]:
+                delta.last = (message_id, timestamp, sender_name, text)
+            for user_id, peer_id in members.items():
+                delta.members.setdefault(user_id, peer_id)
+
+    def read(self, user_id, room_name, peer_id, up_to):
+        with self.lock:
+            previous = self.reads.get((user_id, room_name))
+            if previous is None or previous[0] < up_to:
+                self.reads[(user_id, room_name)] = (up_to, peer_id)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.flusher is None or self.flusher.done() or self.flusher.get_loop() is not loop:
+            if self.flusher is not None and self.flusher.get_loop() is not loop:
+                # নতুন ইভেন্ট লুপ (টেস্ট, বেঞ্চমার্ক): আগের লুপের জমা আপডেট বাদ
+                self._collect()
+            self.flusher = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def _collect(self):
+        with self.lock:
+            rooms, self.rooms = self.rooms, {}
+            reads, self.reads = self.reads, {}
+        return rooms, reads
+
+    async def flush(self):
+        rooms, reads = self._collect()
+        if not rooms and not reads:
+            return 0
+        try:
+            await db_sync_to_async(write_inbox)(rooms, reads)
+        except Exception:
+            logger.exception("Could not update the inbox for %d rooms and %d reads", len(rooms), len(reads))
+            return 0
+        return len(rooms) + len(reads)
+
+
+_writer = None
+
+
+def get_inbox_writer():
+    global _writer
+    if _writer is None:
+        _writer = InboxWriter(settings.CHAT_INBOX_FLUSH_INTERVAL)
+    return _writer
+
+
+def inbox_page(user_id, cursor=None, limit=PAGE_SIZE):
+    """
+    A user's conversations, most recent first, with the cursor of the next
+    page or None. One query on (user, last_message_at, id).
+    """
+    conversations = Conversation.objects.filter(user_id=user_id).select_related('peer__userprofile')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        conversations = conversations.filter(last_message_at__lte=timestamp).filter(
+            Q(last_message_at__lt=timestamp) | Q(id__lt=pk)
+        )
+    rows = list(conversations.order_by('-last_message_at', '-id')[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_key(rows[-1].last_message_at, rows[-1].id)
+
+
+def serialize_conversation(conversation):
+    peer = conversation.peer
+    profile = getattr(peer, 'userprofile', None) if peer else None
+    return {
+        'room': conversation.room_name,
+        'title': peer.username if peer else conversation.room_name,
+        'peer_id': conversation.peer_id,
+        'online': bool(profile and profile.is_online),
+        'last_message_id': conversation.last_message_id,
+        'last_sender': conversation.last_sender,
+        'snippet': conversation.snippet,
+        'timestamp': timezone.localtime(conversation.last_message_at).strftime('%I:%M %p'),
+        'unread': conversation.unread_count,
+    }
@@ -0,0 +1,51 @@
+"""
+Move messages past their room's retention into the archive (chat.archive).
+Safe to run from cron at any time and to interrupt: each batch commits on
+its own.
+
+    python manage.py archive_messages
+    python manage.py archive_messages --room general --batch-size 500
+"""
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from chat import partitions
+from chat.archive import archive_room, retention_policies
+
+
+class Command(BaseCommand):
+    help = "Archive messages older than their room's retention."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', action='append', help='Only these rooms (repeatable).')
+        parser.add_argument('--batch-size', type=int, help='Messages per segment (CHAT_ARCHIVE_BATCH_SIZE).')
+        parser.add_argument('--dry-run', action='store_true', help='List the rooms and their retention only.')
+
+    def handle(self, *args, **options):
+        policies = retention_policies()
+        if options['room']:
+            policies = {room: days for room, days in policies.items() if room in options['room']}
+
+        total = 0
+        for room_name, days in sorted(policies.items()):
+            if options['dry_run']:
+                self.stdout.write(f'{room_name}: {days} days')
+                continue
+            moved = archive_room(room_name, days, options['batch_size'])
+            if moved:
+                self.stdout.write(f'{room_name}: archived {moved} messages older than {days} days')
+            total += moved
+
+        if not options['dry_run'] and connection.vendor == 'postgresql' and policies:
+            # সবচেয়ে কম রিটেনশনের আগের খালি মাসগুলো; সারি থাকলে পার্টিশন থেকে যায়
+            before = timezone.now() - datetime.timedelta(days=min(policies.values()))
+            with connection.cursor() as cursor:
+                tables = [table for table in partitions.TABLES if partitions.is_partitioned(cursor, table)]
+            for table in tables:
+                for name in partitions.drop_empty_partitions(table, before):
+                    self.stdout.write(f'dropped empty partition {name}')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} messages from {len(policies)} rooms.'))
@@ -0,0 +1,34 @@
+"""
+Monthly partitions for the message tables on PostgreSQL (chat.partitions).
+Run once with --convert in a quiet period, then daily or weekly from cron
+so the coming months always exist.
+
+    python manage.py partition_messages --convert
+    python manage.py partition_messages --months-ahead 3
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat import partitions
+
+
+class Command(BaseCommand):
+    help = 'Partition the message tables by month and create upcoming partitions (PostgreSQL only).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='Convert unpartitioned tables first.')
+        parser.add_argument('--months-ahead', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Table partitioning needs PostgreSQL.')
+
+        for table in partitions.TABLES:
+            if options['convert'] and partitions.convert(table):
+                self.stdout.write(f'{table}: converted, existing rows are in {table}_legacy')
+            with connection.cursor() as cursor:
+                if not partitions.is_partitioned(cursor, table):
+                    self.stdout.write(self.style.WARNING(f'{table}: not partitioned, run with --convert'))
+                    continue
+            for name in partitions.ensure_partitions(table, options['months_ahead']):
+                self.stdout.write(f'{table}: created {name}')
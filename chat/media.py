@@ -0,0 +1,230 @@
+"""
+Background processing of uploaded images and voice notes. The consumer
+saves and broadcasts the original as before and hands the message to the
+CHAT_MEDIA_BACKEND; when the job is done the room gets a 'media_update'
+frame with the new URLs and clients swap them in.
+
+    images   a WebP copy no larger than CHAT_MEDIA_DISPLAY_SIZE, a WebP
+             thumbnail of CHAT_MEDIA_THUMBNAIL_SIZE and the dimensions
+    audio    mono Opus/Ogg through ffmpeg (CHAT_MEDIA_FFMPEG); without it
+             WAV recordings are only downmixed to 16-bit mono 16 kHz
+
+Originals are kept, so a failed job only means the client keeps showing
+the original. The default backend runs jobs on CHAT_MEDIA_WORKERS threads
+of the worker that received the upload. A task-queue backend can
+serialize the job (a tuple) and call ``run_job`` from its worker instead.
+"""
+import asyncio
+import collections
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import warnings
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+
+from . import fanout
+from .frames import frame_event
+from .history import media_urls
+from .metrics import ERRORS
+from .recent import recent_messages
+
+logger = logging.getLogger(__name__)
+
+WEBP_QUALITY = 80
+OPUS_BITRATE = '24k'
+WAV_RATE = 16000
+
+MediaJob = collections.namedtuple('MediaJob', ['model', 'message_id', 'room_name', 'group'])
+
+
+def media_job(msg, room_name, group):
+    """The job for a freshly saved message, or None if it has nothing to process."""
+    if not msg.image and not msg.audio:
+        return None
+    return MediaJob(msg._meta.label, msg.id, room_name, group)
+
+
+def _stem(field_file):
+    return os.path.splitext(os.path.basename(field_file.name))[0]
+
+
+def _webp(image, size):
+    image = image.copy()
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    out = io.BytesIO()
+    image.save(out, 'WEBP', quality=WEBP_QUALITY)
+    return ContentFile(out.getvalue())
+
+
+def process_image(msg):
+    with msg.image.open('rb') as fh:
+        image = Image.open(fh)
+        animated = getattr(image, 'is_animated', False)
+        image = ImageOps.exif_transpose(image)
+    msg.image_width, msg.image_height = image.size
+    stem = _stem(msg.image)
+    # অ্যানিমেটেড GIF-এর WebP কপি শুধু প্রথম ফ্রেম হতো, তাই আসলটাই দেখানো হয়
+    if not animated:
+        msg.image_webp.save(f'{stem}.webp', _webp(image, settings.CHAT_MEDIA_DISPLAY_SIZE), save=False)
+    msg.thumbnail.save(f'{stem}.webp', _webp(image, settings.CHAT_MEDIA_THUMBNAIL_SIZE), save=False)
+    return ['image_width', 'image_height', 'thumbnail'] + ([] if animated else ['image_webp'])
+
+
+def _ffmpeg():
+    return shutil.which(settings.CHAT_MEDIA_FFMPEG) if settings.CHAT_MEDIA_FFMPEG else None
+
+
+def encode_opus(ffmpeg, data):
+    with tempfile.TemporaryDirectory(prefix='chat-media') as tmp:
+        source, target = os.path.join(tmp, 'in'), os.path.join(tmp, 'out.ogg')
+        with open(source, 'wb') as fh:
+            fh.write(data)
+        subprocess.run(
+            [ffmpeg, '-nostdin', '-loglevel', 'error', '-i', source,
+             '-vn', '-ac', '1', '-c:a', 'libopus', '-b:a', OPUS_BITRATE, target],
+            check=True, capture_output=True, timeout=120,
+        )
+        with open(target, 'rb') as fh:
+            return fh.read()
+
+
+def downmix_wav(data):
+    """16-bit mono WAV_RATE copy of a WAV file, or None if it is not one or would not get smaller."""
+    try:
+        with wave.open(io.BytesIO(data)) as src:
+            channels, width, rate = src.getnchannels(), src.getsampwidth(), src.getframerate()
+            frames = src.readframes(src.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if channels == 1 and width <= 2 and rate <= WAV_RATE:
+        return None
+    with warnings.catch_warnings():
+        # Python 3.13 থেকে audioop নেই; তখন ffmpeg ছাড়া অডিও যেমন আছে তেমন থাকে
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            import audioop
+        except ImportError:
+            return None
+    if channels == 2:
+        frames = audioop.tomono(frames, width, 0.5, 0.5)
+    elif channels != 1:
+        return None
+    if width != 2:
+        frames = audioop.lin2lin(frames, width, 2)
+    if rate > WAV_RATE:
+        frames, _ = audioop.ratecv(frames, 2, 1, rate, WAV_RATE, None)
+        rate = WAV_RATE
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as dst:
+        dst.setnchannels(1)
+        dst.setsampwidth(2)
+        dst.setframerate(rate)
+        dst.writeframes(frames)
+    return out.getvalue()
+
+
+def process_audio(msg):
+    with msg.audio.open('rb') as fh:
+        data = fh.read()
+    ffmpeg = _ffmpeg()
+    if ffmpeg:
+        compressed, ext = encode_opus(ffmpeg, data), 'ogg'
+    else:
+        compressed, ext = downmix_wav(data), 'wav'
+    if compressed is None:
+        return []
+    msg.audio_compressed.save(f'{_stem(msg.audio)}.{ext}', ContentFile(compressed), save=False)
+    return ['audio_compressed']
+
+
+def process_job(job):
+    """
+    Builds the variants of one message and returns its 'media_update'
+    frame, or None if there was nothing to do. Runs in a worker thread.
+    """
+    model = apps.get_model(job.model)
+    msg = model.objects.filter(pk=job.message_id).first()
+    if msg is None:
+        return None
+    fields = []
+    if msg.image and not msg.thumbnail:
+        fields += process_image(msg)
+    if msg.audio and not msg.audio_compressed:
+        fields += process_audio(msg)
+    if not fields:
+        return None
+    # save() নয়: post_save রিসিভার পুরো রুম ক্যাশ বাতিল করত
+    model.objects.filter(pk=msg.pk).update(**{field: getattr(msg, field) for field in fields})
+    return {'type': 'media_update', 'message_id': msg.id, **media_urls(msg)}
+
+
+async def announce(job, frame):
+    recent_messages.set_media(job.room_name, job.message_id, {
+        key: frame[key] for key in ('image_url', 'audio_url', 'thumbnail_url', 'width', 'height')
+    })
+    await fanout.publish(get_channel_layer(), job.group, frame_event(frame))
+
+
+def run_job(job):
+    """Entry point for task-queue backends: process ``job`` and tell the room."""
+    frame = process_job(MediaJob(*job))
+    if frame is not None:
+        async_to_sync(announce)(MediaJob(*job), frame)
+    return frame
+
+
+class MediaBackend:
+    def enqueue(self, job):
+        """Schedule ``job``. Called from the event loop; must not block."""
+        raise NotImplementedError
+
+
+class ThreadPoolBackend(MediaBackend):
+    """Runs jobs in this process, CHAT_MEDIA_WORKERS at a time."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.CHAT_MEDIA_WORKERS, thread_name_prefix='chat-media'
+        )
+        self.tasks = set()
+
+    def enqueue(self, job):
+        task = asyncio.get_running_loop().create_task(self.run(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, job):
+        try:
+            frame = await database_sync_to_async(
+                process_job, thread_sensitive=False, executor=self.executor
+            )(job)
+            if frame is not None:
+                await announce(job, frame)
+        except Exception:
+            ERRORS.inc(where='media')
+            logger.exception("Could not process media of %s %s", job.model, job.message_id)
+
+
+_backend = None
+
+
+def get_media_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.CHAT_MEDIA_BACKEND)()
+    return _backend
@@ -0,0 +1,190 @@
+"""
+In-process counters and latency histograms for the hot paths, rendered in
+the Prometheus text format by ``metrics_view`` (/metrics). Numbers are per
+process, so every daphne worker has to be scraped.
+
+    chat_ws_phase_seconds{phase}      consumer steps: decode, db, channel layer, storage
+    chat_ws_frame_seconds{type}       whole handling of one incoming frame by type
+    chat_db_seconds{op}               time inside the database thread
+    chat_http_request_seconds{view}   Django views, via MetricsMiddleware
+    chat_db_pool_*                    psycopg connection pool, when CHAT_DB_POOL_MAX is set
+"""
+import contextlib
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = {}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        # database_sync_to_async আর storage থ্রেড থেকেও আপডেট হয়
+        self.lock = threading.Lock()
+        registry[name] = self
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, key, value in self.samples():
+            lines.append(f'{name}{_format_labels(key)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Collected(Metric):
+    """
+    Values read at scrape time from ``collect()``, which returns
+    ``(labels, value)`` pairs, for numbers another library already keeps.
+    """
+
+    def __init__(self, name, documentation, kind, collect):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, _label_key(labels), value) for labels, value in self.collect()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Context manager (or decorator for plain functions) observing the elapsed seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = [(key, list(buckets), total, count) for key, (buckets, total, count) in self.values.items()]
+        for key, buckets, total, count in snapshot:
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+WS_CONNECTIONS = Counter('chat_ws_connections_total', 'WebSocket connections accepted.')
+WS_OPEN = Gauge('chat_ws_open_connections', 'WebSocket connections currently open.')
+WS_PHASE = Histogram('chat_ws_phase_seconds', 'Time spent in each step of the chat consumer.')
+WS_FRAME = Histogram('chat_ws_frame_seconds', 'Time to handle one incoming WebSocket frame, by frame type.')
+DB_SECONDS = Histogram('chat_db_seconds', 'Time spent inside the database thread, by operation.')
+ERRORS = Counter('chat_errors_total', 'Errors that were handled instead of raised, by where they happened.')
+EPHEMERAL_DROPPED = Counter('chat_ephemeral_dropped_total', 'Typing and ephemeral events dropped under load.')
+OUTBOUND_DROPPED = Counter('chat_outbound_dropped_total', 'Frames dropped from full per-connection outbound queues, by kind.')
+OUTBOUND_COALESCED = Counter('chat_outbound_coalesced_total', 'Queued typing and presence frames replaced by a newer one, by kind.')
+SLOW_CLOSES = Counter('chat_slow_client_closes_total', 'Connections closed because their outbound queue was full of messages.')
+WRITE_BEHIND_DROPPED = Counter('chat_write_behind_dropped_total', 'Broadcast messages the write-behind flush could not store, by reason.')
+RECENT_CACHE = Counter('chat_recent_cache_requests_total', 'Recent-message cache lookups: hit or miss (loaded from the database).')
+AUTH_CACHE = Counter('chat_auth_cache_requests_total', 'WebSocket handshake user lookups: hit or miss (loaded from the database).')
+HTTP_SECONDS = Histogram('chat_http_request_seconds', 'Django view latency, by view and method.')
+HTTP_RESPONSES = Counter('chat_http_responses_total', 'Django responses, by view and status code.')
+
+
+def render():
+    lines = []
+    for metric in list(registry.values()):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = settings.CHAT_METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    """
+    Times every request by resolved view name. With CHAT_PROFILE_REQUESTS
+    on, a request carrying ``?profile`` runs under cProfile and gets the
+    stats back instead of the page.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.CHAT_PROFILE_REQUESTS and 'profile' in request.GET:
+            return self.profile(request)
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        HTTP_SECONDS.observe(time.perf_counter() - start, view=view, method=request.method)
+        HTTP_RESPONSES.inc(view=view, status=response.status_code)
+        return response
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        profiler.runcall(self.get_response, request)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(60)
+        return HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room_name', 'timestamp', 'id'], name='chat_msg_room_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='privatemessage',
+            index=models.Index(fields=['room', 'timestamp', 'id'], name='chat_pmsg_room_ts_idx'),
+        ),
+    ]
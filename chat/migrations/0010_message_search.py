@@ -0,0 +1,72 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:02
+
+from django.db import migrations, OperationalError
+
+TABLES = [
+    # (message table, author column, room column)
+    ('chat_message', 'user_id', 'room_name'),
+    ('chat_privatemessage', 'sender_id', 'room_id'),
+]
+
+
+def sqlite_statements(table, author, room):
+    # SQLite drops these triggers whenever a migration rebuilds the table
+    # (most AlterField/AddField with defaults); such migrations must recreate them.
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5(body, author, room, tokenize='unicode61 remove_diacritics 2')",
+        f"""INSERT INTO {fts}(rowid, body, author, room)
+            SELECT m.id, coalesce(m.content, ''), u.username, m.{room}
+            FROM {table} m JOIN auth_user u ON u.id = m.{author}""",
+        f"""CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN
+              INSERT INTO {fts}(rowid, body, author, room)
+              SELECT new.id, coalesce(new.content, ''), u.username, new.{room}
+              FROM auth_user u WHERE u.id = new.{author};
+            END""",
+        f"""CREATE TRIGGER {fts}_update AFTER UPDATE OF content ON {table} BEGIN
+              UPDATE {fts} SET body = coalesce(new.content, '') WHERE rowid = new.id;
+            END""",
+        f"""CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN
+              DELETE FROM {fts} WHERE rowid = old.id;
+            END""",
+    ]
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for table, _, _ in TABLES:
+            schema_editor.execute(
+                f"CREATE INDEX {table}_fts_idx ON {table} "
+                f"USING GIN (to_tsvector('simple', coalesce(content, '')))"
+            )
+    elif connection.vendor == 'sqlite':
+        # SQLite builds without FTS5 fall back to the in-process index in chat.search
+        try:
+            for table, author, room in TABLES:
+                for sql in sqlite_statements(table, author, room):
+                    schema_editor.execute(sql)
+        except OperationalError:
+            drop_search_indexes(apps, schema_editor)
+
+
+def drop_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    for table, _, _ in TABLES:
+        if connection.vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_fts_idx')
+        elif connection.vendor == 'sqlite':
+            for suffix in ('insert', 'update', 'delete'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_unread_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
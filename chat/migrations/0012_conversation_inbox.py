@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_read_markers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_name', models.CharField(max_length=255)),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('last_message_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_sender', models.CharField(blank=True, max_length=150)),
+                ('snippet', models.CharField(blank=True, max_length=100)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('peer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_message_at', '-id'], name='chat_conv_user_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('room_name', 'user'), name='chat_conv_room_user_uniq')],
+            },
+        ),
+    ]
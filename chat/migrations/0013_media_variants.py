@@ -0,0 +1,63 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_conversation_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='audio_compressed',
+            field=models.FileField(blank=True, null=True, upload_to='chat_audio/compressed/'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_webp',
+            field=models.ImageField(blank=True, null=True, upload_to='chat_images/webp/'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='chat_images/thumbs/'),
+        ),
+        migrations.AddField(
+            model_name='privatemessage',
+            name='audio_compressed',
+            field=models.FileField(blank=True, null=True, upload_to='chat_audio/compressed/'),
+        ),
+        migrations.AddField(
+            model_name='privatemessage',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='privatemessage',
+            name='image_webp',
+            field=models.ImageField(blank=True, null=True, upload_to='chat_images/webp/'),
+        ),
+        migrations.AddField(
+            model_name='privatemessage',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='privatemessage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='chat_images/thumbs/'),
+        ),
+    ]
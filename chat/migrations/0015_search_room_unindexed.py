@@ -0,0 +1,51 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:40
+
+from django.db import migrations
+
+TABLES = [
+    # (message table, author column, room column)
+    ('chat_message', 'user_id', 'room_name'),
+    ('chat_privatemessage', 'sender_id', 'room_id'),
+]
+
+
+def rebuild_fts(schema_editor, room_definition):
+    # ট্রিগারগুলো কলামের নাম দিয়ে লেখা, তাই শুধু টেবিলটা নতুন করে বানালেই চলে
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE name = 'chat_message_fts'")
+        if cursor.fetchone() is None:
+            return
+    for table, author, room in TABLES:
+        fts = f'{table}_fts'
+        schema_editor.execute(f'DROP TABLE {fts}')
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5(body, author, {room_definition}, "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"""INSERT INTO {fts}(rowid, body, author, room)
+                SELECT m.id, coalesce(m.content, ''), u.username, m.{room}
+                FROM {table} m JOIN auth_user u ON u.id = m.{author}"""
+        )
+
+
+def unindex_room(apps, schema_editor):
+    # রুম শুধু সমান-তুলনায় ফিল্টার হয়; টোকেনাইজ করলে নামের অংশ মেলা অন্য রুমও আসত
+    rebuild_fts(schema_editor, 'room UNINDEXED')
+
+
+def index_room(apps, schema_editor):
+    rebuild_fts(schema_editor, 'room')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_message_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(unindex_room, index_room),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:05
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+def snippet(content, image, audio):
+    # chat.inbox.snippet এর কপি: মাইগ্রেশন অ্যাপের কোডের উপর নির্ভর করে না
+    if content:
+        return content[:100]
+    if image:
+        return '📷 Photo'
+    if audio:
+        return '🎤 Voice message'
+    return ''
+
+
+def backfill_conversations(apps, schema_editor):
+    """
+    One inbox row per participant of every private room that has messages,
+    so existing conversations stay on the landing page. Rows the inbox
+    writer already made are left alone.
+    """
+    PrivateChatRoom = apps.get_model('chat', 'PrivateChatRoom')
+    PrivateMessage = apps.get_model('chat', 'PrivateMessage')
+    Conversation = apps.get_model('chat', 'Conversation')
+
+    latest = PrivateMessage.objects.filter(room=OuterRef('pk')).order_by('-timestamp', '-id').values('id')[:1]
+    rooms = PrivateChatRoom.objects.annotate(last_id=Subquery(latest)).order_by('pk')
+    after = 0
+    while True:
+        batch = list(rooms.filter(pk__gt=after).values_list(
+            'pk', 'room_id', 'user1_id', 'user2_id', 'last_id'
+        )[:BATCH_SIZE])
+        if not batch:
+            break
+        after = batch[-1][0]
+        batch = [room for room in batch if room[4] is not None]
+        room_pks = [room[0] for room in batch]
+        last = {
+            row[0]: row[1:] for row in PrivateMessage.objects.filter(id__in=[room[4] for room in batch]).values_list(
+                'id', 'timestamp', 'sender__username', 'content', 'image', 'audio'
+            )
+        }
+        # রিড রিসিপ্ট অন্যজনের মেসেজে is_read বসায়, তাই না-পড়া = অন্যজনের is_read=False মেসেজ
+        unread = {
+            (room_pk, sender_id): count
+            for room_pk, sender_id, count in PrivateMessage.objects.filter(room_id__in=room_pks, is_read=False)
+            .values('room_id', 'sender_id').annotate(count=Count('id')).values_list('room_id', 'sender_id', 'count')
+        }
+        conversations = []
+        for room_pk, room_name, user1_id, user2_id, last_id in batch:
+            timestamp, sender, content, image, audio = last[last_id]
+            for user_id, peer_id in ((user1_id, user2_id), (user2_id, user1_id)):
+                conversations.append(Conversation(
+                    user_id=user_id, room_name=room_name, peer_id=peer_id,
+                    last_message_id=last_id, last_message_at=timestamp, last_sender=sender,
+                    snippet=snippet(content, image, audio), unread_count=unread.get((room_pk, peer_id), 0),
+                ))
+        Conversation.objects.bulk_create(conversations, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_search_room_unindexed'),
+    ]
+
+    operations = [
+        # ফেরত গেলে সারিগুলো থাকে: ততক্ষণে ইনবক্স রাইটারও এগুলোতে লিখেছে
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
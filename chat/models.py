@@ -8,16 +8,28 @@ class Message(models.Model):
    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
    room_name = models.CharField(max_length=255)
    content = models.TextField(null=True, blank=True)
-   timestamp = models.DateTimeField(auto_now_add=True)
+   timestamp = models.DateTimeField(default=timezone.now, editable=False)
    is_read = models.BooleanField(default=False)
    image = models.ImageField(upload_to='chat_images/', null=True, blank=True)
    audio = models.FileField(upload_to='chat_audio/', null=True, blank=True)
+   # chat.media ব্যাকগ্রাউন্ডে তৈরি করে; অরিজিনাল ফাইল যেমন ছিল তেমনই থাকে
+   image_webp = models.ImageField(upload_to='chat_images/webp/', null=True, blank=True)
+   thumbnail = models.ImageField(upload_to='chat_images/thumbs/', null=True, blank=True)
+   image_width = models.PositiveIntegerField(null=True, blank=True)
+   image_height = models.PositiveIntegerField(null=True, blank=True)
+   audio_compressed = models.FileField(upload_to='chat_audio/compressed/', null=True, blank=True)
 
    def __str__(self):
       return f'{self.user.username}:{self.content[:20] if self.content else "Image"}'
    
    class Meta:
       ordering = ('timestamp',)
+      indexes = [
+         # রুমের হিস্ট্রি (timestamp, id) keyset পেজিনেশন
+         models.Index(fields=['room_name', 'timestamp', 'id'], name='chat_msg_room_ts_idx'),
+         # শুধু না-পড়া মেসেজ, is_read আপডেটে পুরো রুম স্ক্যান হয় না
+         models.Index(fields=['room_name', 'id'], condition=models.Q(is_read=False), name='chat_msg_unread_idx'),
+      ]
       
 
 class PrivateChatRoom(models.Model):
@@ -30,19 +42,99 @@ class PrivateChatRoom(models.Model):
    
 
 class PrivateMessage(models.Model):
-   room = models.ForeignKey(PrivateChatRoom, on_delete=models.CASCADE, related_name='private_messages')
+   # (room, timestamp, id) ইনডেক্সই room দিয়ে খোঁজা কভার করে
+   room = models.ForeignKey(PrivateChatRoom, on_delete=models.CASCADE, related_name='private_messages', db_index=False)
    sender = models.ForeignKey(User, on_delete=models.CASCADE)
    content = models.TextField(null=True, blank=True)
    image = models.ImageField(upload_to='chat_images/', null=True, blank=True)
    audio = models.FileField(upload_to='chat_audio/', null=True, blank=True)
-   timestamp = models.DateTimeField(auto_now_add=True)
+   timestamp = models.DateTimeField(default=timezone.now, editable=False)
    is_read = models.BooleanField(default=False)
+   # chat.media ব্যাকগ্রাউন্ডে তৈরি করে; অরিজিনাল ফাইল যেমন ছিল তেমনই থাকে
+   image_webp = models.ImageField(upload_to='chat_images/webp/', null=True, blank=True)
+   thumbnail = models.ImageField(upload_to='chat_images/thumbs/', null=True, blank=True)
+   image_width = models.PositiveIntegerField(null=True, blank=True)
+   image_height = models.PositiveIntegerField(null=True, blank=True)
+   audio_compressed = models.FileField(upload_to='chat_audio/compressed/', null=True, blank=True)
 
    def __str__(self):
       return f'{self.sender.username}: {self.content[:20] if self.content else "Image"}'
    
    class Meta:
       ordering = ('timestamp', )
+      indexes = [
+         models.Index(fields=['room', 'timestamp', 'id'], name='chat_pmsg_room_ts_idx'),
+         models.Index(fields=['room', 'id'], condition=models.Q(is_read=False), name='chat_pmsg_unread_idx'),
+      ]
+
+class ReadMarker(models.Model):
+   # ইউজার এই রুমে কোন মেসেজ পর্যন্ত পড়েছে (high-water mark)
+   user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_markers')
+   room_name = models.CharField(max_length=255)
+   last_read_id = models.BigIntegerField(default=0)
+   updated_at = models.DateTimeField(auto_now=True)
+
+   def __str__(self):
+      return f'{self.user_id} read {self.room_name} up to {self.last_read_id}'
+
+   class Meta:
+      constraints = [
+         models.UniqueConstraint(fields=['user', 'room_name'], name='chat_readmarker_user_room_uniq'),
+      ]
+
+class Conversation(models.Model):
+   # ইনবক্সের একটা লাইন: ইউজারের প্রতি রুমের শেষ মেসেজ আর না-পড়া সংখ্যা (chat.inbox আপডেট করে)
+   user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+   room_name = models.CharField(max_length=255)
+   # প্রাইভেট রুমে অন্য ইউজার, পাবলিক রুমে null
+   peer = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+   last_message_id = models.BigIntegerField(default=0)
+   last_message_at = models.DateTimeField(default=timezone.now)
+   last_sender = models.CharField(max_length=150, blank=True)
+   snippet = models.CharField(max_length=100, blank=True)
+   unread_count = models.PositiveIntegerField(default=0)
+
+   def __str__(self):
+      return f'{self.user_id} in {self.room_name} ({self.unread_count} unread)'
+
+   class Meta:
+      constraints = [
+         # room_name আগে: নতুন মেসেজে পুরো রুমের লাইনগুলো একসাথে আপডেট হয়
+         models.UniqueConstraint(fields=['room_name', 'user'], name='chat_conv_room_user_uniq'),
+      ]
+      indexes = [
+         # ইনবক্স পেজ: ইউজারের কনভারসেশন, নতুন থেকে পুরনো (keyset)
+         models.Index(fields=['user', '-last_message_at', '-id'], name='chat_conv_user_recent_idx'),
+      ]
+
+class RoomRetention(models.Model):
+   # রুম-ভিত্তিক রিটেনশন; না থাকলে CHAT_RETENTION_DAYS (chat.archive)
+   room_name = models.CharField(max_length=255, unique=True)
+   # null: এই রুমের মেসেজ কখনো আর্কাইভ হয় না
+   days = models.PositiveIntegerField(null=True, blank=True)
+
+   def __str__(self):
+      return f'{self.room_name}: {self.days or "forever"}'
+
+class ArchiveSegment(models.Model):
+   # আর্কাইভে সরানো একটা ব্যাচ: CHAT_ARCHIVE_DIR-এ একটা gzip JSONL ফাইল
+   room_name = models.CharField(max_length=255)
+   path = models.CharField(max_length=500)
+   first_id = models.BigIntegerField()
+   last_id = models.BigIntegerField()
+   first_timestamp = models.DateTimeField()
+   last_timestamp = models.DateTimeField()
+   message_count = models.PositiveIntegerField()
+   created_at = models.DateTimeField(auto_now_add=True)
+
+   def __str__(self):
+      return f'{self.room_name}: {self.message_count} messages up to {self.last_timestamp:%Y-%m-%d}'
+
+   class Meta:
+      indexes = [
+         # রিড-থ্রু: রুমের সেগমেন্ট, নতুন থেকে পুরনো
+         models.Index(fields=['room_name', '-last_timestamp', '-last_id'], name='chat_archive_room_recent_idx'),
+      ]
 
 class UserProfile(models.Model):
    user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -57,7 +149,3 @@ class UserProfile(models.Model):
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+Many rooms over one socket (ws/mux/). The client subscribes and
+unsubscribes with control frames:
+
+    {"type": "subscribe", "room": "general", "after": 1234}
+    {"type": "unsubscribe", "room": "general"}
+
+and sends everything else exactly as on ws/chat/<room>/ with a "room"
+field added. The server answers "subscribed" / "unsubscribed", tags every
+frame it sends with the room, and reports refusals as an "error" frame
+with the room. In the binary protocols a room's frame is the room name
+followed by the frame itself, as a msgpack or CBOR sequence, so the
+pre-encoded group events are still only forwarded.
+
+Each subscription is a RoomSubscription: ChatConsumer's room logic
+(replay, presence, read receipts, its own outbound queue) without a socket
+of its own. Authentication, the subprotocol and the online-status record
+are per socket. A socket may hold CHAT_MUX_MAX_ROOMS rooms; a room whose
+outbound queue overflows gets a "resume" frame and is unsubscribed instead
+of the socket being closed.
+"""
+import asyncio
+import logging
+import re
+
+from channels.consumer import get_handler_name
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from .consumers import FRAME_TYPES, ChatConsumer
+from .frames import encode
+from .metrics import ERRORS, WS_CONNECTIONS, WS_FRAME, WS_OPEN, WS_PHASE
+from .protocol import CODECS, decode_json, negotiate
+from .status import get_status_writer
+
+logger = logging.getLogger(__name__)
+
+# ws/chat/<room>/ রাউটের মতোই
+ROOM_NAME = re.compile(r'^\w+$')
+
+
+class RoomSubscription(ChatConsumer):
+    """One room of a MultiplexConsumer, writing through its socket."""
+
+    def __init__(self, mux):
+        super().__init__()
+        self.mux = mux
+        self.scope = mux.scope
+        self.channel_layer = mux.channel_layer
+        self.user = mux.user
+        self.user_id = mux.user_id
+        self.codec = mux.codec
+        self.receiver = None
+
+    async def subscribe(self, room_name, private_room, after):
+        # নিজের চ্যানেল: গ্রুপের ইভেন্ট কোন রুমের তা আলাদা করে বোঝা যায়
+        self.channel_name = await self.channel_layer.new_channel('mux')
+        if not settings.CHAT_LOCAL_FANOUT:
+            self.receiver = asyncio.ensure_future(self.receive_events())
+        self.prefix = self.codec.dumps(room_name) if self.codec else None
+        self.tag = '{"room":' + encode(room_name) + ','
+        await self.join_room(room_name, private_room)
+        await self.send_frame({'type': 'subscribed'})
+        await self.enter_room(after)
+
+    async def unsubscribe(self):
+        if self.receiver is not None:
+            self.receiver.cancel()
+        if self.outbound is not None:
+            await self.leave_room()
+
+    # LocalFanout রিলের মতো: হ্যান্ডলারগুলো শুধু আউটবাউন্ড কিউতে রাখে
+    async def receive_events(self):
+        while True:
+            event = await self.channel_layer.receive(self.channel_name)
+            try:
+                await getattr(self, get_handler_name(event))(event)
+            except Exception:
+                ERRORS.inc(where='mux')
+                logger.exception("Could not deliver %s to %s", event.get('type'), self.room_name)
+
+    async def write(self, text_data, bytes_data):
+        if text_data is not None:
+            await self.mux.send(text_data=self.tag + text_data[1:])
+        else:
+            await self.mux.send(bytes_data=self.prefix + bytes_data)
+
+    async def close_slow_client(self, last_message_id):
+        await self.write(*self.encode_frame({'type': 'resume', 'message_id': last_message_id}))
+        await self.mux.unsubscribe(self.room_name)
+
+
+class MultiplexConsumer(AsyncWebsocketConsumer):
+    accepted = False
+    codec = None
+    rooms = None
+
+    async def connect(self):
+        with WS_PHASE.time(phase='connect'):
+            self.user = self.scope['user']
+            self.user_id = self.user.id if self.user.is_authenticated else None
+            self.rooms = {}
+            subprotocol = negotiate(self.scope.get('subprotocols', []))
+            self.codec = CODECS.get(subprotocol)
+            await self.accept(subprotocol=subprotocol)
+            self.accepted = True
+            WS_CONNECTIONS.inc()
+            WS_OPEN.inc()
+            if self.user_id is not None:
+                get_status_writer().connect(self.user_id)
+
+    async def disconnect(self, close_code):
+        if not self.accepted:
+            return
+        self.accepted = False
+        WS_OPEN.dec()
+        with WS_PHASE.time(phase='disconnect'):
+            await asyncio.gather(*(subscription.unsubscribe() for subscription in self.rooms.values()))
+            self.rooms.clear()
+            if self.user_id is not None:
+                get_status_writer().disconnect(self.user_id)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        with WS_PHASE.time(phase='decode'):
+            if bytes_data is not None and self.codec is None:
+                return
+            try:
+                if bytes_data is not None:
+                    frame = self.codec.decode(bytes_data)
+                else:
+                    frame = decode_json(text_data)
+            except ValueError as e:
+                ERRORS.inc(where='decode')
+                await self.send_control({'type': 'error', 'error': str(e)})
+                return
+
+        msg_type = frame.get('type')
+        room_name = frame.get('room')
+        if msg_type == 'subscribe':
+            with WS_FRAME.time(type='subscribe'):
+                await self.subscribe(room_name, frame.get('after'))
+            return
+        if msg_type == 'unsubscribe':
+            if await self.unsubscribe(room_name):
+                await self.send_control({'type': 'unsubscribed', 'room': room_name})
+            return
+
+        subscription = self.rooms.get(room_name)
+        if subscription is None:
+            await self.send_control({'type': 'error', 'room': room_name, 'error': 'Not subscribed.'})
+            return
+        label = msg_type if msg_type in FRAME_TYPES else ('text' if 'message' in frame else 'other')
+        with WS_FRAME.time(type=label):
+            await subscription.handle_frame(frame)
+
+    async def subscribe(self, room_name, after):
+        if not isinstance(room_name, str) or not ROOM_NAME.match(room_name):
+            await self.send_control({'type': 'error', 'room': room_name, 'error': 'Invalid room.'})
+            return
+        if room_name in self.rooms:
+            return
+        if len(self.rooms) >= settings.CHAT_MUX_MAX_ROOMS:
+            await self.send_control({'type': 'error', 'room': room_name, 'error': 'Too many rooms.'})
+            return
+
+        subscription = RoomSubscription(self)
+        private_room = None
+        if room_name.startswith('private_'):
+            # ws/chat/private/-এর মতো খোলা নয়: শুধু রুমের দুই সদস্য
+            subscription.room_name = room_name
+            private_room = await subscription.resolve_private_room()
+            if private_room is None or self.user_id not in (private_room.user1_id, private_room.user2_id):
+                await self.send_control({'type': 'error', 'room': room_name, 'error': 'Unknown room.'})
+                return
+        try:
+            after = int(after) if after is not None else None
+        except (TypeError, ValueError):
+            after = None
+
+        self.rooms[room_name] = subscription
+        try:
+            await subscription.subscribe(room_name, private_room, after)
+        except Exception:
+            self.rooms.pop(room_name, None)
+            await subscription.unsubscribe()
+            raise
+
+    async def unsubscribe(self, room_name):
+        subscription = self.rooms.pop(room_name, None)
+        if subscription is None:
+            return False
+        await subscription.unsubscribe()
+        return True
+
+    async def send_control(self, frame):
+        if self.codec is None:
+            await self.send(text_data=encode(frame))
+        else:
+            await self.send(bytes_data=self.codec.encode(frame))
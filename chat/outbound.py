@@ -0,0 +1,126 @@
+"""
+Bounded per-connection outbound queue. Group handlers only enqueue and
+return, so a slow socket never leaves its channel-layer inbox filling up;
+a writer task drains the queue into the socket, waiting after each frame
+until the server reports the socket's write buffer drained (the
+``chat.drained`` scope extension from core/serve.py). Without that wait
+daphne accepts every frame into Twisted's buffer and the queue never fills.
+
+When the queue is full the cheapest frames give way first:
+
+    ephemeral   dropped (oldest queued first)
+    typing      one queued frame per typist, the newest state wins; dropped when full
+    presence    queued deltas collapse into one fresh user_list snapshot
+    message     never dropped; if there is no room the connection is closed
+                with a 'resume' frame carrying the last delivered message id
+"""
+import asyncio
+import collections
+
+from .metrics import OUTBOUND_COALESCED, OUTBOUND_DROPPED, SLOW_CLOSES
+
+EPHEMERAL = 'ephemeral'
+TYPING = 'typing'
+PRESENCE = 'presence'
+MESSAGE = 'message'
+
+# a queued presence entry whose payload is rebuilt from the store when it is written
+RESYNC = object()
+
+
+def classify(frame):
+    """(kind, coalesce key) for a client frame."""
+    frame_type = frame.get('type')
+    if frame_type == 'ephemeral':
+        return EPHEMERAL, None
+    if frame_type == 'typing':
+        return TYPING, f"typing:{frame.get('username')}"
+    if frame_type in ('presence', 'user_list'):
+        return PRESENCE, PRESENCE
+    return MESSAGE, None
+
+
+class OutboundQueue:
+    """
+    ``send(text_data, bytes_data)`` writes one frame to the socket,
+    ``snapshot()`` returns the encoded user_list for a presence resync and
+    ``overflow(last_message_id)`` is scheduled once when a message frame
+    does not fit. ``drained()``, if given, returns once the socket can
+    take more.
+    """
+
+    def __init__(self, send, snapshot, overflow, maxsize, drained=None):
+        self.send = send
+        self.snapshot = snapshot
+        self.overflow = overflow
+        self.maxsize = maxsize
+        self.drained = drained
+        self.entries = collections.deque()
+        self.keyed = {}
+        self.task = None
+        self.closed = False
+        self.last_message_id = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, kind, key=None, text=None, data=None, message_id=None):
+        if self.closed:
+            return
+        queued = self.keyed.get(key) if key else None
+        if queued is not None:
+            # প্রেজেন্সের ডেল্টা জোড়া না দিয়ে লেখার সময় পুরো লিস্ট নতুন করে পাঠানো
+            queued[2:4] = (RESYNC, None) if kind == PRESENCE else (text, data)
+            OUTBOUND_COALESCED.inc(kind=kind)
+            return
+
+        if len(self.entries) >= self.maxsize and not self.make_room(kind):
+            if kind == MESSAGE:
+                self.close()
+            else:
+                OUTBOUND_DROPPED.inc(kind=kind)
+            return
+
+        entry = [kind, key, text, data, message_id]
+        self.entries.append(entry)
+        if key:
+            self.keyed[key] = entry
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._drain())
+
+    def make_room(self, kind):
+        if kind in (EPHEMERAL, TYPING):
+            return False
+        for entry in self.entries:
+            if entry[0] == EPHEMERAL:
+                self.entries.remove(entry)
+                OUTBOUND_DROPPED.inc(kind=EPHEMERAL)
+                return True
+        return False
+
+    def close(self):
+        self.closed = True
+        for entry in self.entries:
+            OUTBOUND_DROPPED.inc(kind=entry[0])
+        self.entries.clear()
+        self.keyed.clear()
+        SLOW_CLOSES.inc()
+        asyncio.ensure_future(self.overflow(self.last_message_id))
+
+    def cancel(self):
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _drain(self):
+        while self.entries and not self.closed:
+            kind, key, text, data, message_id = entry = self.entries.popleft()
+            if key and self.keyed.get(key) is entry:
+                del self.keyed[key]
+            if text is RESYNC:
+                text, data = await self.snapshot()
+            await self.send(text, data)
+            if message_id is not None:
+                self.last_message_id = message_id
+            if self.drained is not None:
+                await self.drained()
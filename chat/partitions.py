@@ -0,0 +1,155 @@
+"""
+Monthly range partitioning of the message tables on PostgreSQL.
+
+``convert`` turns a table into one partitioned by "timestamp". The rows it
+already holds become a single legacy partition, so there is no copy; the
+longest step is building a unique (id, timestamp) index, which runs
+CONCURRENTLY before the swap. The swap itself holds an exclusive lock only
+while catalog entries are changed and the existing indexes are attached.
+
+``ensure_partitions`` then creates the coming months ahead of time (a
+DEFAULT partition catches anything outside them) and
+``drop_empty_partitions`` drops months that archiving has emptied. Queries
+with a timestamp bound, which keyset history pages always have after the
+first page, only touch the partitions they need.
+
+Nothing references the message tables by foreign key and Django still
+treats ``id`` as the primary key; the database key is (id, timestamp)
+because PostgreSQL requires the partition key in it.
+"""
+import datetime
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+TABLES = ('chat_message', 'chat_privatemessage')
+
+
+def month_start(when, months=0):
+    month = when.year * 12 + when.month - 1 + months
+    return datetime.datetime(month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def literal(bound):
+    # DDL-তে প্যারামিটার চলে না; মান আমাদের নিজের তৈরি datetime
+    return f"'{bound.isoformat()}'"
+
+
+def is_partitioned(cursor, table):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitions(cursor, table):
+    """(name, upper bound) of each partition of ``table``; the bound is None for the DEFAULT partition."""
+    cursor.execute(
+        """SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+           FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+           WHERE i.inhparent = %s::regclass""",
+        [table],
+    )
+    result = []
+    for name, bound in cursor.fetchall():
+        match = re.search(r"TO \('([^']+)'\)", bound)
+        result.append((name, datetime.datetime.fromisoformat(match.group(1)) if match else None))
+    return result
+
+
+def convert(table):
+    legacy = f'{table}_legacy'
+    # বর্তমান মাসের নতুন মেসেজও legacy পার্টিশনে যায়, তাই সীমা পরের মাস
+    boundary = month_start(timezone.now(), 1)
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return False
+        # লক নেওয়ার আগেই: ইনডেক্স CONCURRENTLY, রেঞ্জ CHECK যাচাই (ATTACH তখন টেবিল স্ক্যান করে না)
+        cursor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_id_ts_key ON {table} (id, "timestamp")')
+        cursor.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_legacy_range '
+            f'CHECK ("timestamp" IS NOT NULL AND "timestamp" < {literal(boundary)}) NOT VALID'
+        )
+        cursor.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_legacy_range')
+
+        with transaction.atomic():
+            cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+                "AND indexname NOT IN (%s, %s)",
+                [table, f'{table}_pkey', f'{table}_id_ts_key'],
+            )
+            indexes = cursor.fetchall()
+            cursor.execute(
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass "
+                "AND contype = 'f'",
+                [table],
+            )
+            foreign_keys = cursor.fetchall()
+            cursor.execute(f'SELECT coalesce(max(id), 0) + 1 FROM {table}')
+            next_id = cursor.fetchone()[0]
+
+            # PostgreSQL 17-এর আগে পার্টিশন করা টেবিলে identity কলাম চলে না, তাই সাধারণ sequence
+            cursor.execute(f'ALTER TABLE {table} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+            cursor.execute(f'ALTER TABLE {table} ALTER COLUMN id DROP DEFAULT')
+            cursor.execute(f'DROP SEQUENCE IF EXISTS {table}_id_seq')
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+            for name, _ in indexes:
+                cursor.execute(f'ALTER INDEX {name} RENAME TO {name[:56]}_legacy')
+            cursor.execute(f'ALTER TABLE {legacy} DROP CONSTRAINT {table}_pkey')
+            cursor.execute(f'ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_pkey PRIMARY KEY USING INDEX {table}_id_ts_key')
+
+            cursor.execute(
+                f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE) '
+                f'PARTITION BY RANGE ("timestamp")'
+            )
+            cursor.execute(f'CREATE SEQUENCE {table}_id_seq START WITH {int(next_id)} OWNED BY {table}.id')
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+            cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "timestamp")')
+            for name, definition in foreign_keys:
+                cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+            cursor.execute(
+                f'ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ({literal(boundary)})'
+            )
+            cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+            # একই সংজ্ঞার ইনডেক্স legacy-তে আছে, তাই নতুন করে বানানো নয়, শুধু যুক্ত হয়
+            for name, definition in indexes:
+                cursor.execute(definition)
+            cursor.execute(f'ALTER TABLE {legacy} DROP CONSTRAINT {table}_legacy_range')
+    return True
+
+
+def ensure_partitions(table, months_ahead=3):
+    """Create the monthly partitions from the last existing one through ``months_ahead`` months from now."""
+    created = []
+    with connection.cursor() as cursor:
+        bounds = [bound for _, bound in partitions(cursor, table) if bound is not None]
+        start = max(bounds) if bounds else month_start(timezone.now())
+        end = month_start(timezone.now(), months_ahead + 1)
+        while start < end:
+            upper = month_start(start, 1)
+            name = f'{table}_p{start:%Y%m}'
+            # DEFAULT পার্টিশনে এই রেঞ্জের সারি থাকলে এখানে ত্রুটি হবে; আগে সেগুলো সরাতে হবে
+            cursor.execute(
+                f'CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({literal(start)}) TO ({literal(upper)})'
+            )
+            created.append(name)
+            start = upper
+    return created
+
+
+def drop_empty_partitions(table, before):
+    """Detach and drop monthly partitions that end before ``before`` and hold no rows."""
+    dropped = []
+    with connection.cursor() as cursor:
+        for name, bound in partitions(cursor, table):
+            if bound is None or bound > before:
+                continue
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {name})')
+            if cursor.fetchone()[0]:
+                continue
+            with transaction.atomic():
+                cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+                cursor.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    return dropped
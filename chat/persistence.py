@@ -0,0 +1,267 @@
+import asyncio
+import datetime
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from .db import db_sync_to_async
+from .metrics import WRITE_BEHIND_DROPPED
+from .models import Message, PrivateChatRoom, PrivateMessage
+from .search import index_messages
+
+logger = logging.getLogger(__name__)
+
+# 2025-01-01T00:00:00Z, keeps snowflake ids well inside a signed BIGINT
+SNOWFLAKE_EPOCH_MS = 1735689600000
+
+
+class SnowflakeGenerator:
+    """
+    Time-ordered 63-bit ids: 41 bits of milliseconds, 10 bits of worker id
+    and a 12 bit per-millisecond sequence.
+    """
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id & 0x3FF
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            now = max(int(time.time() * 1000) - SNOWFLAKE_EPOCH_MS, self.last_ms)
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & 0xFFF
+                if self.sequence == 0:
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last_ms = now
+            return (now << 22) | (self.worker_id << 12) | self.sequence
+
+
+def persist_rows(rows):
+    room_ids = {row['room'] for row in rows if row['kind'] == 'private'}
+    room_pks = dict(
+        PrivateChatRoom.objects.filter(room_id__in=room_ids).values_list('room_id', 'pk')
+    ) if room_ids else {}
+
+    # journal replay: rows written before the crash are already in the table
+    ids = [row['id'] for row in rows]
+    stored = {
+        pk: ('public', room, user_id, content)
+        for pk, room, user_id, content in Message.objects.filter(id__in=ids).values_list(
+            'id', 'room_name', 'user_id', 'content'
+        )
+    }
+    stored.update({
+        pk: ('private', room, user_id, content)
+        for pk, room, user_id, content in PrivateMessage.objects.filter(id__in=ids).values_list(
+            'id', 'room_id', 'sender_id', 'content'
+        )
+    })
+
+    batch = []
+    for row in rows:
+        room = room_pks.get(row['room']) if row['kind'] == 'private' else row['room']
+        if row['kind'] == 'private' and room is None:
+            drop(row, 'unknown_room')
+            continue
+        if row['id'] in stored:
+            if stored[row['id']] != (row['kind'], room, row['user_id'], row['content']):
+                # অন্য মেসেজ এই আইডি নিয়ে নিয়েছে; এটা আর লেখা যাবে না
+                drop(row, 'id_conflict')
+            continue
+
+        fields = {
+            'id': row['id'],
+            'content': row['content'],
+            'timestamp': datetime.datetime.fromisoformat(row['timestamp']),
+        }
+        if row['kind'] == 'private':
+            batch.append((row, PrivateMessage(room_id=room, sender_id=row['user_id'], **fields)))
+        else:
+            batch.append((row, Message(room_name=room, user_id=row['user_id'], **fields)))
+
+    index_messages(insert_rows(batch))
+
+
+def insert_rows(batch):
+    """
+    Write (row, instance) pairs and return the instances written. A batch
+    the database rejects is split in halves until the offending rows are
+    found and dropped; any other error (a lost connection, a locked table)
+    propagates so the flush retries the whole batch.
+    """
+    if not batch:
+        return []
+    try:
+        with transaction.atomic():
+            Message.objects.bulk_create([obj for _, obj in batch if isinstance(obj, Message)])
+            PrivateMessage.objects.bulk_create([obj for _, obj in batch if isinstance(obj, PrivateMessage)])
+    except (IntegrityError, DataError) as e:
+        # যেমন লেখক ডিলিট হয়ে গেছে: আবার চেষ্টা করলেও হবে না, বাকিদের আটকে রাখা যাবে না
+        if len(batch) == 1:
+            drop(batch[0][0], 'rejected', e)
+            return []
+        middle = len(batch) // 2
+        return insert_rows(batch[:middle]) + insert_rows(batch[middle:])
+    return [obj for _, obj in batch]
+
+
+def drop(row, reason, error=None):
+    # ব্রডকাস্ট হয়ে গেছে, কিন্তু ডাটাবেসে যাবে না
+    WRITE_BEHIND_DROPPED.inc(reason=reason)
+    logger.error("Dropping acknowledged message %s in %s: %s", row['id'], row['room'], error or reason)
+
+
+class WriteBehindQueue:
+    """
+    Buffers text messages so they can be broadcast before they are written.
+
+    Every row is appended to an on-disk journal segment before it is
+    acknowledged; a flush seals the segment, writes all pending rows with
+    bulk_create and only then deletes the sealed segments. Segments left
+    over from a crash are replayed on startup; rows that reached the
+    database before the crash are recognised by id and skipped. Rows the
+    database rejects are dropped one by one; only a flush that fails for
+    another reason is retried whole.
+    """
+
+    def __init__(self, journal_dir, worker_id=0, batch_size=200, interval=0.05, fsync=False):
+        self.journal_dir = os.path.join(journal_dir, f'worker-{worker_id}')
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self.ids = SnowflakeGenerator(worker_id)
+        self.pending = []
+        self.sealed = []
+        self.segment = None
+        self.segment_no = 0
+        self.flusher = None
+        self.wakeup = None
+        self.lock = None
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(self.journal_dir, '.lock'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ImproperlyConfigured(
+                f"Journal {self.journal_dir} is in use by another process; "
+                "give every worker a unique CHAT_WORKER_ID."
+            )
+        self._recover()
+
+    def _recover(self):
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith('.jsonl'):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            with open(path) as fh:
+                for line in fh:
+                    try:
+                        self.pending.append(json.loads(line))
+                    except ValueError:
+                        # a torn final line is a write that was never acknowledged
+                        break
+            self.sealed.append(path)
+            self.segment_no = max(self.segment_no, int(name.split('.')[0]) + 1)
+        if self.pending:
+            logger.info("Replaying %d journaled messages from %s", len(self.pending), self.journal_dir)
+
+    def _journal(self, row):
+        if self.segment is None:
+            path = os.path.join(self.journal_dir, f'{self.segment_no:012d}.jsonl')
+            self.segment_no += 1
+            self.segment = open(path, 'a')
+        self.segment.write(json.dumps(row) + '\n')
+        self.segment.flush()
+        if self.fsync:
+            os.fsync(self.segment.fileno())
+
+    def _seal(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.sealed.append(self.segment.name)
+            self.segment = None
+
+    def enqueue(self, kind, user_id, room, content):
+        row = {
+            'kind': kind,
+            'id': self.ids.next_id(),
+            'user_id': user_id,
+            'room': room,
+            'content': content,
+            'timestamp': timezone.now().isoformat(),
+        }
+        self._journal(row)
+        self.pending.append(row)
+        self.start()
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+        return row
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.flusher is None or self.flusher.done() or self.flusher.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.lock = asyncio.Lock()
+            self.flusher = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self.pending:
+            if len(self.pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(self.interval * 10)
+
+    async def flush(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.pending:
+                return 0
+            rows, self.pending = self.pending, []
+            self._seal()
+            sealed = list(self.sealed)
+            try:
+                await db_sync_to_async(persist_rows)(rows)
+            except Exception:
+                logger.exception("Write-behind flush of %d messages failed, will retry", len(rows))
+                self.pending[:0] = rows
+                return 0
+            for path in sealed:
+                os.remove(path)
+                self.sealed.remove(path)
+            return len(rows)
+
+
+_queue = None
+
+
+def get_write_behind_queue():
+    global _queue
+    if not settings.CHAT_WRITE_BEHIND:
+        return None
+    if _queue is None:
+        _queue = WriteBehindQueue(
+            settings.CHAT_WRITE_BEHIND_JOURNAL_DIR,
+            worker_id=settings.CHAT_WORKER_ID,
+            batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+            interval=settings.CHAT_WRITE_BEHIND_INTERVAL,
+            fsync=settings.CHAT_WRITE_BEHIND_FSYNC,
+        )
+    return _queue
@@ -0,0 +1,129 @@
+import time
+import weakref
+
+from django.conf import settings
+
+
+def _member(username, channel_name):
+    return f'{username}|{channel_name}'
+
+
+def _usernames(members):
+    return {member.split('|', 1)[0] for member in members}
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class PresenceStore:
+    """
+    Per-room socket membership with heartbeat/TTL expiry.
+
+    Every socket is its own member, so a user with several tabs open stays
+    online until the last one leaves or expires. Each call returns the
+    ``(joined, left)`` usernames it caused, so callers only broadcast deltas.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    async def join(self, room, username, channel_name):
+        before, after = await self._update(room, add=_member(username, channel_name))
+        return self._diff(before, after)
+
+    # A heartbeat re-adds the member with a fresh expiry and prunes stale ones.
+    heartbeat = join
+
+    async def leave(self, room, username, channel_name):
+        before, after = await self._update(room, remove=_member(username, channel_name))
+        return self._diff(before, after)
+
+    async def members(self, room):
+        raise NotImplementedError
+
+    async def _update(self, room, add=None, remove=None):
+        raise NotImplementedError
+
+    def _diff(self, before, after):
+        before, after = _usernames(before), _usernames(after)
+        return sorted(after - before), sorted(before - after)
+
+
+class InMemoryPresenceStore(PresenceStore):
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        self.rooms = {}
+
+    async def members(self, room):
+        now = time.monotonic()
+        members = self.rooms.get(room, {})
+        return sorted(_usernames(m for m, expires in members.items() if expires > now))
+
+    async def _update(self, room, add=None, remove=None):
+        now = time.monotonic()
+        members = self.rooms.setdefault(room, {})
+        before = set(members)
+        for member, expires in list(members.items()):
+            if expires <= now:
+                del members[member]
+        if add:
+            members[add] = now + self.ttl
+        if remove:
+            members.pop(remove, None)
+        after = set(members)
+        if not members:
+            del self.rooms[room]
+        return before, after
+
+
+class RedisPresenceStore(PresenceStore):
+    """
+    Presence kept in the channel layer's Redis: one sorted set per room,
+    scored by expiry time, so every worker sees the same membership.
+    """
+
+    def __init__(self, channel_layer, ttl):
+        super().__init__(ttl)
+        self.channel_layer = channel_layer
+
+    def _key(self, room):
+        return f'{self.channel_layer.prefix}:presence:{room}'
+
+    def _connection(self, key):
+        return self.channel_layer.connection(self.channel_layer.consistent_hash(key))
+
+    async def members(self, room):
+        key = self._key(room)
+        members = await self._connection(key).zrangebyscore(key, time.time(), '+inf')
+        return sorted(_usernames(_decode(m) for m in members))
+
+    async def _update(self, room, add=None, remove=None):
+        key = self._key(room)
+        now = time.time()
+        async with self._connection(key).pipeline(transaction=True) as pipe:
+            pipe.zrange(key, 0, -1)
+            pipe.zremrangebyscore(key, '-inf', now)
+            if add:
+                pipe.zadd(key, {add: now + self.ttl})
+            if remove:
+                pipe.zrem(key, remove)
+            pipe.zrange(key, 0, -1)
+            pipe.expire(key, self.ttl * 2)
+            results = await pipe.execute()
+        return {_decode(m) for m in results[0]}, {_decode(m) for m in results[-2]}
+
+
+_stores = weakref.WeakKeyDictionary()
+
+
+def get_presence_store(channel_layer):
+    store = _stores.get(channel_layer)
+    if store is None:
+        ttl = settings.CHAT_PRESENCE_TTL
+        if hasattr(channel_layer, 'connection'):
+            store = RedisPresenceStore(channel_layer, ttl)
+        else:
+            store = InMemoryPresenceStore(ttl)
+        _stores[channel_layer] = store
+    return store
@@ -0,0 +1,143 @@
+"""
+Versioned WebSocket protocol, negotiated through the subprotocol header.
+
+    chat.v1.msgpack   binary msgpack frames with short field codes
+    chat.v1.cbor      binary CBOR frames with short field codes
+    chat.v1.json      JSON text frames with the full field names
+
+Clients that offer none of these get the original JSON protocol, which is
+the same as chat.v1.json. In the binary protocols the frame type is an
+integer, null fields are left out and media ('file_data') is sent as raw
+bytes instead of a base64 data URL.
+"""
+import functools
+import json
+
+import cbor2
+import msgpack
+from django.conf import settings
+
+JSON = 'chat.v1.json'
+
+FIELDS = {
+    'type': 't',
+    'message': 'm',
+    'username': 'u',
+    'timestamp': 'ts',
+    'message_id': 'id',
+    'image_url': 'img',
+    'audio_url': 'aud',
+    'up_to': 'up',
+    'reader': 'r',
+    'joined': 'j',
+    'left': 'l',
+    'users': 'us',
+    'state': 's',
+    'ttl': 'ttl',
+    'event': 'e',
+    'data': 'd',
+    'error': 'err',
+    'upload_token': 'tok',
+    'file_data': 'fd',
+    'file_name': 'fn',
+    'count': 'n',
+    'complete': 'c',
+    'thumbnail_url': 'th',
+    'width': 'w',
+    'height': 'h',
+    'room': 'rm',
+}
+FIELD_NAMES = {code: name for name, code in FIELDS.items()}
+
+TYPES = {
+    'chat_message': 1,
+    'typing': 2,
+    'message_read': 3,
+    'presence': 4,
+    'user_list': 5,
+    'ephemeral': 6,
+    'upload_error': 7,
+    'audio': 8,
+    'file': 9,
+    'error': 10,
+    'resume': 11,
+    'replay': 12,
+    'media_update': 13,
+    'subscribe': 14,
+    'unsubscribe': 15,
+    'subscribed': 16,
+    'unsubscribed': 17,
+}
+TYPE_NAMES = {code: name for name, code in TYPES.items()}
+
+
+def compact(frame):
+    out = {}
+    for key, value in frame.items():
+        if value is None:
+            continue
+        if key == 'type':
+            value = TYPES.get(value, value)
+        out[FIELDS.get(key, key)] = value
+    return out
+
+
+def expand(frame):
+    out = {}
+    for key, value in frame.items():
+        key = FIELD_NAMES.get(key, key)
+        if key == 'type':
+            value = TYPE_NAMES.get(value, value)
+        out[key] = value
+    return out
+
+
+class Codec:
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.subprotocol = f'chat.v1.{name}'
+        self.dumps = dumps
+        self.loads = loads
+
+    def encode(self, frame):
+        return self.dumps(compact(frame))
+
+    def decode(self, data):
+        try:
+            frame = self.loads(data)
+        except Exception as e:
+            raise ValueError(f'Undecodable {self.name} frame: {e}')
+        if not isinstance(frame, dict):
+            raise ValueError(f'Expected a map, got {type(frame).__name__}.')
+        return expand(frame)
+
+
+def decode_json(text):
+    """A text frame in the JSON protocol; like Codec.decode, anything but an object is a ValueError."""
+    try:
+        frame = json.loads(text)
+    except ValueError as e:
+        raise ValueError(f'Undecodable JSON frame: {e}')
+    if not isinstance(frame, dict):
+        raise ValueError(f'Expected an object, got {type(frame).__name__}.')
+    return frame
+
+
+CODECS = {
+    codec.subprotocol: codec for codec in (
+        Codec('msgpack', functools.partial(msgpack.packb, use_bin_type=True), functools.partial(msgpack.unpackb, raw=False)),
+        Codec('cbor', cbor2.dumps, cbor2.loads),
+    )
+}
+
+
+def enabled_codecs():
+    return [CODECS[name] for name in settings.CHAT_WS_PROTOCOLS if name in CODECS]
+
+
+def negotiate(offered):
+    """The first offered subprotocol this server speaks, or None for the original JSON protocol."""
+    for subprotocol in offered:
+        if subprotocol == JSON or (subprotocol in CODECS and subprotocol in settings.CHAT_WS_PROTOCOLS):
+            return subprotocol
+    return None
@@ -0,0 +1,57 @@
+import contextlib
+import re
+
+from django.db import connection as default_connection
+from django.test.utils import CaptureQueriesContext
+
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)\b(?! USING (COVERING )?INDEX| VIRTUAL TABLE INDEX)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def explain(sql, connection=default_connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + sql)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def sequential_scans(sql, connection=default_connection, table_prefix='chat_'):
+    """
+    Plan lines where ``sql`` reads a whole table (or sorts outside an index)
+    instead of seeking an index, limited to tables starting with ``table_prefix``.
+    """
+    pattern = SQLITE_SCAN if connection.vendor == 'sqlite' else POSTGRES_SCAN
+    plan = explain(sql, connection)
+    # ranking full-text matches has to sort them by score; the match itself is an index lookup
+    ranked = any('VIRTUAL TABLE INDEX' in line for line in plan)
+    found = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1).startswith(table_prefix):
+            found.append(line.strip())
+        elif 'USE TEMP B-TREE FOR ORDER BY' in line and not ranked:
+            found.append(line.strip())
+    return found
+
+
+@contextlib.contextmanager
+def assert_no_sequential_scans(connection=default_connection, table_prefix='chat_'):
+    """
+    Capture every query issued inside the block and fail if any SELECT,
+    UPDATE or DELETE falls back to a sequential scan.
+    """
+    with CaptureQueriesContext(connection) as ctx:
+        yield ctx
+
+    failures = []
+    for query in ctx.captured_queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            continue
+        scans = sequential_scans(sql, connection, table_prefix)
+        if scans:
+            failures.append(f'{sql}\n    -> ' + '\n    -> '.join(scans))
+    if failures:
+        raise AssertionError('Queries fell back to sequential scans:\n' + '\n'.join(failures))
@@ -0,0 +1,147 @@
+"""
+Newest messages of recently viewed rooms, kept per process so room pages
+of busy rooms do not query the database. A room is loaded with one keyset
+page on its first view; after that the consumer writes new messages and
+read receipts through, and edits drop the room so the next view reloads it.
+
+The cache only sees writes made in this process: messages saved by other
+workers, the admin or a shell appear once the room is reloaded, which
+happens at the latest CHAT_RECENT_CACHE_TTL seconds after it was loaded.
+That is fine for a page whose socket replays anything newer, but not for
+deciding that a reconnect replay is complete, so replays never read it.
+There is deliberately no delete signal (it
+would disable Django's fast bulk delete on the message tables), so code
+that deletes messages calls ``recent_messages.invalidate`` itself.
+"""
+import collections
+import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .cache import LRUCache
+from .history import fetch_history, media_urls
+from .metrics import RECENT_CACHE
+from .models import Message, PrivateChatRoom, PrivateMessage
+
+RecentMessage = collections.namedtuple(
+    'RecentMessage',
+    ['id', 'user_id', 'username', 'content', 'image_url', 'audio_url', 'timestamp', 'is_read',
+     'thumbnail_url', 'width', 'height'],
+    defaults=(None, None, None),
+)
+
+
+def from_model(msg, username=None):
+    author_id = msg.sender_id if isinstance(msg, PrivateMessage) else msg.user_id
+    if username is None:
+        username = (msg.sender if isinstance(msg, PrivateMessage) else msg.user).username
+    media = media_urls(msg)
+    return RecentMessage(
+        msg.id, author_id, username, msg.content or '',
+        media['image_url'], media['audio_url'], msg.timestamp, msg.is_read,
+        media['thumbnail_url'], media['width'], media['height'],
+    )
+
+
+class RecentRoom:
+    __slots__ = ('messages', 'has_more', 'expires')
+
+    def __init__(self, messages, has_more, expires):
+        self.messages = messages
+        self.has_more = has_more
+        self.expires = expires
+
+
+class RecentMessageCache:
+    def __init__(self, size, max_rooms, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.rooms = LRUCache(max_rooms)
+        # লোড চলাকালীন ক্যাশে না থাকা রুমে লেখা এলে সেই লোড ক্যাশে রাখা যাবে না
+        self.generation = 0
+        # রুমের deque ভিউ, কনজিউমার আর মিডিয়া থ্রেড থেকে একসাথে বদলায়
+        self.lock = threading.Lock()
+
+    def page(self, room_name):
+        """The newest messages of the room, newest first, and whether older ones exist."""
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is not None and room.expires > time.monotonic():
+                messages, has_more = list(room.messages), room.has_more
+            else:
+                room = None
+                generation = self.generation
+        if room is not None:
+            RECENT_CACHE.inc(result='hit')
+            return messages[::-1], has_more
+
+        RECENT_CACHE.inc(result='miss')
+        messages, has_more = fetch_history(room_name, limit=self.size)
+        page = [from_model(msg) for msg in messages]
+        with self.lock:
+            if generation == self.generation:
+                self.rooms.set(room_name, RecentRoom(
+                    collections.deque(reversed(page), maxlen=self.size), has_more, time.monotonic() + self.ttl,
+                ))
+        return page, has_more
+
+    def add(self, room_name, message):
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is None:
+                self.generation += 1
+                return
+            if len(room.messages) == self.size:
+                room.has_more = True
+            room.messages.append(message)
+
+    def add_row(self, row, username):
+        """Write-behind rows (chat.persistence) before they reach the database."""
+        self.add(row['room'], RecentMessage(
+            row['id'], row['user_id'], username, row['content'], None, None,
+            datetime.datetime.fromisoformat(row['timestamp']), False,
+        ))
+
+    def mark_read(self, room_name, up_to, reader_id):
+        self._update(room_name, lambda msg: msg.id <= up_to and msg.user_id != reader_id, is_read=True)
+
+    def set_media(self, room_name, message_id, media):
+        """Swap in the variants chat.media made for one cached message."""
+        self._update(room_name, lambda msg: msg.id == message_id, **media)
+
+    def _update(self, room_name, matches, **fields):
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is None:
+                return
+            for i, msg in enumerate(room.messages):
+                if matches(msg):
+                    room.messages[i] = msg._replace(**fields)
+
+    def invalidate(self, room_name):
+        with self.lock:
+            self.generation += 1
+            self.rooms.pop(room_name)
+
+
+recent_messages = RecentMessageCache(
+    settings.CHAT_RECENT_CACHE_SIZE, settings.CHAT_ROOM_CACHE_SIZE, settings.CHAT_RECENT_CACHE_TTL,
+)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=PrivateMessage)
+def invalidate_edited_room(sender, instance, created, **kwargs):
+    # নতুন মেসেজ কনজিউমার নিজেই লিখে দেয়; এডিট হলে পুরো রুম আবার লোড
+    if created:
+        return
+    if isinstance(instance, PrivateMessage):
+        room_name = PrivateChatRoom.objects.filter(pk=instance.room_id).values_list('room_id', flat=True).first()
+    else:
+        room_name = instance.room_name
+    if room_name is not None:
+        recent_messages.invalidate(room_name)
@@ -0,0 +1,96 @@
+"""
+Missed-message replay for reconnecting sockets. Every chat_message frame a
+room broadcasts is also appended to a short per-room ring; a client that
+reconnects with ``?after=<last seen message id>`` gets the frames after it
+from the ring, or from one keyset query when the ring no longer reaches
+back that far (or was lost in a deploy).
+"""
+import collections
+import json
+import weakref
+
+from django.conf import settings
+
+from .cache import LRUCache
+from .frames import encode
+
+# Redis rings outlive a deploy but not an idle day
+KEY_TTL = 24 * 60 * 60
+
+
+def _since(entries, after):
+    """
+    Frames newer than ``after`` if ``entries`` (oldest first) provably hold
+    all of them, i.e. the ring still contains ``after`` or something older.
+    """
+    if not entries or entries[0]['message_id'] > after:
+        return None
+    return [frame for frame in entries if frame['message_id'] > after]
+
+
+class ReplayBuffer:
+    def __init__(self, size):
+        self.size = size
+
+    async def append(self, room, frame):
+        raise NotImplementedError
+
+    async def since(self, room, after):
+        raise NotImplementedError
+
+
+class InMemoryReplayBuffer(ReplayBuffer):
+    def __init__(self, size, max_rooms):
+        super().__init__(size)
+        self.rooms = LRUCache(max_rooms)
+
+    async def append(self, room, frame):
+        ring = self.rooms.get(room)
+        if ring is None:
+            ring = collections.deque(maxlen=self.size)
+            self.rooms.set(room, ring)
+        ring.append(frame)
+
+    async def since(self, room, after):
+        return _since(self.rooms.get(room), after)
+
+
+class RedisReplayBuffer(ReplayBuffer):
+    """One capped Redis list per room in the channel layer's Redis."""
+
+    def __init__(self, channel_layer, size):
+        super().__init__(size)
+        self.channel_layer = channel_layer
+
+    def _key(self, room):
+        return f'{self.channel_layer.prefix}:replay:{room}'
+
+    def _connection(self, key):
+        return self.channel_layer.connection(self.channel_layer.consistent_hash(key))
+
+    async def append(self, room, frame):
+        key = self._key(room)
+        async with self._connection(key).pipeline(transaction=False) as pipe:
+            pipe.rpush(key, encode(frame))
+            pipe.ltrim(key, -self.size, -1)
+            pipe.expire(key, KEY_TTL)
+            await pipe.execute()
+
+    async def since(self, room, after):
+        key = self._key(room)
+        entries = await self._connection(key).lrange(key, 0, -1)
+        return _since([json.loads(entry) for entry in entries], after)
+
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_replay_buffer(channel_layer):
+    buffer = _buffers.get(channel_layer)
+    if buffer is None:
+        if hasattr(channel_layer, 'connection'):
+            buffer = RedisReplayBuffer(channel_layer, settings.CHAT_REPLAY_BUFFER_SIZE)
+        else:
+            buffer = InMemoryReplayBuffer(settings.CHAT_REPLAY_BUFFER_SIZE, settings.CHAT_ROOM_CACHE_SIZE)
+        _buffers[channel_layer] = buffer
+    return buffer
@@ -1,9 +1,11 @@
 
 from django.urls import re_path
-from . import consumers
+from . import consumers, multiplex
 
 websocket_urlpatterns = [
    # ws/chat/ROOM_NAME/ এই প্যাটার্নে কানেকশন আসবে
    re_path(r'ws/chat/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
    re_path(r'ws/chat/private/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
+   # একটা সকেটে অনেক রুম (subscribe/unsubscribe ফ্রেম দিয়ে)
+   re_path(r'ws/mux/$', multiplex.MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
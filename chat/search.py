@@ -0,0 +1,250 @@
+import bisect
+import heapq
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .cache import LRUCache, get_private_room
+from .models import Message, PrivateMessage
+
+PER_PAGE = 20
+MAX_TERMS = 8
+# only the newest matches are ranked, so common words cost the same at any table size
+RANK_WINDOW = 1000
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def query_terms(query):
+    return tokenize(query)[:MAX_TERMS]
+
+
+def resolve_room(room_name):
+    """(model, author field, room filter) for a public room name or private room id."""
+    if room_name.startswith('private_'):
+        room = get_private_room(room_name)
+        return PrivateMessage, 'sender', {'room_id': room.pk if room else None}
+    return Message, 'user', {'room_name': room_name}
+
+
+def _fetch_in_order(model, author, ids):
+    by_id = model.objects.select_related(author).order_by().in_bulk(ids)
+    return [by_id[i] for i in ids if i in by_id]
+
+
+class SearchBackend:
+    def search(self, room_name, query, page=1, per_page=PER_PAGE):
+        """
+        Ranked, paginated matches in one room; returns (messages, has_more).
+        Every term must match the text or author as a word prefix, and only
+        the newest RANK_WINDOW matches are ranked.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return [], False
+        model, author, room_filter = resolve_room(room_name)
+        if None in room_filter.values():
+            return [], False
+        ids = self.search_ids(model, room_filter, terms, (page - 1) * per_page, per_page + 1)
+        return _fetch_in_order(model, author, ids[:per_page]), len(ids) > per_page
+
+    def search_ids(self, model, room_filter, terms, offset, limit):
+        raise NotImplementedError
+
+    def index(self, messages):
+        """Called for newly saved messages; backends kept up to date by the database ignore it."""
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    tsvector matching served by the GIN expression index from migration 0010.
+    Text and author matches are separate branches of a UNION: an OR across
+    the two would keep the planner off the GIN index.
+    """
+
+    def search_ids(self, model, room_filter, terms, offset, limit):
+        table = model._meta.db_table
+        author_column = 'sender_id' if model is PrivateMessage else 'user_id'
+        room_column, room_value = next(iter(room_filter.items()))
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        # \w+ টোকেনে _ থাকতে পারে, LIKE-এ সেটা যেকোনো অক্ষর
+        username = connection.ops.prep_for_like_query(' '.join(terms)) + '%'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id FROM (
+                    SELECT id, timestamp, content FROM (
+                        (SELECT m.id, m.timestamp, m.content FROM {table} m
+                         WHERE m.{room_column} = %s
+                           AND to_tsvector('simple', coalesce(m.content, '')) @@ to_tsquery('simple', %s)
+                         ORDER BY m.timestamp DESC LIMIT %s)
+                        UNION
+                        (SELECT m.id, m.timestamp, m.content FROM {table} m
+                         WHERE m.{room_column} = %s
+                           AND m.{author_column} IN (SELECT id FROM auth_user WHERE lower(username) LIKE %s)
+                         ORDER BY m.timestamp DESC LIMIT %s)
+                    ) matches
+                    ORDER BY timestamp DESC LIMIT %s
+                ) m
+                ORDER BY ts_rank(to_tsvector('simple', coalesce(m.content, '')), to_tsquery('simple', %s)) DESC,
+                         m.timestamp DESC
+                LIMIT %s OFFSET %s
+                """,
+                [
+                    room_value, tsquery, RANK_WINDOW,
+                    room_value, username, RANK_WINDOW,
+                    RANK_WINDOW, tsquery, limit, offset,
+                ],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def fts_string(value):
+    # FTS5 স্ট্রিংয়ের ভেতরে " লিখতে হয় "" হিসেবে
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class SQLiteFTSSearchBackend(SearchBackend):
+    """
+    FTS5 tables kept in sync by the triggers from migration 0010. The room
+    column is UNINDEXED (migration 0015) and compared exactly, so the rank
+    window only ever holds matches from the searched room.
+    """
+
+    def search_ids(self, model, room_filter, terms, offset, limit):
+        table = model._meta.db_table
+        room_value = next(iter(room_filter.values()))
+        match = '{body author} : (' + ' AND '.join(fts_string(term) + '*' for term in terms) + ')'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT rowid FROM (
+                    SELECT rowid, bm25({table}_fts, 1.0, 0.5, 0.0) AS score FROM {table}_fts
+                    WHERE {table}_fts MATCH %s AND room = %s ORDER BY rowid DESC LIMIT %s
+                )
+                ORDER BY score, rowid DESC
+                LIMIT %s OFFSET %s
+                """,
+                [match, room_value, RANK_WINDOW, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """
+    In-process fallback for databases without full-text support. Each room
+    is tokenized on first search, kept in an LRU of rooms and updated as
+    messages are saved.
+    """
+
+    def __init__(self, max_rooms=256):
+        self.rooms = LRUCache(max_rooms)
+        self.lock = threading.Lock()
+
+    def _key(self, model, room_filter):
+        return (model._meta.label, next(iter(room_filter.values())))
+
+    def _load(self, model, room_filter):
+        author = 'sender__username' if model is PrivateMessage else 'user__username'
+        postings = {}
+        for message_id, content, username in model.objects.filter(**room_filter).values_list('id', 'content', author):
+            for token in set(tokenize(content)) | set(tokenize(username)):
+                postings.setdefault(token, set()).add(message_id)
+        return {'postings': postings, 'tokens': sorted(postings)}
+
+    def search_ids(self, model, room_filter, terms, offset, limit):
+        key = self._key(model, room_filter)
+        room = self.rooms.get(key)
+        if room is None:
+            room = self._load(model, room_filter)
+            self.rooms.set(key, room)
+
+        with self.lock:
+            tokens = room['tokens']
+            scores = None
+            for term in terms:
+                matched = {}
+                start = bisect.bisect_left(tokens, term)
+                for token in tokens[start:]:
+                    if not token.startswith(term):
+                        break
+                    # পুরো শব্দ মিললে প্রিফিক্সের চেয়ে বেশি স্কোর
+                    weight = 2 if token == term else 1
+                    for message_id in room['postings'][token]:
+                        matched[message_id] = max(matched.get(message_id, 0), weight)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {i: s + matched[i] for i, s in scores.items() if i in matched}
+                if not scores:
+                    return []
+
+        newest = heapq.nlargest(RANK_WINDOW, scores)
+        ranked = heapq.nsmallest(offset + limit, newest, key=lambda i: (-scores[i], -i))
+        return ranked[offset:]
+
+    def index(self, messages):
+        pending = []
+        for msg in messages:
+            if isinstance(msg, PrivateMessage):
+                key, author_id = (PrivateMessage._meta.label, msg.room_id), msg.sender_id
+            else:
+                key, author_id = (Message._meta.label, msg.room_name), msg.user_id
+            room = self.rooms.get(key)
+            if room is not None:
+                pending.append((room, msg, author_id))
+        if not pending:
+            return
+
+        usernames = dict(User.objects.filter(id__in={a for _, _, a in pending}).values_list('id', 'username'))
+        with self.lock:
+            for room, msg, author_id in pending:
+                for token in set(tokenize(msg.content)) | set(tokenize(usernames.get(author_id))):
+                    if token not in room['postings']:
+                        room['postings'][token] = set()
+                        bisect.insort(room['tokens'], token)
+                    room['postings'][token].add(msg.id)
+
+
+def fts5_tables_exist():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE name = 'chat_message_fts'")
+        return cursor.fetchone() is not None
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        if settings.CHAT_SEARCH_BACKEND:
+            _backend = import_string(settings.CHAT_SEARCH_BACKEND)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        elif connection.vendor == 'sqlite' and fts5_tables_exist():
+            _backend = SQLiteFTSSearchBackend()
+        else:
+            _backend = InvertedIndexSearchBackend()
+    return _backend
+
+
+def index_messages(messages):
+    """Feed newly written messages to the active backend (bulk_create skips post_save)."""
+    if _backend is not None:
+        _backend.index(messages)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=PrivateMessage)
+def index_saved_message(sender, instance, created, **kwargs):
+    if created:
+        index_messages([instance])
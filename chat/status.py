@@ -0,0 +1,131 @@
+"""
+Debounced UserProfile.is_online / last_seen writes. Connects and
+disconnects only touch in-process counters; a flusher writes the users
+whose state actually changed with one upsert every
+CHAT_STATUS_FLUSH_INTERVAL seconds. A user whose last socket closed is
+only marked offline after CHAT_STATUS_OFFLINE_GRACE seconds, so page
+navigation and tab switches do not flap the status.
+
+Counts are per process and nothing is compared across workers: with
+several workers, any worker whose last socket for a user closes writes
+that user offline, even while they still have sockets on other workers.
+The record then stays offline until the user opens a socket on a worker
+that has not already written them online.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .db import db_sync_to_async
+from .metrics import DB_SECONDS
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+@DB_SECONDS.time(op='write_status')
+def write_status(rows):
+    # প্রোফাইল না থাকলে তৈরি, থাকলে শুধু এই দুটো ফিল্ড আপডেট
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user_id, is_online=online, last_seen=seen) for user_id, (online, seen) in rows.items()],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['is_online', 'last_seen'],
+    )
+
+
+class StatusWriter:
+    def __init__(self, interval, grace):
+        self.interval = interval
+        self.grace = grace
+        self.sockets = collections.Counter()
+        # user ids this process last wrote as online
+        self.online = set()
+        # user_id -> (is_online, last_seen) waiting for the next flush
+        self.dirty = {}
+        # user_id -> (monotonic deadline, last_seen) for users with no sockets left
+        self.leaving = {}
+        self.flusher = None
+
+    def connect(self, user_id):
+        self.start()
+        self.sockets[user_id] += 1
+        self.leaving.pop(user_id, None)
+        if user_id in self.online:
+            # অফলাইন লেখার আগেই ফিরে এসেছে
+            self.dirty.pop(user_id, None)
+        else:
+            self.dirty[user_id] = (True, timezone.now())
+
+    def disconnect(self, user_id):
+        if user_id not in self.sockets:
+            return
+        self.sockets[user_id] -= 1
+        if self.sockets[user_id] > 0:
+            return
+        del self.sockets[user_id]
+        if user_id in self.dirty and user_id not in self.online:
+            # never written as online, nothing to undo
+            del self.dirty[user_id]
+            return
+        self.leaving[user_id] = (time.monotonic() + self.grace, timezone.now())
+        self.start()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.flusher is None or self.flusher.done() or self.flusher.get_loop() is not loop:
+            if self.flusher is not None and self.flusher.get_loop() is not loop:
+                # নতুন ইভেন্ট লুপ (টেস্ট, বেঞ্চমার্ক): আগের লুপের সকেটগুলো আর নেই
+                self.sockets.clear()
+                self.online.clear()
+                self.dirty.clear()
+                self.leaving.clear()
+            self.flusher = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self.dirty or self.leaving:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def _collect(self):
+        now = time.monotonic()
+        for user_id, (deadline, seen) in list(self.leaving.items()):
+            if deadline <= now:
+                del self.leaving[user_id]
+                self.dirty[user_id] = (False, seen)
+        rows, self.dirty = self.dirty, {}
+        return rows
+
+    def _written(self, rows):
+        for user_id, (online, _) in rows.items():
+            if online:
+                self.online.add(user_id)
+            else:
+                self.online.discard(user_id)
+
+    async def flush(self):
+        rows = self._collect()
+        if not rows:
+            return 0
+        try:
+            await db_sync_to_async(write_status)(rows)
+        except Exception:
+            # স্ট্যাটাস best-effort, মেসেজের মতো আবার চেষ্টা দরকার নেই
+            logger.exception("Could not write online status of %d users", len(rows))
+            return 0
+        self._written(rows)
+        return len(rows)
+
+
+_writer = None
+
+
+def get_status_writer():
+    global _writer
+    if _writer is None:
+        _writer = StatusWriter(settings.CHAT_STATUS_FLUSH_INTERVAL, settings.CHAT_STATUS_OFFLINE_GRACE)
+    return _writer
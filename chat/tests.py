@@ -1,3 +1,1808 @@
-from django.test import TestCase
+import asyncio
+import base64
+import collections
+import contextlib
+import datetime
+import fcntl
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+from PIL import Image
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from twisted.internet.testing import StringTransport
+
+from core.serve import DeflateWebSocketFactory
+
+from .auth import CachedAuthMiddlewareStack, sessions
+from . import persistence
+from .cache import get_private_room, private_rooms
+from .consumers import ChatConsumer
+from .db import db_sync_to_async
+from .frames import chat_message_frame, frame_event
+from .metrics import WRITE_BEHIND_DROPPED, WS_FRAME
+from .outbound import EPHEMERAL, MESSAGE, PRESENCE, TYPING, OutboundQueue
+from .presence import InMemoryPresenceStore, RedisPresenceStore
+from .persistence import SNOWFLAKE_EPOCH_MS, SnowflakeGenerator, WriteBehindQueue
+from .protocol import Codec
+from .inbox import get_inbox_writer
+from .media import MediaJob, process_job
+from .multiplex import MultiplexConsumer
+from .models import (
+   ArchiveSegment, Conversation, Message, PrivateChatRoom, PrivateMessage, ReadMarker, RoomRetention, UserProfile,
+)
+from .queryplan import assert_no_sequential_scans
+from .recent import RecentMessage, RecentMessageCache, RecentRoom, recent_messages
+from .replay import get_replay_buffer
+from .status import StatusWriter
+from .uploads import UploadError, claim_upload, cleanup_stale_uploads, create_upload, load_upload, make_token
+from .search import InvertedIndexSearchBackend, PostgresSearchBackend, SQLiteFTSSearchBackend
+from .views import get_or_create_private_room
+
+
+async def connect(user, room_name, query=''):
+   communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{room_name}/{query}')
+   communicator.scope['user'] = user
+   communicator.scope['url_route'] = {'kwargs': {'room_name': room_name}}
+   connected, _ = await communicator.connect()
+   assert connected
+   while not await communicator.receive_nothing(timeout=0.05):
+      await communicator.receive_from()
+   return communicator
+
+
+@contextlib.asynccontextmanager
+async def capture_queries():
+   # consumer DB calls run on the main thread, so the capture has to be entered there too
+   ctx = CaptureQueriesContext(connection)
+   await sync_to_async(ctx.__enter__)()
+   try:
+      yield ctx
+   finally:
+      await sync_to_async(ctx.__exit__)(None, None, None)
+
+
+class InMemoryPresenceStoreTests(SimpleTestCase):
+   ttl = 0.2
+
+   def make_store(self):
+      return InMemoryPresenceStore(self.ttl)
+
+   def room(self, name):
+      return f'presence_{name}_{uuid.uuid4().hex}'
+
+   def test_user_stays_online_until_their_last_tab_leaves(self):
+      async def run():
+         store, room = self.make_store(), self.room('tabs')
+         deltas = [
+            await store.join(room, 'alice', 'tab1'),
+            await store.join(room, 'alice', 'tab2'),
+            await store.join(room, 'bob', 'tab3'),
+         ]
+         deltas.append(await store.leave(room, 'alice', 'tab1'))
+         online = await store.members(room)
+         deltas.append(await store.leave(room, 'alice', 'tab2'))
+         deltas.append(await store.leave(room, 'alice', 'tab2'))
+         return deltas, online, await store.members(room)
+
+      deltas, online, after = async_to_sync(run)()
+      self.assertEqual(deltas, [
+         (['alice'], []), ([], []), (['bob'], []), ([], []), ([], ['alice']), ([], []),
+      ])
+      self.assertEqual(online, ['alice', 'bob'])
+      self.assertEqual(after, ['bob'])
+
+   def test_sockets_that_stop_heartbeating_expire(self):
+      async def run():
+         store, room = self.make_store(), self.room('ttl')
+         await store.join(room, 'alice', 'tab1')
+         await store.join(room, 'bob', 'tab2')
+         # বব হার্টবিট দেয়, অ্যালিসের সকেট চুপচাপ মরে গেছে
+         await asyncio.sleep(self.ttl * 0.6)
+         heartbeat = await store.heartbeat(room, 'bob', 'tab2')
+         await asyncio.sleep(self.ttl * 0.6)
+         online = await store.members(room)
+         pruned = await store.heartbeat(room, 'bob', 'tab2')
+         return heartbeat, online, pruned
+
+      heartbeat, online, pruned = async_to_sync(run)()
+      self.assertEqual(heartbeat, ([], []))
+      self.assertEqual(online, ['bob'])
+      self.assertEqual(pruned, ([], ['alice']))
+
+
+@skipUnless(settings.REDIS_HOSTS, 'needs REDIS_URL')
+class RedisPresenceStoreTests(InMemoryPresenceStoreTests):
+   # Redis key expiry is in whole seconds
+   ttl = 1
+
+   def make_store(self):
+      return RedisPresenceStore(RedisChannelLayer(hosts=settings.REDIS_HOSTS), self.ttl)
+
+
+class PresenceTests(TransactionTestCase):
+
+   def setUp(self):
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+
+   def test_only_join_and_leave_deltas_are_broadcast(self):
+      room = f'presence_{uuid.uuid4().hex}'
+
+      async def run():
+         bob = await connect(self.bob, room)
+         tab1 = await connect(self.alice, room)
+         frames = [await bob.receive_json_from()]
+         tab2 = await connect(self.alice, room)
+         quiet_on_second_tab = await bob.receive_nothing(timeout=0.1)
+         await tab1.disconnect()
+         quiet_on_first_close = await bob.receive_nothing(timeout=0.1)
+         await tab2.disconnect()
+         frames.append(await bob.receive_json_from())
+         await bob.disconnect()
+         return frames, quiet_on_second_tab, quiet_on_first_close
+
+      frames, quiet_on_second_tab, quiet_on_first_close = async_to_sync(run)()
+      self.assertEqual(frames, [
+         {'type': 'presence', 'joined': ['alice'], 'left': []},
+         {'type': 'presence', 'joined': [], 'left': ['alice']},
+      ])
+      self.assertTrue(quiet_on_second_tab)
+      self.assertTrue(quiet_on_first_close)
+
+   def test_new_socket_gets_the_full_user_list(self):
+      room = f'presence_{uuid.uuid4().hex}'
+
+      async def run():
+         bob = await connect(self.bob, room)
+         communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{room}/')
+         communicator.scope['user'] = self.alice
+         communicator.scope['url_route'] = {'kwargs': {'room_name': room}}
+         await communicator.connect()
+         frame = await communicator.receive_json_from()
+         await communicator.disconnect()
+         await bob.disconnect()
+         return frame
+
+      self.assertEqual(async_to_sync(run)(), {'type': 'user_list', 'users': ['alice', 'bob']})
+
+
+class MessageQueryCountTests(TransactionTestCase):
+
+   def setUp(self):
+      private_rooms.clear()
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+
+   def test_public_message_costs_one_insert(self):
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         async with capture_queries() as ctx:
+            for i in range(3):
+               await communicator.send_json_to({'message': f'hello {i}'})
+               await communicator.receive_json_from()
+         await communicator.disconnect()
+         return ctx
+
+      ctx = async_to_sync(run)()
+      self.assertEqual(len(ctx.captured_queries), 3)
+      self.assertTrue(all(q['sql'].startswith('INSERT') for q in ctx.captured_queries))
+      self.assertEqual(Message.objects.filter(room_name='lobby', user=self.alice).count(), 3)
+
+   def test_private_message_costs_one_insert(self):
+      room = get_or_create_private_room(self.alice, self.bob)
+
+      async def run():
+         communicator = await connect(self.alice, room.room_id)
+         async with capture_queries() as ctx:
+            for i in range(3):
+               await communicator.send_json_to({'message': f'hello {i}'})
+               await communicator.receive_json_from()
+         await communicator.disconnect()
+         return ctx
+
+      ctx = async_to_sync(run)()
+      self.assertEqual(len(ctx.captured_queries), 3)
+      self.assertTrue(all(q['sql'].startswith('INSERT') for q in ctx.captured_queries))
+      self.assertEqual(PrivateMessage.objects.filter(room=room, sender=self.alice).count(), 3)
+
+   def test_private_room_rows_are_shared_and_invalidated(self):
+      room = get_or_create_private_room(self.alice, self.bob)
+      get_private_room(room.room_id)
+      with self.assertNumQueries(0):
+         self.assertEqual(get_private_room(room.room_id).pk, room.pk)
+
+      room.delete()
+      with self.assertNumQueries(1):
+         self.assertIsNone(get_private_room(room.room_id))
+
+
+
+class WriteBehindTests(TransactionTestCase):
+
+   def setUp(self):
+      self.journal_dir = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, self.journal_dir)
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+
+   def queue(self):
+      # the flusher never fires on its own; tests flush (or crash) explicitly
+      queue = WriteBehindQueue(self.journal_dir, worker_id=1, interval=60)
+      self.addCleanup(queue._lock_file.close)
+      return queue
+
+   def crash(self, queue):
+      queue.flusher.cancel()
+      queue.segment.close()
+      queue._lock_file.close()
+
+   def journal(self):
+      return [name for name in os.listdir(os.path.join(self.journal_dir, 'worker-1')) if name.endswith('.jsonl')]
+
+   def test_journal_is_replayed_after_a_crash(self):
+      room = get_or_create_private_room(self.alice, self.bob)
+
+      async def run():
+         queue = self.queue()
+         rows = [queue.enqueue('public', self.alice.id, 'lobby', f'hello {i}') for i in range(3)]
+         rows.append(queue.enqueue('private', self.bob.id, room.room_id, 'psst'))
+         self.crash(queue)
+
+         replayed = self.queue()
+         self.assertEqual(replayed.pending, rows)
+         return rows, await replayed.flush()
+
+      rows, flushed = async_to_sync(run)()
+      self.assertEqual(flushed, 4)
+      self.assertEqual(self.journal(), [])
+      self.assertEqual(
+         list(Message.objects.order_by('id').values_list('id', 'content')),
+         [(row['id'], row['content']) for row in rows[:3]],
+      )
+      self.assertEqual(PrivateMessage.objects.get(id=rows[3]['id']).room_id, room.pk)
+
+   def test_failed_flush_keeps_rows_and_journal_for_retry(self):
+      persist = persistence.persist_rows
+
+      async def run():
+         queue = self.queue()
+         for i in range(2):
+            queue.enqueue('public', self.alice.id, 'lobby', f'hello {i}')
+         with mock.patch('chat.persistence.persist_rows', side_effect=RuntimeError('database is down')):
+            with self.assertLogs('chat.persistence', 'ERROR'):
+               failed = await queue.flush()
+         pending, journal = len(queue.pending), self.journal()
+         with mock.patch('chat.persistence.persist_rows', side_effect=persist):
+            retried = await queue.flush()
+         queue.flusher.cancel()
+         return failed, pending, journal, retried
+
+      failed, pending, journal, retried = async_to_sync(run)()
+      self.assertEqual((failed, pending, len(journal)), (0, 2, 1))
+      self.assertEqual(retried, 2)
+      self.assertEqual(self.journal(), [])
+      self.assertEqual(Message.objects.count(), 2)
+
+   def test_rejected_row_is_dropped_and_later_messages_still_land(self):
+      carol = User.objects.create_user('carol', password='pass')
+      dropped = WRITE_BEHIND_DROPPED.values.get((('reason', 'rejected'),), 0)
+
+      async def run():
+         queue = self.queue()
+         queue.enqueue('public', self.alice.id, 'lobby', 'before')
+         queued = queue.enqueue('public', carol.id, 'lobby', 'gone with carol')
+         queue.enqueue('public', self.bob.id, 'lobby', 'after carol')
+         # the author disappears while the message is still in the queue
+         await db_sync_to_async(carol.delete)()
+         with self.assertLogs('chat.persistence', 'ERROR') as logs:
+            first = await queue.flush()
+         queue.enqueue('public', self.alice.id, 'lobby', 'later')
+         second = await queue.flush()
+         queue.flusher.cancel()
+         return queued, first, second, logs.output, queue.pending
+
+      queued, first, second, logs, pending = async_to_sync(run)()
+      self.assertEqual((first, second, pending), (3, 1, []))
+      self.assertEqual(len(logs), 1)
+      self.assertIn(str(queued['id']), logs[0])
+      self.assertEqual(
+         list(Message.objects.order_by('id').values_list('content', flat=True)), ['before', 'after carol', 'later'],
+      )
+      self.assertEqual(self.journal(), [])
+      self.assertEqual(WRITE_BEHIND_DROPPED.values[(('reason', 'rejected'),)] - dropped, 1)
+
+   def test_replay_skips_written_rows_and_reports_conflicts(self):
+      room = get_or_create_private_room(self.alice, self.bob)
+
+      async def run():
+         queue = self.queue()
+         written = [queue.enqueue('public', self.alice.id, 'lobby', f'hello {i}') for i in range(2)]
+         # the batch reached the database, the process died before the journal was removed
+         await db_sync_to_async(persistence.persist_rows)(written)
+         taken = queue.enqueue('public', self.alice.id, 'lobby', 'mine')
+         orphan = queue.enqueue('private', self.alice.id, room.room_id, 'to nobody')
+         self.crash(queue)
+         return written, taken, orphan
+
+      written, taken, orphan = async_to_sync(run)()
+      Message.objects.create(id=taken['id'], user=self.bob, room_name='lobby', content='not mine')
+      room.delete()
+      dropped = dict(WRITE_BEHIND_DROPPED.values)
+
+      async def replay():
+         queue = self.queue()
+         return await queue.flush()
+
+      with self.assertLogs('chat.persistence', 'ERROR') as logs:
+         self.assertEqual(async_to_sync(replay)(), 4)
+      self.assertEqual(len(logs.output), 2)
+      self.assertEqual(
+         list(Message.objects.order_by('id').values_list('content', flat=True)), ['hello 0', 'hello 1', 'not mine'],
+      )
+      self.assertFalse(PrivateMessage.objects.filter(id=orphan['id']).exists())
+      for reason in ('id_conflict', 'unknown_room'):
+         key = (('reason', reason),)
+         self.assertEqual(WRITE_BEHIND_DROPPED.values[key] - dropped.get(key, 0), 1)
+
+   def test_snowflake_ids_are_ordered_across_workers_and_sequence_rollover(self):
+      first, second = SnowflakeGenerator(1), SnowflakeGenerator(2)
+      now = (SNOWFLAKE_EPOCH_MS + 1000) / 1000
+      with mock.patch('chat.persistence.time.time', return_value=now):
+         ids = [first.next_id() for _ in range(5000)]
+         other = [second.next_id() for _ in range(10)]
+      # the clock stepping back never reuses an id
+      with mock.patch('chat.persistence.time.time', return_value=now - 5):
+         ids.append(first.next_id())
+
+      self.assertEqual(ids, sorted(set(ids)))
+      self.assertFalse(set(ids) & set(other))
+      # 4096 ids per millisecond, then the next millisecond
+      self.assertEqual([i >> 22 for i in (ids[0], ids[4095], ids[4096])], [1000, 1000, 1001])
+      self.assertEqual({(i >> 12) & 0x3FF for i in ids}, {1})
+      self.assertEqual({(i >> 12) & 0x3FF for i in other}, {2})
+      # same millisecond on another worker sorts after worker 1, before worker 1's next millisecond
+      self.assertTrue(ids[4095] < other[0] < ids[4096])
+
+   def test_media_messages_use_snowflake_ids(self):
+      media_root = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, media_root)
+      settings = override_settings(
+         CHAT_WRITE_BEHIND=True, CHAT_WRITE_BEHIND_JOURNAL_DIR=self.journal_dir, CHAT_WORKER_ID=1,
+         MEDIA_ROOT=media_root, CHAT_MEDIA_FFMPEG='',
+      )
+      settings.enable()
+      self.addCleanup(settings.disable)
+      persistence._queue = None
+      self.addCleanup(setattr, persistence, '_queue', None)
+      png = io.BytesIO()
+      Image.new('RGB', (8, 8), 'teal').save(png, 'PNG')
+      data_url = 'data:image/png;base64,' + base64.b64encode(png.getvalue()).decode()
+
+      async def run():
+         communicator = await connect(self.alice, 'snowflakes')
+         await communicator.send_json_to({'message': 'text first'})
+         text = await communicator.receive_json_from()
+         await communicator.send_json_to({'type': 'file', 'file_data': data_url, 'file_name': 'dot.png'})
+         image = await communicator.receive_json_from()
+         await communicator.receive_json_from(timeout=5)  # media_update, before MEDIA_ROOT goes away
+         await communicator.disconnect()
+         queue = persistence.get_write_behind_queue()
+         await queue.flush()
+         queue.flusher.cancel()
+         queue._lock_file.close()
+         return text, image
+
+      text, image = async_to_sync(run)()
+      self.assertTrue(text['message_id'] < image['message_id'])
+      self.assertEqual((image['message_id'] >> 12) & 0x3FF, 1)
+      self.assertTrue(Message.objects.get(id=image['message_id']).image.name.endswith('.png'))
+
+   def test_private_room_that_does_not_resolve_is_refused(self):
+      settings = override_settings(CHAT_WRITE_BEHIND=True, CHAT_WRITE_BEHIND_JOURNAL_DIR=self.journal_dir)
+      settings.enable()
+      self.addCleanup(settings.disable)
+      persistence._queue = None
+      self.addCleanup(setattr, persistence, '_queue', None)
+
+      async def run():
+         communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/chat/private_998_999/')
+         communicator.scope['user'] = self.alice
+         communicator.scope['url_route'] = {'kwargs': {'room_name': 'private_998_999'}}
+         connected, _ = await communicator.connect()
+         queue = persistence._queue
+         return connected, queue and list(queue.pending)
+
+      self.assertEqual(async_to_sync(run)(), (False, None))
+
+
+class ReadReceiptTests(TransactionTestCase):
+
+   def setUp(self):
+      private_rooms.clear()
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+      self.room = get_or_create_private_room(self.alice, self.bob)
+      self.mine = PrivateMessage.objects.create(room=self.room, sender=self.alice, content='mine')
+      self.unread = PrivateMessage.objects.bulk_create(
+         PrivateMessage(room=self.room, sender=self.bob, content=f'hi {i}') for i in range(50)
+      )
+
+   def test_receipts_are_coalesced_into_one_update_and_one_event(self):
+      up_to = self.unread[-1].id
+
+      async def run():
+         communicator = await connect(self.alice, self.room.room_id)
+         async with capture_queries() as ctx:
+            for message in self.unread:
+               await communicator.send_json_to({'type': 'message_read', 'message_id': message.id})
+            event = await communicator.receive_json_from()
+         self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+         await communicator.disconnect()
+         return ctx, event
+
+      ctx, event = async_to_sync(run)()
+      self.assertEqual(event['up_to'], up_to)
+      self.assertEqual(event['reader'], 'alice')
+      # মেসেজের UPDATE আর ReadMarker upsert, মেসেজ যতই হোক
+      statements = [q['sql'] for q in ctx.captured_queries if q['sql'] not in ('BEGIN', 'COMMIT')]
+      self.assertEqual(len(statements), 2)
+      self.assertEqual(PrivateMessage.objects.filter(sender=self.bob, is_read=False).count(), 0)
+      self.assertFalse(PrivateMessage.objects.get(id=self.mine.id).is_read)
+      self.assertEqual(ReadMarker.objects.get(user=self.alice, room_name=self.room.room_id).last_read_id, up_to)
+
+   def test_pending_receipt_is_flushed_on_disconnect(self):
+      async def run():
+         communicator = await connect(self.alice, self.room.room_id)
+         await communicator.send_json_to({'type': 'message_read', 'message_id': self.unread[9].id})
+         await communicator.disconnect()
+
+      async_to_sync(run)()
+      self.assertEqual(PrivateMessage.objects.filter(sender=self.bob, is_read=True).count(), 10)
+
+
+
+class UploadTests(TransactionTestCase):
+
+   def setUp(self):
+      upload_dir, media_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, upload_dir)
+      self.addCleanup(shutil.rmtree, media_root)
+      settings = override_settings(
+         CHAT_UPLOAD_DIR=upload_dir, MEDIA_ROOT=media_root, CHAT_UPLOAD_MAX_SIZE=1024, CHAT_MEDIA_FFMPEG='',
+      )
+      settings.enable()
+      self.addCleanup(settings.disable)
+      self.upload_dir = upload_dir
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+      self.client = Client()
+      self.client.force_login(self.alice)
+
+   def start(self, size, kind='file'):
+      return self.client.post(
+         '/chat/uploads/', json.dumps({'file_name': 'photo.png', 'kind': kind, 'size': size}),
+         content_type='application/json',
+      )
+
+   def put(self, upload_id, offset, data):
+      return self.client.put(
+         f'/chat/uploads/{upload_id}/', data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+      )
+
+   def upload(self, data):
+      upload_id = self.start(len(data)).json()['upload_id']
+      return upload_id, self.put(upload_id, 0, data).json()['upload_token']
+
+   def test_chunks_resume_and_reject_wrong_offsets(self):
+      upload_id = self.start(10).json()['upload_id']
+      self.assertEqual(self.put(upload_id, 0, b'01234').json()['offset'], 5)
+      with self.assertRaisesMessage(UploadError, 'Upload is not complete.'):
+         claim_upload(make_token(load_upload(upload_id)), self.alice.id)
+
+      # the client lost the response and sends the first chunk again
+      response = self.put(upload_id, 0, b'01234')
+      self.assertEqual((response.status_code, response.json()['offset']), (409, 5))
+      self.assertEqual(self.client.get(f'/chat/uploads/{upload_id}/').json()['offset'], 5)
+
+      response = self.put(upload_id, 5, b'56789').json()
+      self.assertEqual(response['offset'], 10)
+      self.assertIn('upload_token', response)
+
+   def test_size_is_capped(self):
+      self.assertEqual(self.start(1025).status_code, 400)
+      self.assertEqual(self.start(0).status_code, 400)
+
+      upload_id = self.start(4).json()['upload_id']
+      response = self.put(upload_id, 0, b'12345')
+      self.assertEqual(response.status_code, 409)
+      self.assertEqual(response.json(), {'error': 'Chunk runs past the declared size.', 'offset': 0})
+
+   def test_tokens_are_signed_expire_and_belong_to_the_uploader(self):
+      upload_id, token = self.upload(b'data')
+      self.assertEqual(claim_upload(token, self.alice.id)['id'], upload_id)
+
+      tampered = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+      with self.assertRaisesMessage(UploadError, 'Invalid or expired upload token.'):
+         claim_upload(tampered, self.alice.id)
+      later = time.time() + 3601
+      with mock.patch('django.core.signing.time', mock.Mock(time=lambda: later)):
+         with self.assertRaisesMessage(UploadError, 'Invalid or expired upload token.'):
+            claim_upload(token, self.alice.id)
+
+      with self.assertRaisesMessage(UploadError, 'Unknown upload.'):
+         claim_upload(token, self.bob.id)
+      self.client.force_login(self.bob)
+      self.assertEqual(self.client.get(f'/chat/uploads/{upload_id}/').status_code, 404)
+
+   def test_failed_storage_keeps_the_upload_for_a_retry(self):
+      png = io.BytesIO()
+      Image.new('RGB', (8, 8), 'teal').save(png, 'PNG')
+      upload_id, token = self.upload(png.getvalue())
+
+      async def run():
+         communicator = await connect(self.alice, 'uploads')
+         with mock.patch('chat.consumers.store_upload', side_effect=OSError('storage is down')):
+            await communicator.send_json_to({'type': 'file', 'upload_token': token})
+            error = await communicator.receive_json_from(timeout=5)
+         staged = sorted(os.listdir(self.upload_dir))
+         await communicator.send_json_to({'type': 'file', 'upload_token': token})
+         message = await communicator.receive_json_from(timeout=5)
+         await communicator.receive_json_from(timeout=5)  # media_update, before MEDIA_ROOT goes away
+         await communicator.disconnect()
+         return error, staged, message
+
+      with self.assertLogs('chat.consumers', 'ERROR'):
+         error, staged, message = async_to_sync(run)()
+      self.assertEqual(error['type'], 'upload_error')
+      self.assertEqual(staged, [f'{upload_id}.json', f'{upload_id}.part'])
+      self.assertEqual(message['type'], 'chat_message')
+      self.assertTrue(Message.objects.get(id=message['message_id']).image.name.endswith('.png'))
+      self.assertEqual(os.listdir(self.upload_dir), [])
+
+   def test_stale_uploads_expire_whole_and_never_while_being_written(self):
+      old = time.time() - 7200
+      stale, slow, busy = (create_upload(self.alice.id, 'a.png', 'file', 10)['id'] for _ in range(3))
+      for upload_id in (stale, slow, busy):
+         for ext in ('.json', '.part'):
+            os.utime(os.path.join(self.upload_dir, upload_id + ext), (old, old))
+      # a slow upload: meta written an hour ago, data a moment ago
+      os.utime(os.path.join(self.upload_dir, slow + '.part'))
+
+      with open(os.path.join(self.upload_dir, busy + '.part'), 'ab') as fh:
+         fcntl.flock(fh, fcntl.LOCK_EX)
+         cleanup_stale_uploads()
+
+      remaining = sorted(os.listdir(self.upload_dir))
+      self.assertEqual(remaining, sorted(upload_id + ext for upload_id in (slow, busy) for ext in ('.json', '.part')))
+
+
+@override_settings(CHAT_TYPING_IDLE=0.2)
+class EphemeralEventTests(TransactionTestCase):
+
+   def setUp(self):
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+
+   def test_keystrokes_collapse_into_start_and_stop(self):
+      async def run():
+         bob = await connect(self.bob, 'lobby')
+         alice = await connect(self.alice, 'lobby')
+         await bob.receive_json_from()  # alice এর presence
+         for _ in range(20):
+            await alice.send_json_to({'type': 'typing'})
+         frames = [await bob.receive_json_from(), await bob.receive_json_from(timeout=2)]
+         self.assertTrue(await bob.receive_nothing(timeout=0.3))
+         await alice.disconnect()
+         await bob.disconnect()
+         return frames
+
+      start, stop = async_to_sync(run)()
+      self.assertEqual((start['type'], start['username'], start['state']), ('typing', 'alice', 'start'))
+      self.assertEqual((stop['type'], stop['state']), ('typing', 'stop'))
+
+   def test_ephemeral_frames_are_relayed_without_queries(self):
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         async with capture_queries() as ctx:
+            await communicator.send_json_to({'type': 'ephemeral', 'event': 'reaction', 'data': {'emoji': '+1'}})
+            frame = await communicator.receive_json_from()
+            await communicator.send_json_to({'type': 'ephemeral', 'event': 'big', 'data': 'x' * 5000})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+         await communicator.disconnect()
+         return ctx, frame
+
+      ctx, frame = async_to_sync(run)()
+      self.assertEqual(frame, {'type': 'ephemeral', 'event': 'reaction', 'username': 'alice', 'data': {'emoji': '+1'}})
+      self.assertEqual(len(ctx.captured_queries), 0)
+
+   def test_binary_payloads_that_json_clients_cannot_receive_are_rejected(self):
+      async def run():
+         communicator = WebsocketCommunicator(
+            ChatConsumer.as_asgi(), '/ws/chat/lobby/', subprotocols=['chat.v1.msgpack']
+         )
+         communicator.scope['user'] = self.alice
+         communicator.scope['url_route'] = {'kwargs': {'room_name': 'lobby'}}
+         await communicator.connect()
+         while not await communicator.receive_nothing(timeout=0.1):
+            await communicator.receive_output()
+         await communicator.send_to(bytes_data=msgpack.packb({'t': 6, 'e': 'blob', 'd': b'\x00\x01'}))
+         rejected = await communicator.receive_nothing(timeout=0.2)
+         # the consumer is still alive
+         await communicator.send_to(bytes_data=msgpack.packb({'t': 6, 'e': 'reaction', 'd': '+1'}))
+         frame = msgpack.unpackb((await communicator.receive_output())['bytes'])
+         await communicator.disconnect()
+         return rejected, frame
+
+      rejected, frame = async_to_sync(run)()
+      self.assertTrue(rejected)
+      self.assertEqual((frame['e'], frame['d']), ('reaction', '+1'))
+
+
+
+class ProtocolTests(TransactionTestCase):
+
+   def setUp(self):
+      self.alice = User.objects.create_user('alice', password='pass')
+
+   def test_msgpack_subprotocol_uses_short_binary_frames(self):
+      async def run():
+         communicator = WebsocketCommunicator(
+            ChatConsumer.as_asgi(), '/ws/chat/lobby/', subprotocols=['chat.v2.msgpack', 'chat.v1.msgpack']
+         )
+         communicator.scope['user'] = self.alice
+         communicator.scope['url_route'] = {'kwargs': {'room_name': 'lobby'}}
+         connected, subprotocol = await communicator.connect()
+         await communicator.send_to(bytes_data=msgpack.packb({'m': 'hello'}))
+         frames = {}
+         while not await communicator.receive_nothing(timeout=0.1):
+            frame = msgpack.unpackb((await communicator.receive_output())['bytes'])
+            frames[frame['t']] = frame
+         await communicator.disconnect()
+         return subprotocol, frames
+
+      subprotocol, frames = async_to_sync(run)()
+      self.assertEqual(subprotocol, 'chat.v1.msgpack')
+      self.assertEqual(frames[5], {'t': 5, 'us': ['alice']})
+      echoed = frames[1]
+      self.assertEqual((echoed['t'], echoed['m'], echoed['u']), (1, 'hello', 'alice'))
+      self.assertNotIn('img', echoed)
+
+   def test_clients_without_a_subprotocol_keep_json(self):
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         await communicator.send_json_to({'message': 'hello'})
+         frame = await communicator.receive_json_from()
+         await communicator.disconnect()
+         return frame
+
+      frame = async_to_sync(run)()
+      self.assertEqual((frame['type'], frame['message'], frame['image_url']), ('chat_message', 'hello', None))
+
+   def test_frames_that_are_not_objects_get_a_protocol_error(self):
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         errors = []
+         for text in ('null', '[1, 2]', '"hello"', '{"message": '):
+            await communicator.send_to(text_data=text)
+            errors.append(await communicator.receive_json_from())
+         # the consumer is still alive
+         await communicator.send_json_to({'message': 'hello'})
+         frame = await communicator.receive_json_from()
+         await communicator.disconnect()
+         return errors, frame
+
+      errors, frame = async_to_sync(run)()
+      self.assertEqual({error['type'] for error in errors}, {'error'})
+      self.assertEqual(
+         [error['error'] for error in errors[:3]],
+         ['Expected an object, got NoneType.', 'Expected an object, got list.', 'Expected an object, got str.'],
+      )
+      self.assertTrue(errors[3]['error'].startswith('Undecodable JSON frame'))
+      self.assertEqual(frame['message'], 'hello')
+
+   def test_mixed_codec_room_gets_one_encoding_per_codec(self):
+      bob = User.objects.create_user('bob', password='pass')
+      carol = User.objects.create_user('carol', password='pass')
+      encoded = []
+      original = Codec.encode
+
+      def counting_encode(codec, frame):
+         encoded.append((codec.name, frame['type']))
+         return original(codec, frame)
+
+      async def connect_msgpack(user):
+         communicator = WebsocketCommunicator(
+            ChatConsumer.as_asgi(), '/ws/chat/codecs/', subprotocols=['chat.v1.msgpack']
+         )
+         communicator.scope['user'] = user
+         communicator.scope['url_route'] = {'kwargs': {'room_name': 'codecs'}}
+         await communicator.connect()
+         while not await communicator.receive_nothing(timeout=0.1):
+            await communicator.receive_output()
+         return communicator
+
+      async def run():
+         bob_json = await connect(bob, 'codecs')
+         msgpack_clients = [await connect_msgpack(carol), await connect_msgpack(bob)]
+         alice = await connect(self.alice, 'codecs')
+         for communicator in [bob_json, *msgpack_clients]:
+            while not await communicator.receive_nothing(timeout=0.1):
+               await communicator.receive_output()
+         with mock.patch.object(Codec, 'encode', autospec=True, side_effect=counting_encode):
+            await alice.send_json_to({'message': 'hello'})
+            received = [await bob_json.receive_output(), await alice.receive_output()]
+            received += [await communicator.receive_output() for communicator in msgpack_clients]
+         for communicator in [bob_json, alice, *msgpack_clients]:
+            await communicator.disconnect()
+         return received
+
+      bob_json, alice_echo, *binary = async_to_sync(run)()
+      self.assertEqual(json.loads(bob_json['text'])['message'], 'hello')
+      self.assertEqual(bob_json['text'], alice_echo['text'])
+      self.assertNotIn('bytes', bob_json)
+      # ফ্যানআউটে প্রতি সকেটে নতুন করে encode হয় না; পাঠানো বাইটগুলোই সবাই পায়
+      self.assertEqual(binary[0]['bytes'], binary[1]['bytes'])
+      frame = msgpack.unpackb(binary[0]['bytes'])
+      self.assertEqual((frame['t'], frame['m'], frame['u']), (1, 'hello', 'alice'))
+      self.assertEqual(sorted(encoded), [('cbor', 'chat_message'), ('msgpack', 'chat_message')])
+
+
+class OutboundQueueTests(SimpleTestCase):
+
+   def make_queue(self, maxsize):
+      sent, closed = [], []
+      gate = asyncio.Event()
+
+      async def send(text, data):
+         await gate.wait()
+         sent.append(text)
+
+      async def snapshot():
+         return 'user_list', None
+
+      async def overflow(last_message_id):
+         closed.append(last_message_id)
+
+      return OutboundQueue(send, snapshot, overflow, maxsize), gate, sent, closed
+
+   def test_cheap_frames_give_way_first(self):
+      async def run():
+         queue, gate, sent, closed = self.make_queue(maxsize=4)
+         queue.put(MESSAGE, None, 'm1', message_id=1)
+         await asyncio.sleep(0)  # the writer takes m1 and blocks on the socket
+         queue.put(EPHEMERAL, None, 'e1')
+         queue.put(TYPING, 'typing:bob', 'bob start')
+         queue.put(PRESENCE, PRESENCE, 'joined carol')
+         queue.put(TYPING, 'typing:bob', 'bob stop')
+         queue.put(PRESENCE, PRESENCE, 'left dave')
+         queue.put(MESSAGE, None, 'm2', message_id=2)
+         queue.put(MESSAGE, None, 'm3', message_id=3)
+         queue.put(TYPING, 'typing:eve', 'eve start')
+         gate.set()
+         await queue.task
+         return sent, closed, queue.last_message_id
+
+      sent, closed, last_message_id = async_to_sync(run)()
+      # e1 made room for m3, eve's typing found none
+      self.assertEqual(sent, ['m1', 'bob stop', 'user_list', 'm2', 'm3'])
+      self.assertEqual(closed, [])
+      self.assertEqual(last_message_id, 3)
+
+   def test_message_overflow_closes_once_with_resume_cursor(self):
+      async def run():
+         queue, gate, sent, closed = self.make_queue(maxsize=2)
+         queue.put(MESSAGE, None, 'm1', message_id=1)
+         queue.put(MESSAGE, None, 'm2', message_id=2)
+         queue.put(MESSAGE, None, 'm3', message_id=3)
+         queue.put(MESSAGE, None, 'm4', message_id=4)
+         await asyncio.sleep(0)
+         return len(queue), queue.closed, closed
+
+      remaining, is_closed, closed = async_to_sync(run)()
+      self.assertEqual((remaining, is_closed, closed), (0, True, [None]))
+
+   def test_a_socket_that_stops_draining_fills_the_queue(self):
+      async def run():
+         sent, closed = [], []
+         drained = asyncio.Event()
+
+         async def send(text, data):
+            sent.append(text)
+
+         async def overflow(last_message_id):
+            closed.append(last_message_id)
+
+         # daphne's send() returns at once; only the drain wait holds the writer back
+         queue = OutboundQueue(send, None, overflow, 2, drained=drained.wait)
+         for i in range(1, 5):
+            queue.put(MESSAGE, None, f'm{i}', message_id=i)
+            await asyncio.sleep(0)
+         queue.cancel()
+         return sent, closed
+
+      self.assertEqual(async_to_sync(run)(), (['m1'], [1]))
+
+   def test_consumer_closes_a_client_whose_socket_stopped_draining(self):
+      room = f'slow_{uuid.uuid4().hex}'
+
+      async def run():
+         paused = asyncio.Event()
+         communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{room}/')
+         communicator.scope['user'] = AnonymousUser()
+         communicator.scope['url_route'] = {'kwargs': {'room_name': room}}
+         communicator.scope['extensions'] = {'chat.drained': paused.wait}
+         await communicator.connect()
+         layer = get_channel_layer()
+         for i in range(1, 10):
+            await layer.group_send(f'chat_{room}', frame_event(chat_message_frame('bob', '10:00 AM', i, f'hello {i}')))
+         frames = []
+         while True:
+            output = await communicator.receive_output()
+            if output['type'] == 'websocket.close':
+               return frames, output['code']
+            frames.append(json.loads(output['text']))
+
+      with override_settings(CHAT_OUTBOUND_QUEUE_SIZE=3):
+         frames, code = async_to_sync(run)()
+      # only the user list went out before the socket stopped draining
+      self.assertEqual([frame['type'] for frame in frames], ['user_list', 'resume'])
+      self.assertEqual((frames[-1]['message_id'], code), (None, 4008))
+
+   def test_only_chat_messages_advance_the_resume_cursor(self):
+      async def run():
+         queue, gate, sent, closed = self.make_queue(maxsize=10)
+         consumer = ChatConsumer()
+         consumer.outbound = queue
+         await consumer.send_frame(chat_message_frame('bob', '10:00 AM', 5, 'hello'))
+         # a receipt for a message this socket has not been sent yet, on both paths
+         await consumer.message_read_update({'message_id': 9, 'up_to': 9, 'reader': 'bob'})
+         await consumer.chat_frame(frame_event({'type': 'message_read', 'message_id': 9, 'up_to': 9, 'reader': 'bob'}))
+         await consumer.send_frame({'type': 'media_update', 'message_id': 12, 'image_url': '/m/12.webp'})
+         gate.set()
+         await queue.task
+         return len(sent), queue.last_message_id
+
+      self.assertEqual(async_to_sync(run)(), (4, 5))
+
+
+class BackpressureProtocolTests(SimpleTestCase):
+
+   def test_socket_takes_over_the_transport_and_reports_drains(self):
+      transport = StringTransport()
+      # daphne leaves the HTTP channel registered on the upgraded transport
+      transport.registerProducer(object(), True)
+      protocol = DeflateWebSocketFactory(None).buildProtocol(None)
+      protocol.makeConnection(transport)
+      self.assertIs(transport.producer, protocol)
+
+      async def run():
+         protocol.pauseProducing()
+         waiter = asyncio.ensure_future(protocol.drained())
+         await asyncio.sleep(0.01)
+         paused = waiter.done()
+         protocol.resumeProducing()
+         await asyncio.wait_for(waiter, 1)
+         return paused
+
+      self.assertFalse(async_to_sync(run)())
+
+
+class RecentMessageCacheTests(TransactionTestCase):
+
+   def setUp(self):
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+      Message.objects.bulk_create(Message(user=self.bob, room_name='lobby', content=f'old {i}') for i in range(3))
+      self.client = Client()
+      self.client.force_login(self.alice)
+
+   def message_queries(self):
+      with CaptureQueriesContext(connection) as ctx:
+         response = self.client.get('/chat/lobby/')
+      return response, [q['sql'] for q in ctx.captured_queries if 'chat_message' in q['sql']]
+
+   def test_room_page_is_served_from_the_cache_and_written_through(self):
+      _, queries = self.message_queries()
+      self.assertEqual(len(queries), 1)
+
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         await communicator.send_json_to({'message': 'fresh'})
+         await communicator.receive_json_from()
+         await communicator.disconnect()
+
+      async_to_sync(run)()
+      response, queries = self.message_queries()
+      self.assertEqual(queries, [])
+      self.assertEqual(
+         [msg.content for msg in response.context['messages']], ['old 0', 'old 1', 'old 2', 'fresh']
+      )
+      self.assertEqual(response.context['messages'][-1].username, 'alice')
+
+   def test_read_receipts_and_edits_reach_the_cache(self):
+      self.message_queries()
+      newest = Message.objects.order_by('id').last()
+
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         await communicator.send_json_to({'type': 'message_read', 'message_id': newest.id})
+         await communicator.receive_json_from()
+         await communicator.disconnect()
+
+      async_to_sync(run)()
+      response, queries = self.message_queries()
+      self.assertEqual(queries, [])
+      self.assertTrue(all(msg.is_read for msg in response.context['messages']))
+
+      newest.content = 'edited'
+      newest.save()
+      response, queries = self.message_queries()
+      self.assertEqual(len(queries), 1)
+      self.assertEqual(response.context['messages'][-1].content, 'edited')
+
+
+   def test_other_workers_messages_appear_after_the_ttl_and_in_replays(self):
+      self.message_queries()
+      first = Message.objects.order_by('id').first()
+      # saved by another worker: this process's cache never sees it written
+      Message.objects.create(user=self.bob, room_name='lobby', content='from elsewhere')
+
+      response, queries = self.message_queries()
+      self.assertEqual((len(queries), len(response.context['messages'])), (0, 3))
+
+      async def resume():
+         get_replay_buffer(get_channel_layer()).rooms.clear()
+         communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/lobby/?after={first.id}')
+         communicator.scope['user'] = self.alice
+         communicator.scope['url_route'] = {'kwargs': {'room_name': 'lobby'}}
+         await communicator.connect()
+         frames = []
+         while not await communicator.receive_nothing(timeout=0.1):
+            frames.append(await communicator.receive_json_from())
+         await communicator.disconnect()
+         return [f for f in frames if f['type'] in ('chat_message', 'replay')]
+
+      frames = async_to_sync(resume)()
+      self.assertEqual([f.get('message') for f in frames], ['old 1', 'old 2', 'from elsewhere', None])
+      self.assertTrue(frames[-1]['complete'])
+
+      later = time.monotonic() + recent_messages.ttl + 1
+      with mock.patch('chat.recent.time.monotonic', return_value=later):
+         response, queries = self.message_queries()
+      self.assertEqual(len(queries), 1)
+      self.assertEqual(response.context['messages'][-1].content, 'from elsewhere')
+
+   def test_concurrent_writers_and_readers_lose_nothing(self):
+      cache = RecentMessageCache(size=5000, max_rooms=10, ttl=60)
+      cache.rooms.set('busy', RecentRoom(collections.deque(maxlen=5000), False, time.monotonic() + 60))
+      now = timezone.now()
+      errors = []
+
+      def writer(offset):
+         try:
+            for i in range(offset, offset + 1000):
+               cache.add('busy', RecentMessage(i, 1, 'bob', 'hi', None, None, now, False))
+         except Exception as e:
+            errors.append(e)
+
+      def reader():
+         try:
+            for i in range(300):
+               cache.mark_read('busy', i * 5, 2)
+               cache.set_media('busy', i, {'width': 8})
+               cache.page('busy')
+         except Exception as e:
+            errors.append(e)
+
+      threads = [threading.Thread(target=writer, args=(n * 1000,)) for n in range(3)]
+      threads += [threading.Thread(target=reader) for _ in range(2)]
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+      self.assertEqual(errors, [])
+      self.assertEqual(sorted(msg.id for msg in cache.page('busy')[0]), list(range(3000)))
+
+
+class StatusWriterTests(TransactionTestCase):
+
+   def setUp(self):
+      self.alice = User.objects.create_user('alice', password='pass')
+
+   def test_reconnects_within_the_grace_period_write_nothing(self):
+      async def run():
+         writer = StatusWriter(interval=60, grace=0.2)
+         flushes = []
+         async def flush():
+            async with capture_queries() as ctx:
+               await writer.flush()
+            flushes.append(ctx)
+
+         writer.connect(self.alice.id)
+         writer.connect(self.alice.id)
+         await flush()
+         online = await sync_to_async(UserProfile.objects.get)(user=self.alice)
+
+         # page navigation: both tabs close, one comes straight back
+         writer.disconnect(self.alice.id)
+         writer.disconnect(self.alice.id)
+         writer.connect(self.alice.id)
+         await flush()
+
+         writer.disconnect(self.alice.id)
+         await flush()
+         await asyncio.sleep(0.25)
+         await flush()
+         offline = await sync_to_async(UserProfile.objects.get)(user=self.alice)
+         writer.flusher.cancel()
+         return flushes, online, offline
+
+      flushes, online, offline = async_to_sync(run)()
+      writes = [
+         len([q for q in ctx.captured_queries if q['sql'] not in ('BEGIN', 'COMMIT')]) for ctx in flushes
+      ]
+      self.assertEqual(writes, [1, 0, 0, 1])
+      self.assertTrue(online.is_online)
+      self.assertFalse(offline.is_online)
+      self.assertGreater(offline.last_seen, online.last_seen)
+
+   def test_saving_a_user_leaves_the_profile_alone(self):
+      with CaptureQueriesContext(connection) as ctx:
+         self.alice.save(update_fields=['last_login'])
+      self.assertEqual(len(ctx.captured_queries), 1)
+
+
+class HistoryTests(TransactionTestCase):
+
+   def setUp(self):
+      private_rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+      self.client = Client()
+      self.client.force_login(self.alice)
+      now = timezone.now()
+      # ties on timestamp are broken by id, so a page boundary can fall inside a burst
+      for i in range(2):
+         Message.objects.create(user=self.bob, room_name='lobby', content=f'early {i}', timestamp=now - datetime.timedelta(minutes=5))
+      for i in range(5):
+         Message.objects.create(user=self.bob, room_name='lobby', content=f'burst {i}', timestamp=now)
+      self.newest_first = list(Message.objects.order_by('-timestamp', '-id').values_list('content', flat=True))
+
+   def get(self, room, **params):
+      return self.client.get(f'/chat/history/{room}/', params)
+
+   def test_before_and_after_walk_equal_timestamps_without_gaps(self):
+      seen, params = [], {'limit': 2}
+      while True:
+         page = self.get('lobby', **params).json()
+         seen += [msg['message'] for msg in page['messages']]
+         if not page['has_more']:
+            break
+         params['before'] = page['before']
+      self.assertEqual(seen, self.newest_first)
+
+      # the end of the history: the last page's cursor leads nowhere
+      end = self.get('lobby', before=page['before']).json()
+      self.assertEqual((end['messages'], end['has_more'], end['before']), ([], False, None))
+
+      # walking back up from the oldest burst message
+      oldest_burst = self.get('lobby', limit=5).json()
+      page = self.get('lobby', after=oldest_burst['before'], limit=2).json()
+      self.assertEqual([msg['message'] for msg in page['messages']], ['burst 2', 'burst 1'])
+      self.assertTrue(page['has_more'])
+      page = self.get('lobby', after=page['after'], limit=2).json()
+      self.assertEqual([msg['message'] for msg in page['messages']], ['burst 4', 'burst 3'])
+      self.assertFalse(page['has_more'])
+
+   def test_malformed_requests_are_rejected(self):
+      for params in ({'before': 'not-a-cursor'}, {'after': 'e30='}, {'limit': 'many'}):
+         response = self.get('lobby', **params)
+         self.assertEqual(response.status_code, 400, params)
+      self.assertEqual(self.get('lobby', before='not-a-cursor').json(), {'error': 'Invalid cursor.'})
+
+   def test_private_history_is_for_members_only(self):
+      room = get_or_create_private_room(self.alice, self.bob)
+      PrivateMessage.objects.create(room=room, sender=self.bob, content='just us')
+      self.assertEqual([m['message'] for m in self.get(room.room_id).json()['messages']], ['just us'])
+
+      carol = User.objects.create_user('carol', password='pass')
+      self.client.force_login(carol)
+      self.assertEqual(self.get(room.room_id).status_code, 404)
+      self.assertEqual(self.get('private_998_999').status_code, 404)
+      self.client.logout()
+      self.assertEqual(self.get(room.room_id).status_code, 302)
+
+
+class InboxTests(TransactionTestCase):
+
+   def setUp(self):
+      private_rooms.clear()
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+      self.room = get_or_create_private_room(self.alice, self.bob)
+
+   def talk(self, *lines):
+      async def run():
+         sockets = {'alice': await connect(self.alice, self.room.room_id), 'bob': await connect(self.bob, self.room.room_id)}
+         await sockets['alice'].receive_json_from()  # bob এর presence
+         ids = []
+         for name, text in lines:
+            await sockets[name].send_json_to({'message': text})
+            for communicator in sockets.values():
+               ids.append((await communicator.receive_json_from())['message_id'])
+         await get_inbox_writer().flush()
+         for communicator in sockets.values():
+            await communicator.disconnect()
+         return ids
+
+      return async_to_sync(run)()
+
+   def test_messages_and_receipts_update_both_inboxes(self):
+      ids = self.talk(('bob', 'are you there?'), ('bob', 'ping'), ('alice', 'yes, here'))
+      alice = Conversation.objects.get(user=self.alice)
+      bob = Conversation.objects.get(user=self.bob)
+      self.assertEqual((alice.peer_id, alice.unread_count, alice.snippet), (self.bob.id, 2, 'yes, here'))
+      self.assertEqual((bob.peer_id, bob.unread_count, bob.last_sender), (self.alice.id, 1, 'alice'))
+      self.assertEqual(alice.last_message_id, ids[-1])
+
+      async def read():
+         communicator = await connect(self.alice, self.room.room_id)
+         await communicator.send_json_to({'type': 'message_read', 'message_id': ids[2]})
+         await communicator.receive_json_from()
+         await communicator.disconnect()
+         await get_inbox_writer().flush()
+
+      async_to_sync(read)()
+      self.assertEqual(Conversation.objects.get(user=self.alice).unread_count, 0)
+
+   def test_migration_backfills_existing_private_rooms(self):
+      executor = MigrationExecutor(connection)
+      executor.migrate([('chat', '0015_search_room_unindexed')])
+      carol = User.objects.create_user('carol', password='pass')
+      get_or_create_private_room(self.alice, carol)  # never used: stays off both inboxes
+      dave = User.objects.create_user('dave', password='pass')
+      with_dave = get_or_create_private_room(dave, self.bob)
+      PrivateMessage.objects.create(room=self.room, sender=self.bob, content='hi', is_read=True)
+      PrivateMessage.objects.create(room=self.room, sender=self.bob, content='ping')
+      last = PrivateMessage.objects.create(room=self.room, sender=self.alice, image='chat_images/cat.png')
+      PrivateMessage.objects.create(room=with_dave, sender=dave, content='x' * 150)
+      # written by the inbox writer after the deploy, before the migration ran
+      Conversation.objects.create(user=dave, room_name=with_dave.room_id, peer=self.bob, snippet='newer')
+
+      MigrationExecutor(connection).migrate([('chat', '0016_backfill_private_conversations')])
+      rows = {
+         (row.user.username, row.peer.username): (row.last_message_id, row.last_sender, row.snippet, row.unread_count)
+         for row in Conversation.objects.select_related('user', 'peer')
+      }
+      self.assertEqual(rows, {
+         ('alice', 'bob'): (last.id, 'alice', '📷 Photo', 1),
+         ('bob', 'alice'): (last.id, 'alice', '📷 Photo', 1),
+         ('bob', 'dave'): (rows[('bob', 'dave')][0], 'dave', 'x' * 100, 1),
+         ('dave', 'bob'): (0, '', 'newer', 0),
+      })
+      self.assertEqual(Conversation.objects.get(user=self.alice).last_message_at, last.timestamp)
+
+   def test_landing_page_is_one_query_and_the_inbox_paginates(self):
+      others = User.objects.bulk_create(User(username=f'user{i}') for i in range(40))
+      Conversation.objects.bulk_create(
+         Conversation(user=self.alice, room_name=f'private_{self.alice.id}_{user.id}', peer=user, snippet=f'hi {i}')
+         for i, user in enumerate(others)
+      )
+      client = Client()
+      client.force_login(self.alice)
+      with CaptureQueriesContext(connection) as ctx:
+         response = client.get('/chat/')
+      inbox_queries = [q for q in ctx.captured_queries if 'chat_conversation' in q['sql']]
+      self.assertEqual(len(inbox_queries), 1)
+      self.assertContains(response, 'user39')
+
+      first = client.get('/chat/inbox/', {'limit': 25}).json()
+      second = client.get('/chat/inbox/', {'limit': 25, 'cursor': first['next']}).json()
+      titles = [c['title'] for c in first['conversations'] + second['conversations']]
+      self.assertEqual(len(titles), 40)
+      self.assertEqual(len(set(titles)), 40)
+      self.assertIsNone(second['next'])
+
+
+class ReplayTests(TransactionTestCase):
+
+   def setUp(self):
+      get_replay_buffer(get_channel_layer()).rooms.clear()
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+
+   def reconnect(self, after):
+      async def run():
+         communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/standup/?after={after}')
+         communicator.scope['user'] = self.alice
+         communicator.scope['url_route'] = {'kwargs': {'room_name': 'standup'}}
+         await communicator.connect()
+         frames = []
+         while not await communicator.receive_nothing(timeout=0.1):
+            frames.append(await communicator.receive_json_from())
+         await communicator.disconnect()
+         return [f for f in frames if f['type'] in ('chat_message', 'replay')]
+
+      return async_to_sync(run)()
+
+   def test_gap_is_replayed_from_the_room_ring(self):
+      async def run():
+         communicator = await connect(self.alice, 'standup')
+         ids = []
+         for i in range(3):
+            await communicator.send_json_to({'message': f'update {i}'})
+            ids.append((await communicator.receive_json_from())['message_id'])
+         await communicator.disconnect()
+         return ids
+
+      ids = async_to_sync(run)()
+      # served from memory: the rows are not even needed any more
+      Message.objects.all().delete()
+      frames = self.reconnect(ids[0])
+      self.assertEqual([f.get('message') for f in frames], ['update 1', 'update 2', None])
+      self.assertEqual(frames[-1], {'type': 'replay', 'count': 2, 'complete': True})
+
+   def test_falls_back_to_a_keyset_page(self):
+      messages = Message.objects.bulk_create(
+         Message(user=self.alice, room_name='standup', content=f'old {i}') for i in range(4)
+      )
+      frames = self.reconnect(messages[0].id)
+      self.assertEqual([f['message_id'] for f in frames[:-1]], [m.id for m in messages[1:]])
+      self.assertEqual(frames[-1], {'type': 'replay', 'count': 3, 'complete': True})
+
+      with override_settings(CHAT_REPLAY_LIMIT=2):
+         frames = self.reconnect(messages[0].id)
+      self.assertEqual(frames[-1], {'type': 'replay', 'count': 2, 'complete': False})
+
+   def test_private_rooms_are_only_resumed_by_their_members(self):
+      bob = User.objects.create_user('bob', password='pass')
+      room = get_or_create_private_room(self.alice, bob)
+      first = PrivateMessage.objects.create(room=room, sender=bob, content='psst')
+      PrivateMessage.objects.create(room=room, sender=self.alice, content='the plan')
+      carol = User.objects.create_user('carol', password='pass')
+
+      async def resume(user):
+         communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{room.room_id}/?after={first.id}')
+         communicator.scope['user'] = user
+         communicator.scope['url_route'] = {'kwargs': {'room_name': room.room_id}}
+         connected, _ = await communicator.connect()
+         frames = []
+         if connected:
+            while not await communicator.receive_nothing(timeout=0.1):
+               frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+         return connected, [f['message'] for f in frames if f['type'] == 'chat_message']
+
+      self.assertEqual(async_to_sync(resume)(carol), (False, []))
+      self.assertEqual(async_to_sync(resume)(AnonymousUser()), (False, []))
+      self.assertEqual(async_to_sync(resume)(bob), (True, ['the plan']))
+
+
+@override_settings(CHAT_LOCAL_FANOUT=True, CHAT_GROUP_SHARDS=4)
+class FanoutTests(TransactionTestCase):
+
+   def setUp(self):
+      self.users = [User.objects.create_user(f'user{i}', password='pass') for i in range(3)]
+
+   def test_room_joins_the_layer_once_per_worker(self):
+      layer = get_channel_layer()
+
+      async def run():
+         sockets = [await connect(user, 'townhall') for user in self.users]
+         for communicator in sockets:
+            while not await communicator.receive_nothing(timeout=0.05):
+               await communicator.receive_from()
+         members = {name: set(channels) for name, channels in layer.groups.items() if name.startswith('chat_townhall')}
+         await sockets[0].send_json_to({'message': 'hello everyone'})
+         received = [await communicator.receive_json_from() for communicator in sockets]
+         for communicator in sockets:
+            await communicator.disconnect()
+         left = [name for name, channels in layer.groups.items() if name.startswith('chat_townhall') and channels]
+         return members, received, left
+
+      members, received, left = async_to_sync(run)()
+      # one relay channel in one of the four sub-groups, not three sockets
+      self.assertEqual(len(members), 1)
+      [(group, channels)] = members.items()
+      self.assertRegex(group, r'^chat_townhall\.[0-3]$')
+      self.assertEqual(len(channels), 1)
+      self.assertTrue(next(iter(channels)).startswith('fanout.'))
+      self.assertEqual([frame['message'] for frame in received], ['hello everyone'] * 3)
+      self.assertEqual(left, [])
+
+
+class MediaTests(TransactionTestCase):
+
+   def setUp(self):
+      media_root = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, media_root)
+      settings = override_settings(MEDIA_ROOT=media_root, CHAT_MEDIA_THUMBNAIL_SIZE=64, CHAT_MEDIA_FFMPEG='')
+      settings.enable()
+      self.addCleanup(settings.disable)
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+
+   def test_image_variants_are_pushed_to_the_room(self):
+      png = io.BytesIO()
+      Image.new('RGB', (400, 300), 'teal').save(png, 'PNG')
+      data_url = 'data:image/png;base64,' + base64.b64encode(png.getvalue()).decode()
+
+      recent_messages.page('gallery')
+
+      async def run():
+         communicator = await connect(self.alice, 'gallery')
+         await communicator.send_json_to({'type': 'file', 'file_data': data_url, 'file_name': 'photo.png'})
+         message = await communicator.receive_json_from()
+         update = await communicator.receive_json_from(timeout=5)
+         await communicator.disconnect()
+         return message, update
+
+      message, update = async_to_sync(run)()
+      self.assertTrue(message['image_url'].endswith('.png'))
+      self.assertEqual((update['type'], update['message_id']), ('media_update', message['message_id']))
+      self.assertEqual((update['width'], update['height']), (400, 300))
+      self.assertTrue(update['image_url'].endswith('.webp'))
+
+      msg = Message.objects.get(id=message['message_id'])
+      self.assertTrue(msg.image.name.endswith('.png'))
+      with Image.open(msg.thumbnail) as thumbnail:
+         self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (64, 48)))
+      self.assertEqual(recent_messages.page('gallery')[0][0].thumbnail_url, update['thumbnail_url'])
+
+   def test_wav_is_downmixed_without_ffmpeg(self):
+      recording = io.BytesIO()
+      with wave.open(recording, 'wb') as wav:
+         wav.setnchannels(2)
+         wav.setsampwidth(2)
+         wav.setframerate(48000)
+         wav.writeframes(bytes(48000 * 4))
+      msg = Message.objects.create(
+         user=self.alice, room_name='voice', audio=ContentFile(recording.getvalue(), name='voice.wav')
+      )
+
+      frame = process_job(MediaJob('chat.Message', msg.id, 'voice', 'chat_voice'))
+      msg.refresh_from_db()
+      self.assertEqual(frame['audio_url'], msg.audio_compressed.url)
+      with wave.open(msg.audio_compressed) as wav:
+         self.assertEqual((wav.getnchannels(), wav.getframerate(), wav.getnframes()), (1, 16000, 16000))
+      # already processed
+      self.assertIsNone(process_job(MediaJob('chat.Message', msg.id, 'voice', 'chat_voice')))
+
+
+class ArchiveTests(TransactionTestCase):
+
+   def setUp(self):
+      archive_dir = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, archive_dir)
+      settings = override_settings(CHAT_ARCHIVE_DIR=archive_dir, CHAT_RETENTION_DAYS=30, CHAT_ARCHIVE_BATCH_SIZE=3)
+      settings.enable()
+      self.addCleanup(settings.disable)
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      now = timezone.now()
+      self.messages = Message.objects.bulk_create(
+         Message(user=self.alice, room_name=room, content=f'{room} {i}', timestamp=now - datetime.timedelta(days=days))
+         for room in ('general', 'records')
+         for i, days in enumerate([90, 80, 70, 60, 50, 40, 10, 5])
+      )
+
+   def test_old_messages_move_to_segments_and_history_reads_through(self):
+      RoomRetention.objects.create(room_name='records', days=None)
+      call_command('archive_messages', stdout=io.StringIO())
+
+      self.assertEqual(
+         list(Message.objects.filter(room_name='general').values_list('content', flat=True)), ['general 6', 'general 7']
+      )
+      self.assertEqual(Message.objects.filter(room_name='records').count(), 8)
+      self.assertEqual(
+         list(ArchiveSegment.objects.order_by('first_id').values_list('message_count', flat=True)), [3, 3]
+      )
+
+      client = Client()
+      client.force_login(self.alice)
+      contents, before = [], ''
+      while True:
+         page = client.get('/chat/history/general/', {'limit': 3, 'before': before}).json()
+         contents += [msg['message'] for msg in page['messages']]
+         if not page['has_more']:
+            break
+         before = page['before']
+      self.assertEqual(contents, [f'general {i}' for i in range(7, -1, -1)])
+
+      # an archived cursor walks forward out of the archive into the table
+      page = client.get('/chat/history/general/', {'limit': 3, 'after': page['after']}).json()
+      self.assertEqual([msg['message'] for msg in page['messages']], ['general 4', 'general 3', 'general 2'])
+      self.assertTrue(page['has_more'])
+      page = client.get('/chat/history/general/', {'limit': 3, 'after': page['after']}).json()
+      self.assertEqual([msg['message'] for msg in page['messages']], ['general 7', 'general 6', 'general 5'])
+      self.assertFalse(page['has_more'])
+
+   def test_room_page_offers_archived_history(self):
+      call_command('archive_messages', '--room', 'general', stdout=io.StringIO())
+      messages, has_more = recent_messages.page('general')
+      self.assertEqual([msg.content for msg in messages][:3], ['general 7', 'general 6', 'general 5'])
+      self.assertEqual(len(messages), 8)
+      self.assertFalse(has_more)
+
+
+class MultiplexTests(TransactionTestCase):
+
+   def setUp(self):
+      get_replay_buffer(get_channel_layer()).rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+
+   async def mux(self, user):
+      communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/mux/')
+      communicator.scope['user'] = user
+      connected, _ = await communicator.connect()
+      assert connected
+      return communicator
+
+   async def frames(self, communicator):
+      frames = []
+      while not await communicator.receive_nothing(timeout=0.1):
+         frames.append(await communicator.receive_json_from())
+      return frames
+
+   def test_one_socket_carries_several_rooms(self):
+      async def run():
+         mux = await self.mux(self.alice)
+         for room in ('lobby', 'random'):
+            await mux.send_json_to({'type': 'subscribe', 'room': room})
+         subscribed = await self.frames(mux)
+
+         other = await connect(self.bob, 'random')
+         await other.send_json_to({'message': 'hi from bob'})
+         await mux.send_json_to({'room': 'lobby', 'message': 'hi from alice'})
+         live = await self.frames(mux)
+
+         await mux.send_json_to({'type': 'unsubscribe', 'room': 'random'})
+         unsubscribed = await mux.receive_json_from()
+         await other.send_json_to({'message': 'anyone?'})
+         after = await self.frames(mux)
+         await other.disconnect()
+         await mux.disconnect()
+         return subscribed, live, unsubscribed, after
+
+      subscribed, live, unsubscribed, after = async_to_sync(run)()
+      self.assertEqual(
+         [(f['room'], f['type']) for f in subscribed if f['type'] in ('subscribed', 'user_list')],
+         [('lobby', 'subscribed'), ('lobby', 'user_list'), ('random', 'subscribed'), ('random', 'user_list')],
+      )
+      messages = {f['room']: f['message'] for f in live if f['type'] == 'chat_message'}
+      self.assertEqual(messages, {'random': 'hi from bob', 'lobby': 'hi from alice'})
+      self.assertEqual(Message.objects.get(content='hi from alice').room_name, 'lobby')
+      self.assertEqual(unsubscribed, {'type': 'unsubscribed', 'room': 'random'})
+      self.assertEqual(after, [])
+
+   @override_settings(CHAT_MUX_MAX_ROOMS=1)
+   def test_refuses_foreign_private_rooms_and_too_many_rooms(self):
+      carol = User.objects.create_user('carol', password='pass')
+      room = get_or_create_private_room(self.bob, carol)
+
+      async def run():
+         mux = await self.mux(self.alice)
+         await mux.send_json_to({'type': 'subscribe', 'room': room.room_id})
+         await mux.send_json_to({'type': 'subscribe', 'room': 'lobby'})
+         await mux.send_json_to({'type': 'subscribe', 'room': 'random'})
+         await mux.send_json_to({'room': 'random', 'message': 'hello?'})
+         await mux.send_to(text_data='null')
+         frames = await self.frames(mux)
+         await mux.disconnect()
+         return frames
+
+      errors = [(f.get('room'), f['error']) for f in async_to_sync(run)() if f['type'] == 'error']
+      self.assertEqual(errors, [
+         (room.room_id, 'Unknown room.'), ('random', 'Too many rooms.'), ('random', 'Not subscribed.'),
+         (None, 'Expected an object, got NoneType.'),
+      ])
+
+
+class WhoAmI(AsyncWebsocketConsumer):
+   async def connect(self):
+      await self.accept()
+      await self.send(text_data=self.scope['user'].get_username())
+
+
+class AuthCacheTests(TransactionTestCase):
+
+   def setUp(self):
+      sessions.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.client = Client()
+      self.client.login(username='alice', password='pass')
+      self.cookie = f'sessionid={self.client.cookies["sessionid"].value}'.encode()
+
+   def handshake(self):
+      async def run():
+         app = CachedAuthMiddlewareStack(WhoAmI.as_asgi())
+         async with capture_queries() as ctx:
+            # the application task has to start inside the capture
+            communicator = WebsocketCommunicator(app, '/ws/chat/lobby/', headers=[(b'cookie', self.cookie)])
+            await communicator.connect()
+            username = await communicator.receive_from()
+         await communicator.disconnect()
+         return username, ctx
+
+      username, ctx = async_to_sync(run)()
+      return username, len(ctx)
+
+   def test_reconnects_skip_the_database(self):
+      username, queries = self.handshake()
+      self.assertEqual(username, 'alice')
+      self.assertEqual(queries, 2)
+      self.assertEqual(self.handshake(), ('alice', 0))
+
+   def test_password_change_and_logout_invalidate(self):
+      self.handshake()
+      self.alice.set_password('new pass')
+      self.alice.save()
+      self.assertEqual(self.handshake()[0], '')
+
+      self.client.login(username='alice', password='new pass')
+      self.cookie = f'sessionid={self.client.cookies["sessionid"].value}'.encode()
+      self.assertEqual(self.handshake()[0], 'alice')
+      self.client.logout()
+      self.assertEqual(self.handshake()[0], '')
+
+   @override_settings(CHAT_AUTH_CACHE_TTL=0)
+   def test_disabled_cache_queries_every_time(self):
+      self.handshake()
+      self.assertEqual(self.handshake(), ('alice', 2))
+
+
+class DatabaseThreadTests(TransactionTestCase):
+
+   def setUp(self):
+      self.alice = User.objects.create_user('alice', password='pass')
+
+   def test_calls_share_one_thread_by_default(self):
+      names = async_to_sync(self.thread_names)()
+      self.assertEqual(len(set(names)), 1)
+      self.assertFalse(names[0].startswith('chat-db'))
+
+   @override_settings(CHAT_DB_THREADS=2)
+   def test_pool_runs_calls_concurrently(self):
+      barrier = threading.Barrier(2, timeout=5)
+
+      @db_sync_to_async
+      def wait_for_each_other():
+         # a single thread would break the barrier with a timeout
+         barrier.wait()
+         return threading.current_thread().name
+
+      async def run():
+         return await asyncio.gather(wait_for_each_other(), wait_for_each_other())
+
+      names = async_to_sync(run)()
+      self.assertEqual(len(set(names)), 2)
+      self.assertTrue(all(name.startswith('chat-db') for name in names))
+
+   @override_settings(CHAT_DB_THREADS=2)
+   def test_consumer_saves_through_the_pool(self):
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         await communicator.send_json_to({'message': 'from a pool thread'})
+         frame = await communicator.receive_json_from()
+         await communicator.disconnect()
+         return frame
+
+      frame = async_to_sync(run)()
+      self.assertEqual(Message.objects.get(pk=frame['message_id']).content, 'from a pool thread')
+
+   @override_settings(CHAT_DB_THREADS=2)
+   def test_concurrent_consumers_share_a_bounded_set_of_connections(self):
+      opened = []
+
+      def count(sender, connection, **kwargs):
+         opened.append(connection)
+
+      async def run():
+         # own room, and always disconnected: a failed run must not leave members behind for other tests
+         sockets = [await connect(self.alice, 'burst') for _ in range(10)]
+         connection_created.connect(count)
+         try:
+            await asyncio.gather(*(c.send_json_to({'message': f'burst {i}'}) for i, c in enumerate(sockets)))
+            delivered = 0
+            while delivered < len(sockets):
+               delivered += (await sockets[0].receive_json_from())['type'] == 'chat_message'
+         finally:
+            connection_created.disconnect(count)
+            for communicator in sockets:
+               await communicator.disconnect()
+
+      async_to_sync(run)()
+      self.assertEqual(Message.objects.filter(content__startswith='burst').count(), 10)
+      # only the two pool threads may open connections, however many sockets write at once
+      self.assertLessEqual(len(opened), 2)
+
+   def test_pool_statistics_are_exported(self):
+      stats = {'pool_max': 8, 'pool_size': 3, 'pool_available': 1, 'requests_num': 40, 'requests_wait_ms': 1500}
+      with mock.patch('chat.db.pool_stats', return_value=stats):
+         body = Client().get('/metrics').content.decode()
+      self.assertIn('chat_db_pool_connections{stat="pool_size"} 3', body)
+      self.assertIn('chat_db_pool_wait_seconds_total 1.5', body)
+      self.assertIn('chat_db_pool_errors_total{stat="connections_lost"} 0', body)
+
+   async def thread_names(self):
+      @db_sync_to_async
+      def name():
+         return threading.current_thread().name
+
+      return [await name() for _ in range(3)]
+
+
+class MetricsTests(TransactionTestCase):
+
+   def setUp(self):
+      self.alice = User.objects.create_user('alice', password='pass')
+
+   def test_consumer_phases_are_exported(self):
+      key = (('type', 'text'),)
+      before = WS_FRAME.values.get(key, [None, 0, 0])[2]
+
+      async def run():
+         communicator = await connect(self.alice, 'lobby')
+         await communicator.send_json_to({'message': 'hello'})
+         await communicator.receive_json_from()
+         await communicator.disconnect()
+
+      async_to_sync(run)()
+      self.assertEqual(WS_FRAME.values[key][2], before + 1)
+
+      body = Client().get('/metrics').content.decode()
+      self.assertIn('# TYPE chat_ws_frame_seconds histogram', body)
+      self.assertIn('chat_ws_frame_seconds_bucket{type="text",le="+Inf"}', body)
+      self.assertIn('chat_db_seconds_count{op="save_message"}', body)
+      self.assertIn('chat_ws_phase_seconds_count{phase="group_send"}', body)
+
+   @override_settings(CHAT_METRICS_TOKEN='s3cret')
+   def test_token_protects_the_endpoint(self):
+      self.assertEqual(Client().get('/metrics').status_code, 401)
+      response = Client().get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+      self.assertEqual(response.status_code, 200)
+      self.assertIn('chat_http_request_seconds', response.content.decode())
+
+
+class QueryPlanTests(TransactionTestCase):
+
+   def setUp(self):
+      private_rooms.clear()
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+      self.room = get_or_create_private_room(self.alice, self.bob)
+      users = [self.alice, self.bob]
+      # planners happily scan tiny tables, so give every table a realistic size
+      others = User.objects.bulk_create(User(username=f'user{i}') for i in range(300))
+      UserProfile.objects.bulk_create(UserProfile(user=user) for user in others)
+      PrivateChatRoom.objects.bulk_create(
+         PrivateChatRoom(user1=self.alice, user2=user, room_id=f'private_{self.alice.id}_{user.id}')
+         for user in others
+      )
+      Message.objects.bulk_create(
+         Message(user=users[i % 2], room_name=f'room{i % 20}', content=f'hello {i}', is_read=i % 3 == 0)
+         for i in range(4000)
+      )
+      PrivateMessage.objects.bulk_create(
+         PrivateMessage(room=self.room, sender=users[i % 2], content=f'hi {i}') for i in range(1000)
+      )
+      Conversation.objects.bulk_create(
+         Conversation(user=self.alice, room_name=f'private_{self.alice.id}_{user.id}', peer=user) for user in others
+      )
+      with connection.cursor() as cursor:
+         cursor.execute('ANALYZE')
+      self.client = Client()
+      self.client.force_login(self.alice)
+
+   def test_room_views_and_search_use_indexes(self):
+      with assert_no_sequential_scans():
+         self.client.get('/chat/')
+         self.client.get('/chat/inbox/')
+         self.client.get('/chat/room3/')
+         self.client.get(f'/chat/private/{self.bob.id}/')
+         self.client.get('/chat/search/room3/', {'q': 'hello 1'})
+         self.client.get(f'/chat/search/{self.room.room_id}/', {'q': 'hi'})
+
+   def test_consumer_queries_use_indexes(self):
+      message = PrivateMessage.objects.filter(room=self.room, sender=self.bob).last()
+
+      async def run():
+         communicator = await connect(self.alice, self.room.room_id, f'?after={message.id - 500}')
+         await communicator.send_json_to({'message': 'hello'})
+         await communicator.receive_json_from()
+         await communicator.send_json_to({'type': 'message_read', 'message_id': message.id})
+         await communicator.receive_json_from()
+         await communicator.disconnect()
+         await get_inbox_writer().flush()
+
+      with assert_no_sequential_scans():
+         async_to_sync(run)()
+
+
+class SearchTests(TransactionTestCase):
+
+   def setUp(self):
+      private_rooms.clear()
+      recent_messages.rooms.clear()
+      self.alice = User.objects.create_user('alice', password='pass')
+      self.bob = User.objects.create_user('bob', password='pass')
+      self.room = get_or_create_private_room(self.alice, self.bob)
+      Message.objects.create(user=self.bob, room_name='lobby', content='deploy tonight')
+      Message.objects.create(user=self.bob, room_name='lobby', content='deployment went fine')
+      Message.objects.create(user=self.bob, room_name='other', content='deploy elsewhere')
+      PrivateMessage.objects.create(room=self.room, sender=self.alice, content='secret deploy plan')
+
+   def check_backend(self, backend):
+      messages, has_more = backend.search('lobby', 'deploy')
+      # পুরো শব্দের মিল প্রিফিক্সের আগে, অন্য রুমের মেসেজ বাদ
+      self.assertEqual([m.content for m in messages], ['deploy tonight', 'deployment went fine'])
+      self.assertFalse(has_more)
+
+      messages, has_more = backend.search('lobby', 'dep', page=1, per_page=1)
+      self.assertEqual(len(messages), 1)
+      self.assertTrue(has_more)
+      messages, has_more = backend.search('lobby', 'dep', page=2, per_page=1)
+      self.assertEqual(len(messages), 1)
+      self.assertFalse(has_more)
+
+      self.assertEqual(len(backend.search('lobby', 'bo')[0]), 2)
+      self.assertEqual([m.content for m in backend.search(self.room.room_id, 'plan')[0]], ['secret deploy plan'])
+
+      Message.objects.create(user=self.alice, room_name='lobby', content='redeploy at noon')
+      self.assertEqual([m.content for m in backend.search('lobby', 'redeploy')[0]], ['redeploy at noon'])
+
+   def test_sqlite_fts_backend(self):
+      self.check_backend(SQLiteFTSSearchBackend())
+
+   def test_sqlite_fts_matches_the_room_exactly(self):
+      Message.objects.create(user=self.bob, room_name='lobby_annex', content='deploy annex')
+      Message.objects.create(user=self.bob, room_name='say "hi"', content='deploy quoted')
+      backend = SQLiteFTSSearchBackend()
+      # newer matches from rooms whose names share a token do not use up the window
+      with mock.patch('chat.search.RANK_WINDOW', 1):
+         self.assertEqual([m.content for m in backend.search('lobby', 'deploy')[0]], ['deployment went fine'])
+      self.assertEqual([m.content for m in backend.search('say "hi"', '"deploy')[0]], ['deploy quoted'])
+
+   @skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL')
+   def test_postgres_backend(self):
+      backend = PostgresSearchBackend()
+      self.check_backend(backend)
+      # _ in a username is a literal, not LIKE's any-character
+      for username in ('ops_bot', 'opsxbot'):
+         Message.objects.create(user=User.objects.create_user(username), room_name='lobby', content='ship it')
+      self.assertEqual([m.user.username for m in backend.search('lobby', 'ops_bot')[0]], ['ops_bot'])
+
+   def test_inverted_index_backend(self):
+      backend = InvertedIndexSearchBackend()
+      with mock.patch('chat.search._backend', backend):
+         self.check_backend(backend)
@@ -0,0 +1,174 @@
+import contextlib
+import fcntl
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+
+from .models import Message
+
+TOKEN_SALT = 'chat.uploads'
+READ_SIZE = 64 * 1024
+KINDS = {'file': 'image', 'audio': 'audio'}
+
+# স্টোরেজ (Cloudinary) আপলোড কনজিউমার আর ডাটাবেস থ্রেডের বাইরে চলে
+storage_executor = ThreadPoolExecutor(
+    max_workers=settings.CHAT_STORAGE_WORKERS, thread_name_prefix='chat-storage'
+)
+
+
+class UploadError(Exception):
+    pass
+
+
+def _paths(upload_id):
+    base = os.path.join(settings.CHAT_UPLOAD_DIR, upload_id)
+    return base + '.part', base + '.json'
+
+
+def received_bytes(upload):
+    part_path, _ = _paths(upload['id'])
+    return os.path.getsize(part_path)
+
+
+def cleanup_stale_uploads():
+    cutoff = time.time() - settings.CHAT_UPLOAD_TOKEN_MAX_AGE
+    upload_ids = {
+        os.path.splitext(name)[0] for name in os.listdir(settings.CHAT_UPLOAD_DIR)
+        if name.endswith(('.part', '.json'))
+    }
+    for upload_id in upload_ids:
+        expire_upload(upload_id, cutoff)
+
+
+def expire_upload(upload_id, cutoff):
+    """Remove an upload (data and meta together) whose data was last written before ``cutoff``."""
+    part_path, meta_path = _paths(upload_id)
+    try:
+        fh = open(part_path, 'rb')
+    except FileNotFoundError:
+        with contextlib.suppress(FileNotFoundError):
+            if os.path.getmtime(meta_path) < cutoff:
+                os.remove(meta_path)
+        return
+    with fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # একটা চাংক লেখা বা স্টোরেজে পাঠানো চলছে
+            return
+        if os.fstat(fh.fileno()).st_mtime >= cutoff:
+            return
+        for path in (meta_path, part_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def create_upload(user_id, filename, kind, size):
+    if kind not in KINDS:
+        raise UploadError(f'Unknown upload kind: {kind}')
+    if not 0 < size <= settings.CHAT_UPLOAD_MAX_SIZE:
+        raise UploadError('File is empty or too large.')
+
+    os.makedirs(settings.CHAT_UPLOAD_DIR, exist_ok=True)
+    cleanup_stale_uploads()
+    upload = {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'filename': os.path.basename(filename or ''),
+        'kind': kind,
+        'size': size,
+    }
+    part_path, meta_path = _paths(upload['id'])
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as fh:
+        json.dump(upload, fh)
+    return upload
+
+
+def load_upload(upload_id):
+    if not upload_id.isalnum():
+        return None
+    _, meta_path = _paths(upload_id)
+    try:
+        with open(meta_path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def write_chunk(upload, offset, stream):
+    """
+    Append one chunk read from ``stream`` at ``offset``, which must match the
+    bytes already received, so a client that lost a response can ask for the
+    current offset and resume. Memory use is bounded by READ_SIZE.
+    """
+    part_path, _ = _paths(upload['id'])
+    with open(part_path, 'ab') as fh:
+        # লেখার সময় cleanup এই আপলোড মুছবে না, আর একই আপলোডের দুটো চাংক একসাথে নয়
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        received = os.fstat(fh.fileno()).st_size
+        if offset != received:
+            raise UploadError(f'Expected offset {received}, got {offset}.')
+
+        remaining = upload['size'] - received
+        while remaining > 0:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            fh.write(data)
+            remaining -= len(data)
+        if remaining == 0 and stream.read(1):
+            fh.truncate(received)
+            raise UploadError('Chunk runs past the declared size.')
+    return upload['size'] - remaining
+
+
+def make_token(upload):
+    return signing.dumps({'id': upload['id'], 'user_id': upload['user_id']}, salt=TOKEN_SALT)
+
+
+def claim_upload(token, user_id):
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=settings.CHAT_UPLOAD_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        raise UploadError('Invalid or expired upload token.')
+    upload = load_upload(data['id'])
+    if upload is None or data['user_id'] != user_id or upload['user_id'] != user_id:
+        raise UploadError('Unknown upload.')
+    if received_bytes(upload) != upload['size']:
+        raise UploadError('Upload is not complete.')
+    return upload
+
+
+def discard_upload(upload):
+    for path in _paths(upload['id']):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def stored_field(upload):
+    return Message._meta.get_field(KINDS[upload['kind']])
+
+
+def discard_stored(upload, name):
+    stored_field(upload).storage.delete(name)
+
+
+def store_upload(upload):
+    # Message আর PrivateMessage দুটোর ফিল্ডে একই storage আর upload_to
+    field = stored_field(upload)
+    ext = os.path.splitext(upload['filename'])[1].lstrip('.').lower()
+    if not ext.isalnum():
+        ext = 'wav' if upload['kind'] == 'audio' else 'bin'
+    name = field.generate_filename(None, f'{uuid.uuid4()}.{ext}')
+    part_path, _ = _paths(upload['id'])
+    # ফাইলটা মোছা হয় না: মেসেজ সেভ হলে তবেই discard_upload, নাহলে একই টোকেনে আবার চেষ্টা
+    with open(part_path, 'rb') as fh:
+        fcntl.flock(fh, fcntl.LOCK_SH)
+        return field.storage.save(name, File(fh, name=name))
@@ -11,6 +11,11 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('private/<int:target_user_id>/', views.private_chat_view, name='private_chat'),
     path('search/<str:room_id>/', views.search_messages, name='search_messages'),
+    path('history/<str:room_id>/', views.history, name='history'),
+    path('inbox/', views.inbox, name='inbox'),
+    path('private/', views.private_chat_by_username, name='private_chat_by_username'),
+    path('uploads/', views.upload_start, name='upload_start'),
+    path('uploads/<str:upload_id>/', views.upload_chunk, name='upload_chunk'),
     path('<str:room_name>/', views.room, name='room'), 
     
 ]
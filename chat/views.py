@@ -1,44 +1,84 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from .models import Message, PrivateChatRoom, PrivateMessage
-from django.db.models import Q
+from .models import PrivateChatRoom
 from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods, require_POST
+from .history import PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, fetch_history, serialize_message
+from .cache import get_private_room
+from .search import get_search_backend
+from .recent import recent_messages
+from .inbox import PAGE_SIZE as INBOX_PAGE_SIZE, inbox_page, serialize_conversation
+from .uploads import UploadError, create_upload, load_upload, make_token, received_bytes, write_chunk
+import json
 
 
 def search_messages(request, room_id): # নাম একটু জেনেরিক করলাম
     query = request.GET.get('q', '').strip()
     if not query:
         return JsonResponse({'results': []})
-    
-    # রুমের নামের শুরুতে 'private_' থাকলে সেটি প্রাইভেট চ্যাট
-    if room_id.startswith('private_'):
-        messages = PrivateMessage.objects.filter(
-            room__room_id=room_id # room_id নয়, room__room_id (মডেলের ফিল্ড নাম অনুযায়ী)
-        ).filter(
-            Q(content__icontains=query) | Q(sender__username__icontains=query)
-        ).order_by('-timestamp')[:20]
-    else:
-        # এটি পাবলিক রুমের জন্য
-        messages = Message.objects.filter(
-            room_name=room_id
-        ).filter(
-            Q(content__icontains=query) | Q(user__username__icontains=query)
-        ).order_by('-timestamp')[:20]
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    # Postgres/SQLite full-text ইনডেক্স (অথবা ইন-মেমরি ইনডেক্স), LIKE স্ক্যান নয়
+    messages, has_more = get_search_backend().search(room_id, query, page=page)
 
     results = []
     for msg in messages:
         # মডেল ভেদে ইউজার ফিল্ডের নাম আলাদা হতে পারে (sender vs user)
         sender_name = msg.sender.username if hasattr(msg, 'sender') else msg.user.username
         results.append({
+            'message_id': msg.id,
             'sender': sender_name,
             'content': msg.content,
             'timestamp': msg.timestamp.strftime('%H:%M %p'),
         })
 
-    return JsonResponse({'results': results})
+    return JsonResponse({'results': results, 'page': page, 'has_more': has_more})
+
+# চাংকড আপলোড: বড় ফাইল আর base64 হয়ে WebSocket দিয়ে যায় না
+@login_required
+@require_POST
+def upload_start(request):
+   try:
+      data = json.loads(request.body or '{}')
+      upload = create_upload(
+         request.user.id, data.get('file_name'), data.get('kind'), int(data.get('size', 0))
+      )
+   except (ValueError, UploadError) as e:
+      return JsonResponse({'error': str(e)}, status=400)
+   return JsonResponse({
+      'upload_id': upload['id'],
+      'offset': 0,
+      'chunk_size': settings.CHAT_UPLOAD_CHUNK_SIZE,
+   }, status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PUT'])
+def upload_chunk(request, upload_id):
+   upload = load_upload(upload_id)
+   if upload is None or upload['user_id'] != request.user.id:
+      return JsonResponse({'error': 'Unknown upload.'}, status=404)
+
+   if request.method == 'GET':
+      offset = received_bytes(upload)
+   else:
+      try:
+         offset = write_chunk(upload, int(request.headers.get('Upload-Offset', -1)), request)
+      except (ValueError, UploadError) as e:
+         return JsonResponse({'error': str(e), 'offset': received_bytes(upload)}, status=409)
+
+   response = {'upload_id': upload_id, 'offset': offset, 'size': upload['size']}
+   if offset == upload['size']:
+      response['upload_token'] = make_token(upload)
+   return JsonResponse(response)
+
 
 def get_or_create_private_room(u1, u2):
    user_ids = sorted([u1.id, u2.id])
@@ -63,18 +103,69 @@ def signup(request):
    return render(request, 'chat/signup.html', {'form': form})
 
 
+# ইনবক্স: সব ইউজার নয়, শুধু নিজের কনভারসেশন (একটাই ইনডেক্সড কোয়েরি)
 @login_required
 def index(request):
-   all_users = User.objects.exclude(id=request.user.id)
-   return render(request, 'chat/index.html', {'all_users': all_users})
+   conversations, next_cursor = inbox_page(request.user.id)
+   return render(request, 'chat/index.html', {'conversations': conversations, 'next_cursor': next_cursor or ''})
+
 
+@login_required
+def inbox(request):
+   try:
+      limit = min(int(request.GET.get('limit', INBOX_PAGE_SIZE)), MAX_PAGE_SIZE)
+      conversations, next_cursor = inbox_page(request.user.id, request.GET.get('cursor'), max(limit, 1))
+   except ValueError as e:
+      return JsonResponse({'error': str(e)}, status=400)
+   return JsonResponse({
+      'conversations': [serialize_conversation(c) for c in conversations],
+      'next': next_cursor,
+   })
+
+
+# নতুন প্রাইভেট চ্যাট ইউজারনেম দিয়ে, ইনবক্সে সবার লিস্ট আর নেই
+@login_required
+def private_chat_by_username(request):
+   target_user = get_object_or_404(User, username=request.GET.get('username', '').strip())
+   return redirect('private_chat', target_user_id=target_user.id)
+
+# পুরনো মেসেজ লোড (keyset pagination, নতুন থেকে পুরনো)
+@login_required
+def history(request, room_id):
+   if room_id.startswith('private_'):
+      room = get_private_room(room_id)
+      if room is None or request.user.id not in (room.user1_id, room.user2_id):
+         return JsonResponse({'error': 'Unknown room.'}, status=404)
+
+   try:
+      limit = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+      messages, has_more = fetch_history(
+         room_id,
+         before=request.GET.get('before'),
+         after=request.GET.get('after'),
+         limit=max(limit, 1),
+      )
+   except ValueError as e:
+      return JsonResponse({'error': str(e)}, status=400)
+
+   return JsonResponse({
+      'messages': [serialize_message(msg) for msg in messages],
+      'has_more': has_more,
+      'before': encode_cursor(messages[-1]) if messages else None,
+      'after': encode_cursor(messages[0]) if messages else None,
+   })
+
+
+# হট রুমের শেষ মেসেজগুলো মেমরি থেকে, ডাটাবেসে যায় শুধু প্রথমবার
 @login_required
 def room(request, room_name):
 
-   message = Message.objects.filter(room_name=room_name,).order_by('timestamp')[:50]
+   messages, has_more = recent_messages.page(room_name)
+   messages.reverse()
    return render(request, 'chat/room.html', {
       'room_name': room_name,
-      'messages': message
+      'messages': messages,
+      'history_cursor': encode_cursor(messages[0]) if has_more else '',
       })
 
 
@@ -83,15 +174,17 @@ def private_chat_view(request, target_user_id):
    target_user = get_object_or_404(User, id=target_user_id)
    room = get_or_create_private_room(request.user, target_user)
 
-   all_users = User.objects.exclude(id=request.user.id)
+   conversations, _ = inbox_page(request.user.id)
 
-   messages = room.private_messages.all().order_by('timestamp')[:50]
+   messages, has_more = recent_messages.page(room.room_id)
+   messages.reverse()
 
    return render(request, 'chat/private_room.html', {
       'room': room,
       'target_user': target_user,
       'messages': messages,
-      'all_users': all_users,
+      'history_cursor': encode_cursor(messages[0]) if has_more else '',
+      'conversations': conversations,
       'room_name': room.room_id
    })
 
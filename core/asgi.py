@@ -7,12 +7,12 @@ os.environ.setdefault ('DJANGO_SETTINGS_MODULE', 'core.settings')
 application = get_asgi_application()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from chat.auth import CachedAuthMiddlewareStack
 import chat.routing
 
 application = ProtocolTypeRouter({
    "http": get_asgi_application(),
-   "websocket": AuthMiddlewareStack(
+   "websocket": CachedAuthMiddlewareStack(
       URLRouter(
          chat.routing.websocket_urlpatterns
       )
@@ -0,0 +1,83 @@
+"""
+daphne with permessage-deflate and write backpressure. Daphne never hands
+compression options to autobahn, so this wraps its WebSocket factory and
+server and then runs the normal daphne command line:
+
+    python -m core.serve -b 0.0.0.0 -p $PORT core.asgi:application
+
+Neither side keeps a compression context between messages, which bounds
+the per-connection memory to one message's worth of zlib state.
+
+Daphne's send() returns as soon as Twisted has buffered the frame, so on
+its own a client that stops reading just grows that buffer. Each socket
+registers as the streaming producer of its transport: Twisted pauses it
+when the write buffer is full and resumes it once drained, and the
+``chat.drained`` scope extension lets the consumer's outbound queue wait
+for that instead of writing on.
+"""
+import asyncio
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne import server
+from daphne.cli import CommandLineInterface
+from daphne.ws_protocol import WebSocketProtocol
+
+
+def accept_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(
+                offer,
+                request_no_context_takeover=offer.accept_no_context_takeover,
+                no_context_takeover=True,
+            )
+    return None
+
+
+class BackpressureWebSocketProtocol(WebSocketProtocol):
+    def connectionMade(self):
+        self.writable = asyncio.Event()
+        self.writable.set()
+        super().connectionMade()
+        # আপগ্রেডের পরেও HTTP চ্যানেলটা ট্রান্সপোর্টের producer হয়ে থাকে
+        if getattr(self.transport, 'producer', None) is not None:
+            self.transport.unregisterProducer()
+        self.transport.registerProducer(self, True)
+
+    # IPushProducer: Twisted calls these as the transport's write buffer fills and drains
+    def pauseProducing(self):
+        self.writable.clear()
+
+    def resumeProducing(self):
+        self.writable.set()
+
+    def stopProducing(self):
+        self.writable.set()
+
+    async def drained(self):
+        await self.writable.wait()
+
+
+class DeflateWebSocketFactory(server.WebSocketFactory):
+    protocol = BackpressureWebSocketProtocol
+
+    def setProtocolOptions(self, **options):
+        options.setdefault('perMessageCompressionAccept', accept_deflate)
+        super().setProtocolOptions(**options)
+
+
+class BackpressureServer(server.Server):
+    def create_application(self, protocol, scope):
+        if isinstance(protocol, BackpressureWebSocketProtocol):
+            scope.setdefault('extensions', {})['chat.drained'] = protocol.drained
+        return super().create_application(protocol, scope)
+
+
+def main():
+    server.WebSocketFactory = DeflateWebSocketFactory
+    CommandLineInterface.server_class = BackpressureServer
+    CommandLineInterface.entrypoint()
+
+
+if __name__ == '__main__':
+    main()
@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -65,24 +66,151 @@ TEMPLATES = [
 WSGI_APPLICATION = 'core.wsgi.application'
 ASGI_APPLICATION = 'core.asgi.application'
 
-# Upstash Redis or RedisURL
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [os.getenv('REDIS_URL')], 
+# Upstash Redis or RedisURL (in-memory layer for local runs and tests).
+# REDIS_URLS (comma separated) spreads channels and groups over several hosts by consistent hashing.
+REDIS_HOSTS = [url for url in os.getenv('REDIS_URLS', os.getenv('REDIS_URL', '')).split(',') if url]
+if REDIS_HOSTS:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": REDIS_HOSTS,
+                # a relay channel (CHAT_LOCAL_FANOUT) carries a whole room's events for its worker
+                "channel_capacity": {"fanout.*": int(os.getenv('CHAT_FANOUT_CHANNEL_CAPACITY', '10000'))},
+            },
         },
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+
+# Large rooms: split each room group into this many sub-groups (same value on every worker),
+# and/or join groups once per worker process and fan out to its sockets locally
+CHAT_GROUP_SHARDS = int(os.getenv('CHAT_GROUP_SHARDS', '1'))
+CHAT_LOCAL_FANOUT = os.getenv('CHAT_LOCAL_FANOUT', 'False') == 'True'
+
+# Presence: seconds before a socket that stopped heartbeating is dropped
+CHAT_PRESENCE_TTL = int(os.getenv('CHAT_PRESENCE_TTL', '60'))
+CHAT_PRESENCE_HEARTBEAT = int(os.getenv('CHAT_PRESENCE_HEARTBEAT', '20'))
+
+# Process-wide LRU of private room rows shared by all consumers
+CHAT_ROOM_CACHE_SIZE = int(os.getenv('CHAT_ROOM_CACHE_SIZE', '10000'))
+
+# WebSocket handshakes: seconds a session's user stays cached per process (0 queries the database every time)
+CHAT_AUTH_CACHE_TTL = float(os.getenv('CHAT_AUTH_CACHE_TTL', '30'))
+CHAT_AUTH_CACHE_SIZE = int(os.getenv('CHAT_AUTH_CACHE_SIZE', '10000'))
+
+# Chunked media uploads (streamed to disk, referenced from the socket by token)
+CHAT_UPLOAD_DIR = os.getenv('CHAT_UPLOAD_DIR', os.path.join(BASE_DIR, 'var', 'uploads'))
+CHAT_UPLOAD_MAX_SIZE = int(os.getenv('CHAT_UPLOAD_MAX_SIZE', str(25 * 1024 * 1024)))
+CHAT_UPLOAD_CHUNK_SIZE = int(os.getenv('CHAT_UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+CHAT_UPLOAD_TOKEN_MAX_AGE = int(os.getenv('CHAT_UPLOAD_TOKEN_MAX_AGE', '3600'))
+CHAT_STORAGE_WORKERS = int(os.getenv('CHAT_STORAGE_WORKERS', '4'))
+
+# Threads (and connections) per worker for consumer database calls; 0 keeps them all on
+# asgiref's single shared thread, which is what SQLite wants
+CHAT_DB_THREADS = int(os.getenv('CHAT_DB_THREADS', '0'))
+
+# Online status: seconds between batched writes, and before a user whose last socket closed shows offline
+CHAT_STATUS_FLUSH_INTERVAL = float(os.getenv('CHAT_STATUS_FLUSH_INTERVAL', '2'))
+CHAT_STATUS_OFFLINE_GRACE = float(os.getenv('CHAT_STATUS_OFFLINE_GRACE', '10'))
+
+# Conversation inbox: seconds between batched writes of last messages and unread counts
+CHAT_INBOX_FLUSH_INTERVAL = float(os.getenv('CHAT_INBOX_FLUSH_INTERVAL', '1'))
+
+# Background media processing (chat.media): backend class, worker threads, image sizes in pixels, ffmpeg binary ('' to skip)
+CHAT_MEDIA_BACKEND = os.getenv('CHAT_MEDIA_BACKEND', 'chat.media.ThreadPoolBackend')
+CHAT_MEDIA_WORKERS = int(os.getenv('CHAT_MEDIA_WORKERS', '2'))
+CHAT_MEDIA_DISPLAY_SIZE = int(os.getenv('CHAT_MEDIA_DISPLAY_SIZE', '1600'))
+CHAT_MEDIA_THUMBNAIL_SIZE = int(os.getenv('CHAT_MEDIA_THUMBNAIL_SIZE', '320'))
+CHAT_MEDIA_FFMPEG = os.getenv('CHAT_MEDIA_FFMPEG', 'ffmpeg')
+
+# Message retention (chat.archive): days kept in the tables (0 = forever, RoomRetention overrides per room),
+# archive directory and messages per archive segment
+CHAT_RETENTION_DAYS = int(os.getenv('CHAT_RETENTION_DAYS', '0'))
+CHAT_ARCHIVE_DIR = os.getenv('CHAT_ARCHIVE_DIR', os.path.join(BASE_DIR, 'var', 'archive'))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv('CHAT_ARCHIVE_BATCH_SIZE', '1000'))
+
+# Unique per daphne process (snowflake ids, write-behind journal directory)
+CHAT_WORKER_ID = int(os.getenv('CHAT_WORKER_ID', '0'))
+
+# Write-behind: broadcast text messages first, persist them in batches
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', 'False') == 'True'
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('CHAT_WRITE_BEHIND_BATCH_SIZE', '200'))
+CHAT_WRITE_BEHIND_INTERVAL = float(os.getenv('CHAT_WRITE_BEHIND_INTERVAL', '0.05'))
+CHAT_WRITE_BEHIND_FSYNC = os.getenv('CHAT_WRITE_BEHIND_FSYNC', 'False') == 'True'
+CHAT_WRITE_BEHIND_JOURNAL_DIR = os.getenv('CHAT_WRITE_BEHIND_JOURNAL_DIR', os.path.join(BASE_DIR, 'var', 'journal'))
+
+# Read receipts arriving within this many seconds are written and broadcast as one
+CHAT_READ_RECEIPT_WINDOW = float(os.getenv('CHAT_READ_RECEIPT_WINDOW', '0.25'))
+
+# Typing indicator: seconds without a keystroke before 'stop' (also the refresh interval)
+CHAT_TYPING_IDLE = float(os.getenv('CHAT_TYPING_IDLE', '3'))
+
+# WebSocket subprotocols offered to clients (see chat/protocol.py); JSON without one always works
+CHAT_WS_PROTOCOLS = os.getenv('CHAT_WS_PROTOCOLS', 'chat.v1.msgpack,chat.v1.cbor,chat.v1.json').split(',')
+
+# Frames buffered per socket before typing/ephemeral are dropped and, failing that, a slow client is closed
+CHAT_OUTBOUND_QUEUE_SIZE = int(os.getenv('CHAT_OUTBOUND_QUEUE_SIZE', '256'))
+
+# Rooms one multiplexed socket (ws/mux/) may subscribe to
+CHAT_MUX_MAX_ROOMS = int(os.getenv('CHAT_MUX_MAX_ROOMS', '50'))
+
+# Newest messages cached per recently viewed room for room pages, and how many seconds a
+# loaded room is trusted before it is reloaded (messages saved by other workers show up then)
+CHAT_RECENT_CACHE_SIZE = int(os.getenv('CHAT_RECENT_CACHE_SIZE', '50'))
+CHAT_RECENT_CACHE_TTL = float(os.getenv('CHAT_RECENT_CACHE_TTL', '5'))
+
+# Reconnect replay: chat messages kept per room, and the most a reconnecting socket is sent
+CHAT_REPLAY_BUFFER_SIZE = int(os.getenv('CHAT_REPLAY_BUFFER_SIZE', '100'))
+CHAT_REPLAY_LIMIT = int(os.getenv('CHAT_REPLAY_LIMIT', '100'))
+
+# Message search: dotted path to a chat.search backend, empty picks one for the database
+CHAT_SEARCH_BACKEND = os.getenv('CHAT_SEARCH_BACKEND', '')
+
+# /metrics (Prometheus text): when set, scrapers must send 'Authorization: Bearer <token>'
+CHAT_METRICS_TOKEN = os.getenv('CHAT_METRICS_TOKEN', '')
+
+# Development only: any request with ?profile returns its cProfile stats instead of the page
+CHAT_PROFILE_REQUESTS = os.getenv('CHAT_PROFILE_REQUESTS', 'False') == 'True'
 
 # Database PostgreSQL)
 DATABASES = {
     'default': dj_database_url.config(
-        default=os.getenv('DATABASE_URL'),
+        default=os.getenv('DATABASE_URL', f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
         conn_max_age=600
     )
 }
 
+# PostgreSQL connection pool (psycopg 3): with CHAT_DB_POOL_MAX set, a worker holds at most that
+# many connections, shared by every thread and returned after each request or consumer call
+CHAT_DB_POOL_MIN = int(os.getenv('CHAT_DB_POOL_MIN', '2'))
+CHAT_DB_POOL_MAX = int(os.getenv('CHAT_DB_POOL_MAX', '0'))
+CHAT_DB_POOL_TIMEOUT = float(os.getenv('CHAT_DB_POOL_TIMEOUT', '10'))
+# Server-side prepared statements after this many runs of a query (not behind pgbouncer in transaction mode)
+CHAT_DB_PREPARE_THRESHOLD = int(os.getenv('CHAT_DB_PREPARE_THRESHOLD', '0'))
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    options = DATABASES['default'].setdefault('OPTIONS', {})
+    if CHAT_DB_POOL_MAX:
+        from psycopg_pool import ConnectionPool
+
+        # the pool replaces persistent per-thread connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        options['pool'] = {
+            'min_size': min(CHAT_DB_POOL_MIN, CHAT_DB_POOL_MAX),
+            'max_size': CHAT_DB_POOL_MAX,
+            'timeout': CHAT_DB_POOL_TIMEOUT,
+            # a connection is checked before it is handed out, dead ones are replaced
+            'check': ConnectionPool.check_connection,
+        }
+    if CHAT_DB_PREPARE_THRESHOLD:
+        options['server_side_binding'] = True
+        options['prepare_threshold'] = CHAT_DB_PREPARE_THRESHOLD
+
 # Password validators (default Django validators)
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},